@@ -0,0 +1,85 @@
+"""Time the snapshot strategies against each other on the loaded tables"""
+import time
+import click
+
+from .shared import connections, metrics
+from .shared.snapshot import SNAPSHOT_VIEWS, STRATEGIES, snapshot_query
+
+BASELINE = 'correlated'
+
+
+def _differences(cursor, first, second):
+    """The rows that are in one of two tables and not the other"""
+    cursor.execute(
+        'SELECT count(*) FROM ((TABLE {0} EXCEPT ALL TABLE {1}) UNION ALL '
+        '(TABLE {1} EXCEPT ALL TABLE {0})) AS differences'.format(
+            first, second))
+    return cursor.fetchone()[0]
+
+
+@click.command()
+@click.option('--strategy', 'strategies', multiple=True,
+              type=click.Choice(list(STRATEGIES)),
+              help='A strategy to time; all of them by default. The first '
+                   'is the baseline that the others are compared to.')
+@click.option('--view', 'views', multiple=True,
+              type=click.Choice(list(SNAPSHOT_VIEWS)),
+              help='A snapshot view to build; all of them by default.')
+@click.option('--snapshot-date', type=click.DateTime(['%Y%m%d', '%Y-%m-%d']),
+              default=None, help='Build the snapshots as of this date.')
+@click.option('--repeat', type=int, default=1, show_default=True,
+              help='Build each snapshot this many times; the fastest '
+                   'time counts.')
+def benchmark_snapshot(strategies, views, snapshot_date, repeat):
+    """Build the snapshots of the loaded Full tables with each strategy
+
+    Each snapshot is built into a temporary table, timed, and compared
+    row for row with the baseline's; nothing in the database is changed.
+    """
+    strategies = strategies or [BASELINE] + [
+        strategy for strategy in STRATEGIES if strategy != BASELINE]
+    snapshot_date = snapshot_date.date() if snapshot_date else None
+    conn = connections.connect('snapshot')
+    cursor = conn.cursor()
+    different = 0
+    click.echo('{:<56} {:>10} {}'.format('view', 'rows', '  '.join(
+        '{:>22}'.format(strategy) for strategy in strategies)))
+    for view in views or SNAPSHOT_VIEWS:
+        table_name = SNAPSHOT_VIEWS[view]
+        columns = []
+        for strategy in strategies:
+            fastest = None
+            for _ in range(max(1, repeat)):
+                cursor.execute(
+                    'DROP TABLE IF EXISTS pg_temp.snapshot_{}'.format(
+                        strategy))
+                with metrics.stage(
+                        'benchmark_snapshot/{}/{}'.format(view, strategy),
+                        strategy=strategy) as stage:
+                    start_time = time.time()
+                    cursor.execute(
+                        'CREATE TEMPORARY TABLE snapshot_{} AS {}'.format(
+                            strategy, snapshot_query(
+                                table_name, strategy, snapshot_date)))
+                    seconds = time.time() - start_time
+                    stage.rows = rows = cursor.rowcount
+                fastest = min(fastest or seconds, seconds)
+            baseline = columns[0][0] if columns else fastest
+            differences = _differences(
+                cursor, 'snapshot_' + strategies[0], 'snapshot_' + strategy)
+            different += differences
+            columns.append((fastest, '{:>8.2f}s {:>5.1f}x {:>5}'.format(
+                fastest, baseline / fastest if fastest else 1.0,
+                'DIFF' if differences else 'same')))
+        conn.rollback()
+        click.echo('{:<56} {:>10,} {}'.format(
+            view, rows, '  '.join(column for _, column in columns)))
+    conn.close()
+    if different:
+        raise click.ClickException(
+            '{} rows differ from the {} snapshots'.format(
+                different, strategies[0]))
+
+
+if __name__ == '__main__':
+    benchmark_snapshot()
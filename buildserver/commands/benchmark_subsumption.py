@@ -0,0 +1,149 @@
+"""Time concept_subsumption and the expanded hierarchy views against the
+per-concept SQL that they replaced, and check that they have the same rows"""
+import os
+import time
+import click
+
+from sil_snomed_server.config.config import basedir
+from .shared import connections, metrics, sql_script
+
+SQL_SCRIPT = os.path.join(
+    basedir, 'migrations/sql/denormalized_concepts_descriptions_refsets.sql')
+RELATIONS = ['parents', 'children', 'ancestors', 'descendants']
+
+# concept_subsumption as it was: four correlated subqueries per concept
+LEGACY_SUBSUMPTION = """
+SELECT
+    concept.id,
+    ARRAY(SELECT destination_id FROM current_relationship_snapshot
+        WHERE source_id = concept.id AND type_id = 116680003
+        AND active=true) AS parents,
+    ARRAY(SELECT supertype_id FROM single_snapshot_transitive_closure
+        WHERE subtype_id = concept.id) AS ancestors,
+    ARRAY(SELECT source_id FROM current_relationship_snapshot
+        WHERE destination_id = concept.id AND type_id = 116680003
+        AND active=true) AS children,
+    ARRAY(SELECT subtype_id FROM single_snapshot_transitive_closure
+        WHERE supertype_id = concept.id) AS descendants
+FROM current_concept_snapshot concept
+"""
+# ...and extract_expanded_concepts_for_<relation>, which appended one
+# expand_concept() at a time
+LEGACY_EXPAND = """
+CREATE FUNCTION pg_temp.legacy_expanded_{0}(concept_id bigint)
+RETURNS expanded_concept[] AS $$
+  DECLARE
+    related bigint[];
+    other bigint;
+    expanded_concepts expanded_concept[];
+  BEGIN
+    related := (SELECT {0} FROM legacy_subsumption WHERE id = concept_id);
+    FOREACH other IN ARRAY related LOOP
+      expanded_concepts := expanded_concepts || expand_concept(other);
+    END LOOP;
+    RETURN expanded_concepts;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def _timed(cursor, name, query):
+    """Build a temporary table from query; return the seconds it took"""
+    with metrics.stage('benchmark_subsumption/' + name) as stage:
+        start_time = time.time()
+        cursor.execute('CREATE TEMPORARY TABLE {} AS {}'.format(name, query))
+        stage.rows = cursor.rowcount
+    return time.time() - start_time
+
+
+def _differences(cursor, first, second, key, array):
+    """The (key, element) pairs that are in one array column and not the
+    other; the elements may be in any order"""
+    cursor.execute(
+        'SELECT count(*) FROM ('
+        '(SELECT {2}, unnest({3}) FROM {0} EXCEPT ALL '
+        ' SELECT {2}, unnest({3}) FROM {1}) UNION ALL '
+        '(SELECT {2}, unnest({3}) FROM {1} EXCEPT ALL '
+        ' SELECT {2}, unnest({3}) FROM {0})) AS differences'.format(
+            first, second, key, array))
+    return cursor.fetchone()[0]
+
+
+def _report(name, legacy_seconds, seconds, differences):
+    click.echo('{:<30} {:>9.2f}s {:>9.2f}s {:>6.1f}x {:>5}'.format(
+        name, legacy_seconds, seconds,
+        legacy_seconds / seconds if seconds else 1.0,
+        'DIFF' if differences else 'same'))
+
+
+@click.command()
+def benchmark_subsumption():
+    """Build concept_subsumption and concept_expanded_* both ways
+
+    They are built into temporary tables from the queries in
+    denormalized_concepts_descriptions_refsets.sql and from the per-concept
+    SQL that it used to have, timed, and compared element by element;
+    nothing in the database is changed. It needs the denormalized views
+    that they read, e.g. concept_preferred_terms.
+    """
+    with open(SQL_SCRIPT, 'r') as script:
+        statements = sql_script.parse_script(script.read())
+    conn = connections.connect('denormalization')
+    conn.autocommit = False
+    cursor = conn.cursor()
+    different = 0
+    click.echo('{:<30} {:>10} {:>10} {:>7} {:>5}'.format(
+        'view', 'before', 'after', '', ''))
+    try:
+        legacy_seconds = _timed(cursor, 'legacy_subsumption',
+                                LEGACY_SUBSUMPTION)
+        seconds = _timed(cursor, 'new_subsumption', sql_script.view_query(
+            statements, 'concept_subsumption'))
+        differences = sum(
+            _differences(cursor, 'legacy_subsumption', 'new_subsumption',
+                         'id', relation) for relation in RELATIONS)
+        cursor.execute(
+            'SELECT count(*) FROM ((SELECT id FROM legacy_subsumption '
+            'EXCEPT ALL SELECT id FROM new_subsumption) UNION ALL '
+            '(SELECT id FROM new_subsumption EXCEPT ALL '
+            'SELECT id FROM legacy_subsumption)) AS differences')
+        differences += cursor.fetchone()[0]
+        different += differences
+        _report('concept_subsumption', legacy_seconds, seconds, differences)
+
+        for relation in RELATIONS:
+            cursor.execute(LEGACY_EXPAND.format(relation))
+            legacy = 'legacy_expanded_' + relation
+            new = 'new_expanded_' + relation
+            # The per-concept functions give NULL where the views have no row
+            legacy_seconds = _timed(cursor, legacy, (
+                'SELECT * FROM (SELECT id AS concept_id, '
+                'pg_temp.legacy_expanded_{}(id) AS concepts '
+                'FROM current_concept_snapshot) AS expanded '
+                'WHERE concepts IS NOT NULL').format(relation))
+            seconds = _timed(cursor, new, (
+                'SELECT expanded.* FROM ({}) AS expanded JOIN '
+                'current_concept_snapshot concept '
+                'ON concept.id = expanded.concept_id').format(
+                    sql_script.view_query(
+                        statements, 'concept_expanded_' + relation)))
+            differences = _differences(
+                cursor, legacy, new, 'concept_id', 'concepts')
+            cursor.execute(
+                'SELECT (SELECT count(*) FROM {}) - (SELECT count(*) FROM {})'
+                .format(legacy, new))
+            differences += abs(cursor.fetchone()[0])
+            different += differences
+            _report('concept_expanded_' + relation, legacy_seconds, seconds,
+                    differences)
+    finally:
+        conn.rollback()
+        conn.close()
+    if different:
+        raise click.ClickException(
+            '{} rows or elements differ from the per-concept SQL'.format(
+                different))
+
+
+if __name__ == '__main__':
+    benchmark_subsumption()
@@ -0,0 +1,76 @@
+"""Collect the per-stage metrics of a build into a JSON report"""
+import os
+import re
+import subprocess
+import sys
+import click
+
+from .shared import metrics
+
+# The command tags that psql prints for each statement, e.g. "COPY 1234"
+ROW_COUNT_PATTERN = re.compile(
+    r'^(?:COPY|SELECT|INSERT \d+|UPDATE|DELETE) (\d+)$')
+
+
+def _folder_size(folder):
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for path, _, names in os.walk(folder) for name in names)
+
+
+@click.group()
+def build_metrics():
+    """Measure the stages of a build, and report on them"""
+
+
+@build_metrics.command()
+def reset():
+    """Forget the stages of the previous build"""
+    metrics.reset()
+
+
+@build_metrics.command(context_settings={'ignore_unknown_options': True})
+@click.argument('stage_name')
+@click.argument('command', nargs=-1, required=True, type=click.UNPROCESSED)
+@click.option('--output-folder', type=click.Path(),
+              help='Count the bytes that the stage writes to this folder.')
+def run(stage_name, command, output_folder):
+    """Run COMMAND (e.g. psql) as the stage STAGE_NAME
+
+    Its output is passed through; the row counts that psql prints for each
+    statement are added up.
+    """
+    size_before = _folder_size(output_folder) if output_folder else None
+    with metrics.stage(stage_name, command=' '.join(command)) as stage:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, universal_newlines=True)
+        rows = 0
+        for line in process.stdout:
+            sys.stdout.write(line)
+            match = ROW_COUNT_PATTERN.match(line.strip())
+            if match:
+                rows += int(match.group(1))
+        stage.rows = rows
+        if process.wait() != 0:
+            raise click.ClickException(
+                '{} exited with {}'.format(command[0], process.returncode))
+        if output_folder:
+            stage.bytes_out = _folder_size(output_folder) - size_before
+
+
+@build_metrics.command()
+@click.option('--output', type=click.Path(), default=metrics.REPORT_FILE,
+              show_default=True)
+def report(output):
+    """Write the JSON build report"""
+    summary = metrics.write_report(output)
+    for group, totals in summary['groups'].items():
+        failed = totals['failed']
+        click.echo('{:<24} {:>4} stages {:>10.1f}s {:>12} rows{}'.format(
+            group, totals['stages'], totals.get('wall_seconds', 0),
+            totals.get('rows') or 0,
+            ', {} FAILED'.format(failed) if failed else ''))
+
+
+if __name__ == '__main__':
+    build_metrics()
@@ -0,0 +1,30 @@
+"""Write the memory-mappable concept lookup file of the build"""
+import click
+
+from .shared import connections, lookup, metrics
+
+
+@click.command()
+@click.option('--output', required=True, type=click.Path(dir_okay=False),
+              help='Where to write the file, e.g. in final_build_data')
+def concept_lookup(output):
+    """Write the concepts, their preferred terms, FSNs and active
+    descriptions to OUTPUT
+
+    See commands/shared/lookup_reader.py, which reads it.
+    """
+    conn = connections.connect('export')
+    conn.autocommit = False
+    try:
+        with metrics.stage('export/concept_lookup') as stage:
+            built = lookup.read_lookup(conn)
+            stage.rows = len(built.ids)
+            stage.bytes_out = lookup.write_lookup(built, output)
+    finally:
+        conn.close()
+    click.echo('{:,} concepts, {:,} descriptions: {:,} bytes'.format(
+        len(built.ids), len(built.description_ids), stage.bytes_out))
+
+
+if __name__ == '__main__':
+    concept_lookup()
@@ -11,7 +11,13 @@ import click
 
 from itertools import groupby
 from urllib3.exceptions import MaxRetryError
-from sil_snomed_server.config import config
+from .shared import metrics
+from .shared.discover import (
+    FILE_PATTERNS,
+    RELEASE_PATTERN,
+    SOURCE_FOLDER,
+    CONTENT_FOLDER,
+)
 
 logging.captureWarnings(True)
 
@@ -21,10 +27,8 @@ DROPBOX_APP_KEY = os.environ.get("DROPBOX_APP_KEY", "")
 DROPBOX_APP_SECRET = os.environ.get("DROPBOX_APP_SECRET", "")
 DROPBOX_ACCESS_TOKEN = os.environ.get("DROPBOX_ACCESS_TOKEN", "")
 
-WORKING_FOLDER = os.path.join(config.basedir, "data/source_terminology_data")
-EXTRACT_WORKING_FOLDER = os.path.join(
-    config.basedir, "data/extracted_terminology_data"
-)
+WORKING_FOLDER = SOURCE_FOLDER
+EXTRACT_WORKING_FOLDER = CONTENT_FOLDER
 METADATA_FILE = os.path.join(WORKING_FOLDER, "metadata.json")
 
 LOGGER = logging.getLogger(__name__)
@@ -36,59 +40,6 @@ if not os.path.exists(EXTRACT_WORKING_FOLDER):
     os.makedirs(EXTRACT_WORKING_FOLDER)
 
 
-FILE_PATTERNS = {
-    "concepts": re.compile(r"^.*sct2_Concept_.+txt$"),
-    "descriptions": re.compile(r"^.*sct2_Description_.+txt$"),
-    "relationships": re.compile(r"^.*sct2_Relationship_.+txt$"),
-    "text_definitions": re.compile(r"^.*sct2_TextDefinition_.+txt$"),
-    "identifiers": re.compile(r"^.*sct2_Identifier_.+txt$"),
-    "stated_relationships": re.compile(r"^.*sct2_StatedRelationship_.+txt$"),
-    "simple_reference_sets": re.compile(r"^.*der2_.*Refset.+SimpleFull.+txt$"),
-    "ordered_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+OrderedFull.+txt$"
-    ),
-    "attribute_value_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+AttributeValueFull.+txt$"
-    ),
-    "simple_map_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+SimpleMapFull.+txt$"
-    ),
-    "complex_map_int_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+ComplexMapFull_INT.+txt$"
-    ),
-    "complex_map_gb_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+ComplexMapFull_GB.+txt$"
-    ),
-    "extended_map_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+ExtendedMapFull.+txt$"
-    ),
-    "language_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+LanguageFull.+txt$"
-    ),
-    "query_specification_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+QuerySpecificationFull.+txt$"
-    ),
-    "annotation_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+AnnotationFull.+txt$"
-    ),
-    "association_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+AssociationReferenceFull.+txt$"
-    ),
-    "module_dependency_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+ModuleDependencyFull.+txt$"
-    ),
-    "description_format_reference_sets": re.compile(
-        r"^.*der2_.*Refset.+DescriptionFormatFull.+txt$"
-    ),
-    "refset_descriptor_reference_sets": re.compile(
-        r"^.*der2_.*Refset.*RefsetDescriptorFull.+txt$"
-    ),
-    "description_type_reference_sets": re.compile(
-        r"^.*der2_.*Refset.*DescriptionTypeFull.+txt$"
-    ),
-}
-
-
 class DropboxData(object):
     """The SNOMED content is too large to be distributed via GIT"""
 
@@ -130,7 +81,9 @@ class DropboxData(object):
         try:
             new_file_name = os.path.basename(file_path)
             new_file_path = os.path.join(WORKING_FOLDER, new_file_name)
-            self.client.files_download_to_file(new_file_path, file_path)
+            with metrics.stage("download", source=file_path) as stage:
+                self.client.files_download_to_file(new_file_path, file_path)
+                stage.bytes_out = os.path.getsize(new_file_path)
 
             LOGGER.info("Downloaded %s from Dropbox" % new_file_path)
         except:
@@ -181,10 +134,12 @@ class DropboxData(object):
         if not self.stored_metadata:
             LOGGER.info("No stored metadata; assumed to be a new installation")
             return True  # We assume that it is a new installation
-        elif os.listdir(EXTRACT_WORKING_FOLDER) == []:
+        elif not any(
+            name.endswith(".zip") for name in os.listdir(WORKING_FOLDER)
+        ):
             LOGGER.info(
-                "The dest folder - %s - is empty, downloading/extracting"
-                % EXTRACT_WORKING_FOLDER
+                "The source folder - %s - has no release zips, downloading"
+                % WORKING_FOLDER
             )
             return True
         else:
@@ -226,8 +181,7 @@ class DropboxData(object):
 
     def save_zip_entry(self, zipfile, zip_entry):
         """Extract the entry to the correct location"""
-        release_pattern = re.compile(r"(.*)RF2(.*)/(.*)txt$")
-        if zip_entry.endswith(".txt") and release_pattern.match(zip_entry):
+        if zip_entry.endswith(".txt") and RELEASE_PATTERN.match(zip_entry):
             for folder_name, pattern in iter(FILE_PATTERNS.items()):
                 self.ensure_dest_subfolder_exists(folder_name)
                 if pattern.match(zip_entry):
@@ -240,7 +194,11 @@ class DropboxData(object):
                         dest_file.write(zipfile.read(zip_entry))
 
     def extract_zips(self):
-        """(Re-)extract the downloaded SNOMED distribution zipfiles"""
+        """(Re-)extract the downloaded SNOMED distribution zipfiles
+
+        The load reads the zips in place; this is only needed to inspect the
+        RF2 files by hand.
+        """
         # Extract zips afresh each time there is a change
         LOGGER.debug("Starting SNOMED zip extraction")
         current_files = os.listdir(EXTRACT_WORKING_FOLDER)
@@ -255,16 +213,23 @@ class DropboxData(object):
             file_path for file_path in self.get_cached_file_paths()
         ]
 
-        for source_file_path in source_file_paths:
-            if source_file_path.endswith(".zip"):
-                zf = zipfile.ZipFile(
-                    WORKING_FOLDER
-                    + source_file_path.replace("downloads/", ""),
-                    "r",
-                )
-                entries = zf.namelist()
-                for entry in entries:
-                    self.save_zip_entry(zf, entry)
+        with metrics.stage("extract") as stage:
+            stage.bytes_in = 0
+            for source_file_path in source_file_paths:
+                if source_file_path.endswith(".zip"):
+                    zip_path = WORKING_FOLDER + source_file_path.replace(
+                        "downloads/", ""
+                    )
+                    stage.bytes_in += os.path.getsize(zip_path)
+                    zf = zipfile.ZipFile(zip_path, "r")
+                    entries = zf.namelist()
+                    for entry in entries:
+                        self.save_zip_entry(zf, entry)
+            stage.bytes_out = sum(
+                os.path.getsize(os.path.join(path, name))
+                for path, _, names in os.walk(EXTRACT_WORKING_FOLDER)
+                for name in names
+            )
         LOGGER.debug("Finished SNOMED zip extraction")
 
 
@@ -278,7 +243,7 @@ def snomed_data(context):
 @snomed_data.command()
 @click.pass_obj
 def fetch(dropbox_client):
-    """Downloads content from dropbox and extracts it to specific folders"""
+    """Downloads the release zips from dropbox; they are loaded in place"""
     if not dropbox_client.has_internet_connection:
         LOGGER.warning("No internet connection")
         return
@@ -328,15 +293,12 @@ def fetch(dropbox_client):
                 if dropbox_client.file_has_changed(upstream_file_path):
                     LOGGER.info("Fetching %s" % upstream_file_path)
                     dropbox_client.fetch_file(upstream_file_path)
-
-            dropbox_client.extract_zips()
         else:
             LOGGER.info(
                 "There is no change in the Dropbox folder. "
                 "Happy to do nothing! However, "
-                'if your "%s" or "%s" folders are inconsistent, delete '
-                "them and re-run this command"
-                % (WORKING_FOLDER, EXTRACT_WORKING_FOLDER)
+                'if your "%s" folder is inconsistent, delete '
+                "it and re-run this command" % WORKING_FOLDER
             )
     except MaxRetryError as e:
         LOGGER.warning(
@@ -347,6 +309,13 @@ def fetch(dropbox_client):
         )
 
 
+@snomed_data.command()
+@click.pass_obj
+def extract(dropbox_client):
+    """Extracts the fetched zips to specific folders, for inspection"""
+    dropbox_client.extract_zips()
+
+
 @snomed_data.command()
 def clear():
     """Very unsafe; to be run only to clear space on CircleCI"""
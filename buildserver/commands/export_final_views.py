@@ -0,0 +1,177 @@
+"""Export the final views of the build, a few at a time"""
+import os
+import click
+
+from sil_snomed_server.config.config import basedir
+from .shared import connections, export, metrics, sql_script, terms
+from .shared.compress import CODECS, THREADS, Compression
+from .shared.load import MULTIPROCESSING_POOL_SIZE
+from .shared.metrics import REPORT_FILE
+
+SQL_SCRIPT = os.path.join(basedir, 'migrations/sql/copy_final_views_to_tsv.sql')
+NORMALIZED_SQL_SCRIPT = os.path.join(
+    basedir, 'migrations/sql/copy_normalized_views_to_tsv.sql')
+# Profile -> (the COPY script, the exports written here)
+PROFILES = {
+    'denormalized': (SQL_SCRIPT, export.EXPORTS),
+    'normalized': (NORMALIZED_SQL_SCRIPT, export.NORMALIZED_EXPORTS),
+}
+
+
+def _compressions(specs):
+    """The default Compression, and those of the named exports"""
+    default = Compression('gzip', None)
+    named = {}
+    for spec in specs:
+        name, _, codec = spec.rpartition('=')
+        try:
+            compression = Compression.parse(codec)
+        except ValueError as error:
+            raise click.BadParameter(str(error), param_hint='--compression')
+        if name:
+            named[name] = compression
+        else:
+            default = compression
+    return default, named
+
+
+def _shard_name(name, number):
+    return '{}.shard{:03d}'.format(name, number)
+
+
+@click.command()
+@click.option('--output-folder', type=click.Path(file_okay=False),
+              default=os.path.dirname(REPORT_FILE), show_default=True,
+              help='Where the files go.')
+@click.option('--profile', type=click.Choice(sorted(PROFILES)),
+              default='denormalized', show_default=True,
+              help='denormalized files name every concept that they refer '
+                   'to; normalized files have its id only, and '
+                   'concept_names has the names.')
+@click.option('--script', type=click.Path(exists=True, dir_okay=False),
+              help='The COPY statements to run as well; those of the '
+                   'profile by default.')
+@click.option('--only', 'names', multiple=True,
+              help='An export to write (the name of its file, up to the '
+                   'first "."); all of them by default.')
+@click.option('--jobs', type=int, default=MULTIPROCESSING_POOL_SIZE,
+              show_default=True,
+              help='The number of exports that run at the same time.')
+@click.option('--threads', type=int, default=THREADS, show_default=True,
+              help='The number of threads that compress each file.')
+@click.option('--shards', type=int, default=1, show_default=True,
+              help='Split each of the big exports ({}) into this many '
+                   'files, by id range, and list them in a manifest; they '
+                   'are written at the same time, like other exports.'
+              .format(', '.join(sorted(export.SHARDED))))
+@click.option('--format', 'file_format', type=click.Choice(export.FORMATS),
+              default='csv', show_default=True,
+              help='How to write the table exports: CSV with a header, or '
+                   'one JSON object per line, with the JSON columns nested.')
+@click.option('--compression', 'compression_specs', multiple=True,
+              metavar='[NAME=]CODEC[:LEVEL]',
+              help='How to compress the files, e.g. "xz:6", or one of them, '
+                   'e.g. "description_terms=gzip:9". The codecs: {}; the '
+                   'default is gzip:6.'.format(', '.join(CODECS)))
+def export_final_views(output_folder, profile, script, names, jobs, threads,
+                       shards, file_format, compression_specs):
+    """Write the final views to OUTPUT_FOLDER
+
+    The exports of commands/shared/export.py add the concept names in this
+    process; the COPY statements of the script run on the server, into
+    files of OUTPUT_FOLDER. All of them are independent, and up to JOBS run
+    at once.
+
+    With --shards N, a big export is written as <name>.shardNNN.* files of
+    about the same number of rows each, and <name>.manifest.json lists
+    them, with their id ranges, rows and SHA-256.
+
+    With --format ndjson, the .csv files are .ndjson files instead; the
+    adjacency list and current_version_info are written as they are.
+    """
+    default, named = _compressions(compression_specs)
+    default_script, exports = PROFILES[profile]
+    with open(script or default_script, 'r') as script_file:
+        copies = export.copy_exports(
+            sql_script.parse_script(script_file.read()))
+    available = list(copies) + list(exports)
+    unknown = (set(names) | set(named)) - set(available)
+    if unknown:
+        raise click.BadParameter('No export {}; one of {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(available)))
+
+    def connect():
+        return connections.connect('export')
+
+    preferred_terms = None
+    if any(name in exports and exports[name].named
+           for name in names or available):
+        conn = connect()
+        conn.autocommit = False
+        try:
+            with metrics.stage('export/terms') as stage:
+                preferred_terms = terms.TermDictionary.load(
+                    conn, terms.PREFERRED_TERMS_QUERY)
+                stage.rows = len(preferred_terms)
+        finally:
+            conn.close()
+
+    def ndjson(copy):
+        if file_format == 'ndjson' and copy.tabular:
+            return copy.as_ndjson()
+        return copy
+
+    sharded = {}
+    if shards > 1:
+        for name in names or available:
+            if name in copies and name in export.SHARDED:
+                table, column = export.SHARDED[name]
+                conn = connect()
+                try:
+                    with conn.cursor() as cursor:
+                        sharded[name] = export.shard_ranges(
+                            cursor, table, shards)
+                finally:
+                    conn.close()
+
+    jobs_to_run = []
+    for name in names or available:
+        compression = named.get(name, default)
+        if name in sharded:
+            column = export.SHARDED[name][1]
+            for number, (start, end) in enumerate(sharded[name]):
+                def job(conn, name=_shard_name(name, number),
+                        shard=ndjson(
+                            copies[name].shard(column, start, end, number)),
+                        compression=compression):
+                    return export.write_copy(conn, name, shard, output_folder,
+                                             compression, threads)
+                jobs_to_run.append((_shard_name(name, number), job))
+            continue
+        if name in copies:
+            def job(conn, name=name, compression=compression):
+                return export.write_copy(conn, name, ndjson(copies[name]),
+                                         output_folder, compression, threads)
+        else:
+            def job(conn, name=name, compression=compression):
+                return export.write_export(
+                    conn, name, exports[name], preferred_terms,
+                    output_folder, compression, threads, file_format)
+        jobs_to_run.append((name, job))
+
+    with metrics.stage('export_final_views', jobs=jobs) as stage:
+        results = export.run_exports(jobs_to_run, connect, jobs)
+        stage.rows = sum(written.rows or 0 for written in results.values())
+    for name, written in results.items():
+        click.echo('{}: {} rows'.format(
+            written.file_name,
+            '?' if written.rows is None else '{:,}'.format(written.rows)))
+    for name, ranges in sharded.items():
+        click.echo(export.write_manifest(
+            output_folder, name, export.SHARDED[name][1], ranges,
+            [results[_shard_name(name, number)]
+             for number in range(len(ranges))]))
+
+
+if __name__ == '__main__':
+    export_final_views()
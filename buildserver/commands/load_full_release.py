@@ -1,13 +1,41 @@
 import click
 from sil_snomed_server.app import db
-from .shared.discover import enumerate_release_files
+from .shared.discover import RELEASE_TYPES, enumerate_release_files
 from .shared.load import load_release_files
 
 @click.command()
-def load_snomed_data():
+@click.option('--bulk-load/--no-bulk-load', default=False,
+              help='Load into unlogged, index-free tables with COPY FREEZE '
+                   'and build the keys and indexes at the end.')
+@click.option('--binary-copy/--text-copy', default=False,
+              help='Encode the RF2 rows for binary COPY on the client, '
+                   'instead of having the server parse them as text.')
+@click.option('--delta', type=click.Choice(RELEASE_TYPES), default=None,
+              help='Append only the rows that are newer than what is '
+                   'loaded, from the Full or the Delta files of the '
+                   'release, and mark their ids as changed.')
+@click.option('--validate-ids/--no-validate-ids', default=True,
+              help='Check the check digit and partition of every SCTID as '
+                   'it is loaded; the first file with bad ids stops the load.')
+@click.option('--snapshot-date', type=click.DateTime(['%Y%m%d', '%Y-%m-%d']),
+              default=None,
+              help='Build the current_*_snapshot views as of this date, '
+                   'instead of the latest release.')
+@click.option('--presnapshot/--no-presnapshot', default=False,
+              help='Cut each file down to its latest row per id before the '
+                   'load, leaving the history out of the Full tables.')
+def load_snomed_data(bulk_load, binary_copy, delta, validate_ids,
+                     snapshot_date, presnapshot):
     """Loads the newest full SNOMED UK clinical & drug release"""
+    if bulk_load and delta:
+        raise click.UsageError('--delta cannot be used with --bulk-load')
     try:
-        load_release_files(enumerate_release_files())
+        load_release_files(
+            enumerate_release_files(release_type=delta or 'Full'),
+            bulk=bulk_load, binary=binary_copy, delta=delta is not None,
+            validate_ids=validate_ids,
+            snapshot_date=snapshot_date.date() if snapshot_date else None,
+            presnapshot=presnapshot)
     except Exception as e:
         raise Exception("Unable to load SNOMED content: %s" % e)
 
@@ -0,0 +1,48 @@
+"""Run an SQL script with its independent statements in parallel"""
+import click
+
+from .shared import metrics, sql_script
+from .shared.load import MULTIPROCESSING_POOL_SIZE
+
+
+@click.command()
+@click.argument('script', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, default=MULTIPROCESSING_POOL_SIZE,
+              show_default=True,
+              help='The number of statements that run at the same time.')
+@click.option('--stage-name', default=None,
+              help='Record the whole run as this build metrics stage.')
+@click.option('--profile', default='snapshot', show_default=True,
+              help='The session profile of the connections; see '
+                   'BUILD_SESSION_PROFILES in the config.')
+@click.option('--plan', 'show_plan', is_flag=True,
+              help='Print the statements and what each one waits for, '
+                   'without running them.')
+def run_sql_script(script, workers, stage_name, profile, show_plan):
+    """Run SCRIPT on the database, in dependency order
+
+    Statements that do not depend on each other, e.g. the materialized
+    views of the denormalization script, run side by side; see
+    commands/shared/sql_script.py.
+    """
+    with open(script, 'r') as script_file:
+        statements = sql_script.parse_script(script_file.read())
+    if show_plan:
+        for statement, waiting in zip(
+                statements, sql_script.plan(statements)):
+            click.echo('{:>4} (line {}) after {}: {}'.format(
+                statement.number, statement.line,
+                sorted(statements[index].number for index in waiting) or '-',
+                statement.summary(60)))
+        return
+    name = click.format_filename(script, shorten=True)
+    if stage_name is None:
+        sql_script.run_statements(statements, name, workers, profile)
+        return
+    with metrics.stage(stage_name, script=name,
+                       statements=len(statements)):
+        sql_script.run_statements(statements, name, workers, profile)
+
+
+if __name__ == '__main__':
+    run_sql_script()
@@ -0,0 +1,107 @@
+# coding=utf-8
+"""The framing of PostgreSQL binary COPY streams, shared by the writers
+
+See https://www.postgresql.org/docs/current/sql-copy.html ("Binary
+Format"): a header, then per row a 16 bit field count and, per field, a
+32 bit length and the value in network byte order, then a trailer.
+"""
+import binascii
+import functools
+import struct
+
+from datetime import date
+from itertools import chain, repeat
+
+# The signature, then the flags and the header extension length
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+TRAILER = struct.pack('>h', -1)
+# Dates are sent as days since this one
+POSTGRES_EPOCH = date(2000, 1, 1).toordinal()
+
+
+class BlockReader(object):
+    """A file-like view over an iterable of byte blocks, for copy_expert"""
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = b''
+        self._position = 0
+
+    def read(self, size=-1):
+        if self._position >= len(self._block):
+            self._block = next(self._blocks, b'')
+            self._position = 0
+        if size < 0:
+            size = len(self._block) - self._position
+        chunk = self._block[self._position:self._position + size]
+        self._position += len(chunk)
+        return chunk
+
+
+@functools.lru_cache(maxsize=None)
+def rf2_date(value):
+    """RF2 YYYYMMDD -> days since the PostgreSQL epoch; there are few dates"""
+    return date(int(value[:4]), int(value[4:6]),
+                int(value[6:8])).toordinal() - POSTGRES_EPOCH
+
+
+def rf2_uuid(value):
+    return binascii.unhexlify(value.replace(b'-', b''))
+
+
+# column type -> (struct code, field width, converter from RF2 bytes);
+# text columns are sent as they are, with their length in front
+RF2_FIELDS = {
+    'bigint': ('q', 8, int),
+    'integer': ('i', 4, int),
+    'boolean': ('?', 1, {b'0': False, b'1': True}.__getitem__),
+    'date': ('i', 4, rf2_date),
+    'uuid': ('16s', 16, rf2_uuid),
+}
+
+
+def encode_rf2(blocks, column_types):
+    """Re-encode blocks of RF2 rows as a binary COPY stream
+
+    Each block is converted a column at a time and packed with a single
+    struct call, instead of row by row, so that the server no longer has
+    to parse the SCTIDs, dates and UUIDs from text. RF2 has no NULLs: an
+    empty field is sent as an empty value, as a text COPY loads it.
+
+    :param blocks: line-aligned blocks of tab separated RF2 rows
+    :param column_types: the PostgreSQL type of each column, e.g. 'bigint';
+        the types that are not in RF2_FIELDS are sent as text
+    """
+    fields = [RF2_FIELDS.get(column_type) for column_type in column_types]
+    yield HEADER
+    for block in blocks:
+        rows = [line.split(b'\t') for line in block.splitlines()]
+        if not rows:
+            continue
+        if set(map(len, rows)) != {len(fields)}:
+            raise Exception(
+                'Expected {} fields in every row'.format(len(fields)))
+
+        row_format = ['h']
+        values = [repeat(len(fields))]
+        text_lengths = []
+        for field, column in zip(fields, zip(*rows)):
+            if field is None:
+                lengths = list(map(len, column))
+                text_lengths.append(lengths)
+                row_format.append('i%ds')
+                values += [lengths, column]
+            else:
+                code, width, convert = field
+                row_format.append('i' + code)
+                values += [repeat(width), map(convert, column)]
+
+        row_format = ''.join(row_format)
+        if text_lengths:
+            block_format = ''.join(
+                row_format % lengths for lengths in zip(*text_lengths))
+        else:
+            block_format = row_format * len(rows)
+        yield struct.pack(
+            '>' + block_format, *chain.from_iterable(zip(*values)))
+    yield TRAILER
@@ -0,0 +1,324 @@
+# coding=utf-8
+"""The transitive closure of the IS-A hierarchy, computed in memory
+
+The active IS-A relationships of the snapshot are read into integer arrays
+with a binary COPY, and the ancestors of every concept are merged in
+topological order: a concept's ancestors are its parents and their
+ancestors, which are all known by the time it is reached. The result goes
+back into single_snapshot_transitive_closure with a binary COPY; it has the
+same rows as generate_single_snapshot_transitive_closure in
+transitive_closure.sql, in a fraction of the time.
+
+The edges that a closure was built from are kept in closure_edges, so that
+the next release can update it in place (see update_closure): only the
+concepts below an IS-A edge that was added or retired can have different
+ancestors, and only their rows are rewritten. A pair keeps the
+effective_time of the release that added it; the release that the closure
+is current for is the one row of closure_release, which the exports give
+every pair, as a closure built from scratch has.
+"""
+import io
+
+import numpy as np
+
+from . import binary_copy
+
+IS_A = 116680003
+CLOSURE_TABLE = 'single_snapshot_transitive_closure'
+EDGES_TABLE = 'closure_edges'
+RELEASE_TABLE = 'closure_release'
+# What get_tc_effective_time() in transitive_closure.sql returns
+EFFECTIVE_TIME_QUERY = (
+    'SELECT effective_time FROM current_description_snapshot '
+    'WHERE concept_id = 138875005 AND module_id = 900000000000207008 '
+    'ORDER BY effective_time DESC LIMIT 1')
+EDGES_QUERY = (
+    'SELECT source_id, destination_id FROM current_relationship_snapshot '
+    'WHERE active AND type_id = {}'.format(IS_A))
+PREVIOUS_EDGES_QUERY = 'SELECT source_id, destination_id FROM {}'.format(
+    EDGES_TABLE)
+
+# Rows of the binary COPY streams: (source_id, destination_id) out, and
+# (subtype_id, supertype_id, effective_time, active) in
+_EDGE_ROW = np.dtype([
+    ('fields', '>i2'), ('source_length', '>i4'), ('source', '>i8'),
+    ('destination_length', '>i4'), ('destination', '>i8')])
+_CLOSURE_ROW = np.dtype([
+    ('fields', '>i2'), ('subtype_length', '>i4'), ('subtype', '>i8'),
+    ('supertype_length', '>i4'), ('supertype', '>i8'),
+    ('time_length', '>i4'), ('time', '>i4'),
+    ('active_length', '>i4'), ('active', 'i1')])
+COPY_CHUNK_ROWS = 1000000
+
+
+def read_edges(cursor, query=EDGES_QUERY):
+    """The (child, parent) pairs that query selects, as two int64 arrays"""
+    data = io.BytesIO()
+    cursor.copy_expert(
+        'COPY ({}) TO STDOUT WITH (FORMAT binary)'.format(query), data)
+    data = data.getvalue()
+    rows = np.frombuffer(
+        data, _EDGE_ROW, offset=len(binary_copy.HEADER),
+        count=(len(data) - len(binary_copy.HEADER) -
+               len(binary_copy.TRAILER)) // _EDGE_ROW.itemsize)
+    return (rows['source'].astype(np.int64),
+            rows['destination'].astype(np.int64))
+
+
+def _ancestors_by_search(node, parents, ancestors):
+    """The ancestors of a node that is on a cycle, by a graph search"""
+    found = set()
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if ancestors[current] is not None and current != node:
+            found.update(ancestors[current].tolist())
+            continue
+        for parent in parents[current]:
+            if parent not in found:
+                found.add(parent)
+                pending.append(parent)
+    return np.array(sorted(found), dtype=np.int32)
+
+
+def transitive_closure(children, parents):
+    """Every (descendant, ancestor) pair of a graph of (child, parent) edges
+
+    :param children: the child of each edge, as an integer array
+    :param parents: the parent of each edge
+    :return: (subtypes, supertypes), as two int64 arrays, sorted
+    """
+    nodes, inverse = np.unique(
+        np.concatenate([children, parents]), return_inverse=True)
+    edges = np.unique(np.stack(
+        [inverse[:len(children)], inverse[len(children):]], axis=1), axis=0)
+    node_count = len(nodes)
+
+    # The parents of each node, and the children, as index slices
+    parent_starts = np.searchsorted(edges[:, 0], np.arange(node_count + 1))
+    node_parents = [edges[parent_starts[node]:parent_starts[node + 1], 1]
+                    for node in range(node_count)]
+    by_parent = edges[np.argsort(edges[:, 1], kind='stable')]
+    child_starts = np.searchsorted(by_parent[:, 1], np.arange(node_count + 1))
+
+    # Kahn's algorithm: a node is merged once all of its parents have been
+    waiting = np.diff(parent_starts)
+    ready = list(np.flatnonzero(waiting == 0))
+    ancestors = [None] * node_count
+    empty = np.empty(0, dtype=np.int32)
+    while ready:
+        node = ready.pop()
+        own_parents = node_parents[node]
+        if len(own_parents) == 0:
+            ancestors[node] = empty
+        elif len(own_parents) == 1:
+            ancestors[node] = np.union1d(
+                own_parents, ancestors[own_parents[0]]).astype(np.int32)
+        else:
+            ancestors[node] = np.unique(np.concatenate(
+                [own_parents] + [ancestors[parent]
+                                 for parent in own_parents])
+            ).astype(np.int32)
+        for child in by_parent[child_starts[node]:child_starts[node + 1], 0]:
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                ready.append(child)
+
+    # IS-A should have no cycles; if it does, the nodes on and below them
+    # are searched, which gives the same pairs as the SQL version
+    for node in range(node_count):
+        if ancestors[node] is None:
+            ancestors[node] = _ancestors_by_search(
+                node, node_parents, ancestors)
+
+    lengths = np.array([len(found) for found in ancestors], dtype=np.int64)
+    subtypes = np.repeat(nodes, lengths)
+    supertypes = nodes[np.concatenate(ancestors + [empty])]
+    return subtypes.astype(np.int64), supertypes.astype(np.int64)
+
+
+def encode_closure_copy(subtypes, supertypes, effective_time,
+                        chunk_rows=COPY_CHUNK_ROWS):
+    """The closure as a binary COPY stream, in chunks of chunk_rows rows
+
+    :param effective_time: a date, for every row; the rows are all active
+    """
+    yield binary_copy.HEADER
+    days = effective_time.toordinal() - binary_copy.POSTGRES_EPOCH
+    for start in range(0, len(subtypes), chunk_rows):
+        end = min(start + chunk_rows, len(subtypes))
+        rows = np.empty(end - start, dtype=_CLOSURE_ROW)
+        rows['fields'] = 4
+        rows['subtype_length'] = 8
+        rows['subtype'] = subtypes[start:end]
+        rows['supertype_length'] = 8
+        rows['supertype'] = supertypes[start:end]
+        rows['time_length'] = 4
+        rows['time'] = days
+        rows['active_length'] = 1
+        rows['active'] = 1
+        yield rows.tobytes()
+    yield binary_copy.TRAILER
+
+
+def write_closure(cursor, subtypes, supertypes, effective_time):
+    """Replace single_snapshot_transitive_closure with the given pairs
+
+    The table is created and filled in the same transaction, so the COPY
+    can FREEZE the rows; its keys are built once it is full. The caller
+    commits.
+    """
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(CLOSURE_TABLE))
+    cursor.execute(
+        'CREATE TABLE {} (subtype_id BIGINT, supertype_id BIGINT, '
+        'effective_time date, active BOOLEAN)'.format(CLOSURE_TABLE))
+    cursor.copy_expert(
+        'COPY {} FROM STDIN WITH (FORMAT binary, FREEZE)'.format(
+            CLOSURE_TABLE),
+        binary_copy.BlockReader(encode_closure_copy(
+            subtypes, supertypes, effective_time)), size=1024 * 1024)
+    cursor.execute(
+        'ALTER TABLE {} ADD PRIMARY KEY '
+        '(subtype_id, supertype_id, effective_time, active)'.format(
+            CLOSURE_TABLE))
+    cursor.execute('CREATE INDEX ix_tc_main ON {} (subtype_id, supertype_id)'
+                   .format(CLOSURE_TABLE))
+    cursor.execute('CREATE INDEX ix_tc_inv ON {} (supertype_id)'.format(
+        CLOSURE_TABLE))
+    save_release(cursor, effective_time)
+
+
+def save_release(cursor, effective_time):
+    """Keep the release that the closure is current for in closure_release"""
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS {} (effective_time date NOT NULL)'.format(
+            RELEASE_TABLE))
+    cursor.execute('DELETE FROM {}'.format(RELEASE_TABLE))
+    cursor.execute('INSERT INTO {} VALUES (%s)'.format(RELEASE_TABLE),
+                   (effective_time,))
+
+
+def save_edges(cursor):
+    """Keep the current IS-A edges in closure_edges, for update_closure"""
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(EDGES_TABLE))
+    cursor.execute(
+        'CREATE TABLE {} AS SELECT DISTINCT source_id, destination_id '
+        'FROM ({}) AS edges'.format(EDGES_TABLE, EDGES_QUERY))
+    cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (source_id, '
+                   'destination_id)'.format(EDGES_TABLE))
+
+
+def _descendants(seeds, edges):
+    """The seeds and everything below them, over (child, parent) edges"""
+    children = {}
+    for child, parent in edges:
+        children.setdefault(parent, []).append(child)
+    found = set(seeds)
+    pending = list(found)
+    while pending:
+        for child in children.get(pending.pop(), ()):
+            if child not in found:
+                found.add(child)
+                pending.append(child)
+    return found
+
+
+def closure_changes(old_edges, new_edges, ancestors_of):
+    """How a closure changes when its edges do
+
+    A concept's ancestors can only change if it is the child of an edge
+    that was added or removed, or below one, in the old graph or the new;
+    those concepts are re-derived over the new edges, from the ancestors of
+    the concepts above them that did not change.
+
+    :param old_edges: the (child, parent) pairs the closure was built from
+    :param new_edges: the current (child, parent) pairs
+    :param ancestors_of: called with a list of concepts; returns {concept:
+        set of its ancestors} from the closure, for those that have any
+    :return: (added pairs, removed pairs, concepts whose ancestors changed);
+        the pairs are sets of (subtype, supertype)
+    """
+    old_edges = set(old_edges)
+    new_edges = set(new_edges)
+    seeds = {child for child, _ in old_edges ^ new_edges}
+    if not seeds:
+        return set(), set(), set()
+    affected = _descendants(seeds, old_edges | new_edges)
+
+    parents = {}
+    for child, parent in new_edges:
+        if child in affected:
+            parents.setdefault(child, []).append(parent)
+    above = {parent for node_parents in parents.values()
+             for parent in node_parents if parent not in affected}
+    known = ancestors_of(sorted(above))
+    old = ancestors_of(sorted(affected))
+
+    added = set()
+    removed = set()
+    changed = set()
+    for node in affected:
+        found = set()
+        pending = [node]
+        while pending:
+            for parent in parents.get(pending.pop(), ()):
+                if parent in found:
+                    continue
+                found.add(parent)
+                if parent in affected:
+                    pending.append(parent)
+                else:
+                    found.update(known.get(parent, ()))
+        previous = old.get(node, set())
+        if found != previous:
+            changed.add(node)
+            added.update((node, ancestor) for ancestor in found - previous)
+            removed.update((node, ancestor) for ancestor in previous - found)
+    return added, removed, changed
+
+
+def read_ancestors(cursor, concepts):
+    """{concept: set of its ancestors}, from the closure table"""
+    ancestors = {}
+    cursor.execute(
+        'SELECT subtype_id, supertype_id FROM {} '
+        'WHERE subtype_id = ANY(%s)'.format(CLOSURE_TABLE), (concepts,))
+    for subtype, supertype in cursor:
+        ancestors.setdefault(subtype, set()).add(supertype)
+    return ancestors
+
+
+def apply_changes(cursor, added, removed, changed, effective_time):
+    """Write closure_changes() to the closure and closure_edges tables
+
+    Only the pairs that changed are written: the new ones get
+    effective_time, and the others keep theirs; effective_time becomes the
+    release in closure_release. The concepts whose ancestors changed
+    replace the closure's previous ones in changed_components, with the
+    table name single_snapshot_transitive_closure. The caller commits.
+    """
+    if removed:
+        subtypes, supertypes = zip(*removed)
+        cursor.execute(
+            'DELETE FROM {} AS c USING unnest(%s::bigint[], %s::bigint[]) '
+            'AS r(subtype_id, supertype_id) WHERE c.subtype_id = '
+            'r.subtype_id AND c.supertype_id = r.supertype_id'.format(
+                CLOSURE_TABLE), (list(subtypes), list(supertypes)))
+    if added:
+        subtypes, supertypes = zip(*added)
+        cursor.execute(
+            'INSERT INTO {} SELECT subtype_id, supertype_id, %s, true '
+            'FROM unnest(%s::bigint[], %s::bigint[]) '
+            'AS a(subtype_id, supertype_id)'.format(CLOSURE_TABLE),
+            (effective_time, list(subtypes), list(supertypes)))
+    save_edges(cursor)
+    save_release(cursor, effective_time)
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS changed_components ('
+        'table_name text NOT NULL, id text NOT NULL, '
+        'PRIMARY KEY (table_name, id))')
+    cursor.execute('DELETE FROM changed_components WHERE table_name = %s',
+                   (CLOSURE_TABLE,))
+    cursor.execute(
+        'INSERT INTO changed_components SELECT %s, unnest(%s::text[])',
+        (CLOSURE_TABLE, [str(concept) for concept in sorted(changed)]))
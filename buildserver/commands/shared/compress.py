@@ -0,0 +1,169 @@
+# coding=utf-8
+"""Compress an output file on several threads, a block at a time
+
+The data is cut into blocks, and each block is compressed on its own into a
+complete gzip member (or bzip2 / xz stream); the members are written in
+order. A file of concatenated members is standard: gzip, bzip2 and xz, and
+Python's gzip, bz2 and lzma modules, read it as one. zlib, bz2 and lzma
+release the GIL while they compress, so the blocks are compressed in
+parallel by threads.
+"""
+import bz2
+import hashlib
+import lzma
+import os
+import struct
+import zlib
+
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 4 * 1024 * 1024
+THREADS = os.cpu_count() or 1
+
+# A gzip member header: no file name, no mtime (so the output only depends
+# on the data), an unknown OS
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def _gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b''.join([
+        _GZIP_HEADER, compressor.compress(data), compressor.flush(),
+        struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                    len(data) & 0xffffffff)])
+
+
+def _bz2(data, level):
+    return bz2.compress(data, level)
+
+
+def _xz(data, level):
+    return lzma.compress(data, preset=level)
+
+
+def _none(data, level):
+    return data
+
+
+Codec = namedtuple('Codec', ['extension', 'compress', 'default_level'])
+CODECS = OrderedDict([
+    ('gzip', Codec('.gz', _gzip, 6)),
+    ('bz2', Codec('.bz2', _bz2, 9)),
+    ('xz', Codec('.xz', _xz, 6)),
+    ('none', Codec('', _none, None)),
+])
+
+
+class Compression(namedtuple('Compression', ['codec', 'level'])):
+    """A codec (a CODECS key) and its level; None for the codec's default"""
+
+    @classmethod
+    def parse(cls, text):
+        """'gzip', 'xz:9'..."""
+        codec, _, level = text.partition(':')
+        if codec not in CODECS:
+            raise ValueError('Unknown codec {!r}; one of {}'.format(
+                codec, ', '.join(CODECS)))
+        return cls(codec, int(level) if level else None)
+
+    @property
+    def extension(self):
+        return CODECS[self.codec].extension
+
+    @property
+    def effective_level(self):
+        if self.level is None:
+            return CODECS[self.codec].default_level
+        return self.level
+
+
+class ParallelBlockWriter(object):
+    """A binary file that compresses what is written to it, on threads
+
+    The file is written as <path>.partial, and only gets its name when it is
+    closed without an error. Use it as a context manager.
+    """
+
+    def __init__(self, path, compression=Compression('gzip', None),
+                 threads=THREADS, block_size=BLOCK_SIZE):
+        self.path = path
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._hash = hashlib.sha256()
+        self._compress = CODECS[compression.codec].compress
+        self._level = compression.effective_level
+        self._block_size = block_size
+        self._threads = max(1, threads)
+        self._pool = ThreadPoolExecutor(self._threads)
+        self._pending = deque()
+        self._buffer = []
+        self._buffered = 0
+        self._blocks = 0
+        self._file = open(path + '.partial', 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.bytes_in += len(data)
+        if self._buffered >= self._block_size:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        block = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._blocks += 1
+        self._pending.append(
+            self._pool.submit(self._compress, block, self._level))
+        # Keep a few blocks in flight per thread, no more, so that memory
+        # stays bounded when the compression is slower than the input
+        while len(self._pending) > 2 * self._threads:
+            self._write_next()
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self._file.write(compressed)
+        self._hash.update(compressed)
+        self.bytes_out += len(compressed)
+
+    @property
+    def sha256(self):
+        """The SHA-256 of the file, as written so far, in hex"""
+        return self._hash.hexdigest()
+
+    def close(self):
+        """Compress the rest, and give the file its name"""
+        if self._file.closed:
+            return
+        try:
+            # An empty file still gets one (empty) member
+            if self._buffer or not self._blocks:
+                self._submit()
+            while self._pending:
+                self._write_next()
+        except BaseException:
+            self._abort()
+            raise
+        self._pool.shutdown()
+        self._file.close()
+        os.rename(self._file.name, self.path)
+
+    def _abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._pool.shutdown()
+        self._file.close()
+        os.remove(self._file.name)
@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Database connections for the build, tuned for the stage that uses them
+
+Every process opens connections of its own, after it has been forked; a
+connection is never shared across a fork. Each connection gets the session
+profile of its stage (see BUILD_SESSION_PROFILES in the config), and the
+settings that end up in effect are printed, since the server or a role
+default can override or reject them.
+"""
+import logging
+import os
+import psycopg2
+
+from sil_snomed_server.app import app
+
+LOGGER = logging.getLogger(__name__)
+
+# This process's connections, by (pid, stage). Those inherited from a
+# parent are kept as they are: closing them would end the parent's session.
+_connections = {}
+
+
+def session_profile(stage):
+    """The session settings for a stage, e.g. 'load', 'snapshot' or 'index'"""
+    return app.config.get('BUILD_SESSION_PROFILES', {}).get(stage, {})
+
+
+def connect(stage):
+    """Open a new connection with the session profile of stage applied
+
+    The caller owns the connection, and closes it.
+    """
+    conn = psycopg2.connect(app.config['SQLALCHEMY_DATABASE_URI'])
+    profile = session_profile(stage)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for name, value in sorted(profile.items()):
+        try:
+            cursor.execute(
+                'SELECT set_config(%s, %s, false)', (name, str(value)))
+        except psycopg2.Error as error:
+            LOGGER.warning('Unable to set %s = %s for %s: %s',
+                           name, value, stage, error)
+    if profile:
+        cursor.execute(
+            'SELECT name, current_setting(name, true) '
+            'FROM unnest(%s::text[]) AS name', (sorted(profile),))
+        print('{} session (pid {}): {}'.format(
+            stage, os.getpid(), ', '.join(
+                '{}={}'.format(name, setting)
+                for name, setting in cursor.fetchall())))
+    conn.autocommit = False
+    return conn
+
+
+def for_stage(stage):
+    """This process's own connection for stage; opened when first used"""
+    key = (os.getpid(), stage)
+    if key not in _connections or _connections[key].closed:
+        _connections[key] = connect(stage)
+    return _connections[key]
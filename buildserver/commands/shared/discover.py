@@ -1,16 +1,24 @@
 # coding=utf-8
-"""Enumerate the SNOMED files that are in the designated directory"""
+"""Enumerate the SNOMED files that are in the downloaded release zips"""
 import os
+import re
+import zipfile
+import contextlib
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from sil_snomed_server.config import config
 
 def _join(base, path):
     """A helper - for readability / brevity"""
     return os.path.join(base, path)
 
+SOURCE_FOLDER = os.path.join(config.basedir, 'data/source_terminology_data')
+# `snomed_data extract` unpacks the zips here, for inspecting files by hand
 CONTENT_FOLDER = os.path.join(
     config.basedir, 'data/extracted_terminology_data')
+# `load_snomed_data --presnapshot` writes the snapshots of the files here
+SNAPSHOT_FOLDER = os.path.join(
+    config.basedir, 'data/snapshot_terminology_data')
 SUBFOLDERS = {
     'CONCEPTS':
     _join(CONTENT_FOLDER, 'concepts'),
@@ -55,15 +63,134 @@ SUBFOLDERS = {
     'DESCRIPTION_TYPE':
     _join(CONTENT_FOLDER, 'description_type_reference_sets')
 }
-SOURCE_FILES = defaultdict(list, {
-    key: [os.path.join(subfolder, fname) for fname in os.listdir(subfolder)]
+
+# Only RF2 text files are of interest; the zips also hold docs and readmes
+RELEASE_PATTERN = re.compile(r"(.*)RF2(.*)/(.*)txt$")
+# (folder name, file name pattern); {0} is the release type: Full or Delta
+_FILE_NAME_PATTERNS = [
+    ("concepts", r"^.*sct2_Concept_{0}[_-].+txt$"),
+    ("descriptions", r"^.*sct2_Description_{0}[_-].+txt$"),
+    ("relationships", r"^.*sct2_Relationship_{0}[_-].+txt$"),
+    ("text_definitions", r"^.*sct2_TextDefinition_{0}[_-].+txt$"),
+    ("identifiers", r"^.*sct2_Identifier_{0}[_-].+txt$"),
+    ("stated_relationships", r"^.*sct2_StatedRelationship_{0}[_-].+txt$"),
+    ("simple_reference_sets", r"^.*der2_.*Refset.+Simple{0}.+txt$"),
+    ("ordered_reference_sets", r"^.*der2_.*Refset.+Ordered{0}.+txt$"),
+    (
+        "attribute_value_reference_sets",
+        r"^.*der2_.*Refset.+AttributeValue{0}.+txt$",
+    ),
+    ("simple_map_reference_sets", r"^.*der2_.*Refset.+SimpleMap{0}.+txt$"),
+    (
+        "complex_map_int_reference_sets",
+        r"^.*der2_.*Refset.+ComplexMap{0}_INT.+txt$",
+    ),
+    (
+        "complex_map_gb_reference_sets",
+        r"^.*der2_.*Refset.+ComplexMap{0}_GB.+txt$",
+    ),
+    (
+        "extended_map_reference_sets",
+        r"^.*der2_.*Refset.+ExtendedMap{0}.+txt$",
+    ),
+    ("language_reference_sets", r"^.*der2_.*Refset.+Language{0}.+txt$"),
+    (
+        "query_specification_reference_sets",
+        r"^.*der2_.*Refset.+QuerySpecification{0}.+txt$",
+    ),
+    ("annotation_reference_sets", r"^.*der2_.*Refset.+Annotation{0}.+txt$"),
+    (
+        "association_reference_sets",
+        r"^.*der2_.*Refset.+AssociationReference{0}.+txt$",
+    ),
+    (
+        "module_dependency_reference_sets",
+        r"^.*der2_.*Refset.+ModuleDependency{0}.+txt$",
+    ),
+    (
+        "description_format_reference_sets",
+        r"^.*der2_.*Refset.+DescriptionFormat{0}.+txt$",
+    ),
+    (
+        "refset_descriptor_reference_sets",
+        r"^.*der2_.*Refset.*RefsetDescriptor{0}.+txt$",
+    ),
+    (
+        "description_type_reference_sets",
+        r"^.*der2_.*Refset.*DescriptionType{0}.+txt$",
+    ),
+]
+RELEASE_TYPES = ("Full", "Delta")
+
+
+def file_patterns(release_type="Full"):
+    """The file name pattern of every folder, for a Full or Delta release"""
+    if release_type not in RELEASE_TYPES:
+        raise ValueError("Unknown release type: {}".format(release_type))
+    return {
+        folder_name: re.compile(pattern.format(release_type))
+        for folder_name, pattern in _FILE_NAME_PATTERNS
+    }
+
+
+FILE_PATTERNS = file_patterns("Full")
+# FILE_PATTERNS is keyed by folder name; the loaders use the SUBFOLDERS keys
+CATEGORIES = {
+    os.path.basename(subfolder): key
     for key, subfolder in iter(SUBFOLDERS.items())
-})
+}
+
+
+class ReleaseFile(
+        namedtuple('ReleaseFile', ['archive', 'member', 'size', 'crc'])):
+    """An RF2 file that is read in place from its release zip
+
+    `size` is the uncompressed size of the member, in bytes, and `crc` its
+    CRC-32 from the zip directory; zipfile checks the data against it as
+    the member is read to the end.
+    """
+    __slots__ = ()
+
+    @contextlib.contextmanager
+    def open(self):
+        """Stream the decompressed member; nothing is written to disk"""
+        with zipfile.ZipFile(self.archive) as archive:
+            with archive.open(self.member) as member:
+                yield member
+
+    def __str__(self):
+        return '{}:{}'.format(os.path.basename(self.archive), self.member)
+
+
+def classify_zip_entry(zip_entry, patterns=FILE_PATTERNS):
+    """Return the folder names (see file_patterns) that a zip entry is in"""
+    if not (zip_entry.endswith('.txt') and RELEASE_PATTERN.match(zip_entry)):
+        return []
+    return [
+        folder_name for folder_name, pattern in iter(patterns.items())
+        if pattern.match(zip_entry)
+    ]
+
 
+def enumerate_release_files(source_folder=SOURCE_FOLDER, release_type="Full"):
+    """List and categorize the files that are part of a clinical release
 
-def enumerate_release_files():
-    """List and categorize the files that are part of a full clinical release
+    The release zips are not extracted; every RF2 member is returned as a
+    ReleaseFile, keyed by its SUBFOLDERS category.
 
-    :param release_type:
+    :param source_folder: the folder that the release zips were fetched to
+    :param release_type: Full, or Delta for only the changes of a release
     """
-    return SOURCE_FILES
+    patterns = file_patterns(release_type)
+    release_files = defaultdict(list)
+    archive_names = sorted(
+        name for name in os.listdir(source_folder) if name.endswith('.zip'))
+    for archive_name in archive_names:
+        archive_path = os.path.join(source_folder, archive_name)
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                for folder_name in classify_zip_entry(info.filename, patterns):
+                    release_files[CATEGORIES[folder_name]].append(
+                        ReleaseFile(archive_path, info.filename,
+                                    info.file_size, info.CRC))
+    return release_files
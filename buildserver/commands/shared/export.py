@@ -0,0 +1,447 @@
+# coding=utf-8
+"""Export snapshot tables to gzipped CSV, with the concept names added here
+
+The reference set exports of copy_final_views_to_tsv.sql named every
+concept id that they have, with a get_concept_preferred_term() call each.
+Here the rows are streamed out with a server-side cursor, as
+they are, and a column '<x>_name' is filled in from the TermDictionary
+with the preferred term of the column '<x>_id'. The CSV is written the
+way COPY ... CSV HEADER writes it, so the files are the same as before.
+
+The COPY statements of copy_final_views_to_tsv.sql are run from here too:
+each one is turned into a COPY ... TO STDOUT, into a file of the output
+folder. All of the exports are independent, and run_exports runs a few at
+a time, each on its own connection, while their output is compressed by a
+ParallelBlockWriter (see compress.py).
+
+NORMALIZED_EXPORTS are the same tables without the name columns, for the
+normalized profile, whose files refer to concepts by id only.
+
+Any of the table exports can be written as NDJSON instead of CSV: one JSON
+object per row, whose JSON columns (e.g. descriptions, parents) are nested
+in it as they are, instead of being quoted into a CSV field.
+"""
+import datetime
+import json
+import os
+import re
+import threading
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .compress import Compression, ParallelBlockWriter
+
+FETCH_ROWS = 10000
+FORMATS = ('csv', 'ndjson')
+# COPY ... CSV with a quote and a delimiter that row_to_json() never writes
+# (it escapes control characters): each JSON document goes out as it is
+_NDJSON_OPTIONS = " WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')"
+# The exports that can be split into shards by id range: name -> (the table
+# of the ids, the output column that has them)
+SHARDED = {
+    'snomed_denormalized_concept_view_for_current_snapshot': (
+        'current_concept_snapshot', 'component_id'),
+    'snomed_normalized_concept_view_for_current_snapshot': (
+        'current_concept_snapshot', 'component_id'),
+}
+_COPY = re.compile(r"""
+    ^COPY \s* \( (?P<query> .* ) \) \s* TO \s+
+    (?: PROGRAM \s+ 'gzip \s* > \s* (?P<program_path> [^']+ )'
+      | '(?P<path> [^']+ )' )
+    (?P<options> .* )$
+""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+
+class Export(namedtuple('Export', ['table', 'columns'])):
+    """A table export
+
+    :param table: the table (or view) the rows come from
+    :param columns: the output columns, in order; a name ending in '_name'
+        is the preferred term of the '_id' column of the same name, the
+        others are selected from the table. 'a AS b' selects a, as b.
+    """
+
+    @property
+    def names(self):
+        """The output column names"""
+        return [column.split(' AS ')[-1] for column in self.columns]
+
+    @property
+    def selected(self):
+        """The columns that come from the table"""
+        return [column for column in self.columns
+                if not _is_name(column)]
+
+    @property
+    def named(self):
+        """Whether it has name columns, and so needs the preferred terms"""
+        return len(self.selected) < len(self.columns)
+
+    def query(self, where=None):
+        """The SELECT of the columns that come from the table"""
+        return 'SELECT {} FROM {}{}'.format(
+            ', '.join(_select(column) for column in self.selected),
+            self.table, '' if where is None else ' WHERE ' + where)
+
+    def ids_only(self):
+        """The same export without its name columns"""
+        return self._replace(columns=self.selected)
+
+
+def _is_name(column):
+    return column.endswith('_name') and ' AS ' not in column
+
+
+def _select(column):
+    source, _, alias = column.partition(' AS ')
+    return '"{}"{}'.format(source, ' AS "{}"'.format(alias) if alias else '')
+
+
+_REFSET = ['id', 'effective_time', 'active', 'module_id', 'module_name',
+           'refset_id', 'refset_name', 'referenced_component_id',
+           'referenced_component_name']
+
+# File name (without .csv.gz) -> Export
+EXPORTS = OrderedDict([
+    ('reference_set_descriptor_reference_set_expanded_view', Export(
+        'current_reference_set_descriptor_reference_set_snapshot', _REFSET + [
+            'attribute_description_id', 'attribute_description_name',
+            'attribute_type_id', 'attribute_type_name', 'attribute_order'])),
+    ('simple_reference_set_expanded_view', Export(
+        'current_simple_reference_set_snapshot', _REFSET)),
+    ('ordered_reference_set_expanded_view', Export(
+        'current_ordered_reference_set_snapshot',
+        _REFSET[:3] + ['order'] + _REFSET[3:] + [
+            'linked_to_id', 'linked_to_name'])),
+    ('attribute_value_reference_set_expanded_view', Export(
+        'current_attribute_value_reference_set_snapshot',
+        _REFSET + ['value_id', 'value_name'])),
+    ('simple_map_reference_set_expanded_view', Export(
+        'current_simple_map_reference_set_snapshot',
+        _REFSET + ['map_target'])),
+    ('complex_map_reference_set_expanded_view', Export(
+        'current_complex_map_reference_set_snapshot', _REFSET + [
+            'correlation_id', 'correlation_name', 'map_group',
+            'map_priority', 'map_rule', 'map_advice', 'map_target',
+            'map_block'])),
+    ('extended_map_reference_set_expanded_view', Export(
+        'current_extended_map_reference_set_snapshot', _REFSET + [
+            'correlation_id', 'correlation_name', 'map_category_id',
+            'map_category_name', 'map_group', 'map_priority', 'map_rule',
+            'map_advice', 'map_target'])),
+    ('query_specification_reference_set_expanded_view', Export(
+        'current_query_specification_reference_set_snapshot',
+        _REFSET + ['query'])),
+    ('annotation_reference_set_expanded_view', Export(
+        'current_annotation_reference_set_snapshot',
+        _REFSET + ['annotation'])),
+    ('association_reference_set_expanded_view', Export(
+        'current_association_reference_set_snapshot',
+        _REFSET + ['target_component_id', 'target_component_name'])),
+    ('module_dependency_reference_set_expanded_view', Export(
+        'current_module_dependency_reference_set_snapshot',
+        _REFSET + ['source_effective_time', 'target_effective_time'])),
+    ('description_format_reference_set_expanded_view', Export(
+        'current_description_format_reference_set_snapshot', _REFSET + [
+            'description_format_id', 'description_format_name',
+            'description_length'])),
+])
+# The exports of the normalized profile, which name no concepts: the names
+# are in concept_names (see copy_normalized_views_to_tsv.sql). It has the
+# language reference set and the relationships here too; the denormalized
+# profile copies them from their views, which join the names in.
+NORMALIZED_EXPORTS = OrderedDict(
+    [('language_reference_set', Export(
+        'current_language_reference_set_snapshot',
+        _REFSET + ['acceptability_id']).ids_only())] +
+    [(re.sub(r'_expanded_view$', '', name), export.ids_only())
+     for name, export in EXPORTS.items()] +
+    [('snomed_relationship_for_current_snapshot', Export(
+        'current_relationship_snapshot', [
+            'id AS component_id', 'effective_time', 'active', 'module_id',
+            'relationship_group', 'source_id', 'destination_id', 'type_id',
+            'characteristic_type_id', 'modifier_id']))])
+
+
+# A file that an export wrote
+Written = namedtuple('Written', ['file_name', 'rows', 'bytes_out', 'sha256'])
+
+
+def csv_value(value):
+    """A value as COPY ... CSV writes it: NULL is empty, and a value is
+    quoted if it is empty or has a comma, quote or line break in it"""
+    if value is None:
+        return ''
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if not isinstance(value, str):
+        return str(value)
+    if not value or any(character in value for character in ',"\r\n'):
+        return '"{}"'.format(value.replace('"', '""'))
+    return value
+
+
+def csv_lines(rows):
+    """The CSV lines of rows, as one string"""
+    return ''.join(','.join(csv_value(value) for value in row) + '\n'
+                   for row in rows)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def ndjson_lines(names, rows):
+    """The rows as JSON objects, one per line, the way row_to_json() writes
+    them"""
+    return ''.join(
+        json.dumps(OrderedDict(zip(names, row)), ensure_ascii=False,
+                   separators=(',', ':'), default=_json_value) + '\n'
+        for row in rows)
+
+
+def named_rows(export, rows, preferred_terms):
+    """Add the name columns of an export to a batch of selected rows"""
+    if not rows:
+        return []
+    columns = dict(zip(export.selected, zip(*rows)))
+    output = []
+    for column in export.columns:
+        if _is_name(column):
+            output.append(preferred_terms.lookup(
+                columns[column[:-len('_name')] + '_id']))
+        else:
+            output.append(columns[column])
+    return list(zip(*output))
+
+
+def write_export(conn, name, export, preferred_terms, output_folder,
+                 compression=Compression('gzip', None), threads=1,
+                 file_format='csv'):
+    """Export a table to <output_folder>/<name>.csv.gz (or .bz2, .xz...)
+
+    :param conn: a connection that is not in autocommit mode; the rows
+        are read in a transaction of their own, with a server-side cursor
+    :param threads: the threads that compress the file
+    :param file_format: one of FORMATS; ndjson writes <name>.ndjson.gz
+    :return: a Written
+    """
+    path = os.path.join(
+        output_folder, name + '.' + file_format + compression.extension)
+    with metrics.stage('export/' + name, table=export.table,
+                       codec=compression.codec) as stage:
+        cursor = conn.cursor(name='export_' + name)
+        cursor.itersize = FETCH_ROWS
+        rows = 0
+        try:
+            cursor.execute(export.query())
+            with ParallelBlockWriter(path, compression, threads) as output:
+                if file_format == 'csv':
+                    output.write(csv_lines([export.names]))
+                while True:
+                    batch = cursor.fetchmany(FETCH_ROWS)
+                    if not batch:
+                        break
+                    batch = named_rows(export, batch, preferred_terms)
+                    if file_format == 'csv':
+                        output.write(csv_lines(batch))
+                    else:
+                        output.write(ndjson_lines(export.names, batch))
+                    rows += len(batch)
+        finally:
+            cursor.close()
+            conn.rollback()
+        stage.rows = rows
+        stage.bytes_in = output.bytes_in
+        stage.bytes_out = output.bytes_out
+    return Written(os.path.basename(path), rows, output.bytes_out,
+                   output.sha256)
+
+
+class CopyExport(namedtuple('CopyExport', ['query', 'options', 'file_name',
+                                           'compressed'])):
+    """A COPY statement of an export script, made to write to STDOUT
+
+    :param query: what it copies
+    :param options: e.g. ' CSV HEADER'
+    :param file_name: the file that it wrote to, without the .gz
+    :param compressed: whether it went through gzip
+    """
+
+    @property
+    def statement(self):
+        return 'COPY ({}) TO STDOUT{}'.format(self.query, self.options)
+
+    def shard(self, column, start, end, number):
+        """The rows of the export with start <= column < end, into file
+        <name>.shard<number>.<rest of the file name>
+
+        :param start: None for no lower bound
+        :param end: None for no upper bound
+        """
+        bounds = []
+        if start is not None:
+            bounds.append('shard.{} >= {:d}'.format(column, start))
+        if end is not None:
+            bounds.append('shard.{} < {:d}'.format(column, end))
+        name, _, rest = self.file_name.partition('.')
+        return self._replace(
+            query='SELECT * FROM ({}) AS shard WHERE {}'.format(
+                self.query, ' AND '.join(bounds) or 'true'),
+            file_name='{}.shard{:03d}.{}'.format(name, number, rest))
+
+    @property
+    def tabular(self):
+        """Whether it writes a .csv file, which can be NDJSON instead"""
+        return self.file_name.endswith('.csv')
+
+    def as_ndjson(self):
+        """The same rows, as JSON objects, into a .ndjson file; shard it
+        first, if at all"""
+        return self._replace(
+            query='SELECT row_to_json(document) FROM ({}) AS document'.format(
+                self.query),
+            options=_NDJSON_OPTIONS,
+            file_name=self.file_name[:-len('.csv')] + '.ndjson')
+
+
+def copy_exports(statements):
+    """The COPY ... TO PROGRAM 'gzip > <path>' and COPY ... TO '<path>'
+    statements of a script, by the name of their file (up to the first
+    '.'), as an OrderedDict of CopyExports
+
+    :param statements: from sql_script.parse_script
+    """
+    exports = OrderedDict()
+    for statement in statements:
+        match = _COPY.match(statement.text)
+        if match is None:
+            raise ValueError(
+                'Statement {} on line {} is not a COPY to a file'.format(
+                    statement.number, statement.line))
+        path = match.group('program_path') or match.group('path')
+        file_name = os.path.basename(path.strip())
+        compressed = match.group('program_path') is not None
+        if compressed and file_name.endswith('.gz'):
+            file_name = file_name[:-len('.gz')]
+        exports[file_name.split('.')[0]] = CopyExport(
+            match.group('query'), match.group('options').rstrip(),
+            file_name, compressed)
+    return exports
+
+
+def shard_ranges(cursor, table, shards):
+    """Split the ids of a table into ranges of about the same number of
+    rows, as (start, end) pairs; the first starts, and the last ends, with
+    None"""
+    cursor.execute(
+        'SELECT min(id) FROM (SELECT id, ntile(%s) OVER (ORDER BY id) '
+        'AS shard FROM {}) AS ids GROUP BY shard ORDER BY 1'.format(table),
+        (max(1, shards),))
+    starts = [start for start, in cursor.fetchall()][1:]
+    return list(zip([None] + starts, starts + [None]))
+
+
+def write_manifest(output_folder, name, column, ranges, shards):
+    """Write <name>.manifest.json, which lists the shards of an export
+
+    :param ranges: the (start, end) of each shard, from shard_ranges
+    :param shards: the Written of each shard
+    :return: the manifest's file name
+    """
+    manifest = OrderedDict([
+        ('export', name),
+        ('shard_key', column),
+        ('rows', sum(shard.rows or 0 for shard in shards)),
+        ('shards', [OrderedDict([
+            ('file', shard.file_name),
+            ('first_id', start),
+            ('end_id', end),
+            ('rows', shard.rows),
+            ('bytes', shard.bytes_out),
+            ('sha256', shard.sha256),
+        ]) for (start, end), shard in zip(ranges, shards)]),
+    ])
+    file_name = name + '.manifest.json'
+    path = os.path.join(output_folder, file_name)
+    with open(path + '.partial', 'w') as output:
+        json.dump(manifest, output, indent=2)
+        output.write('\n')
+    os.rename(path + '.partial', path)
+    return file_name
+
+
+def write_copy(conn, name, copy_export, output_folder,
+               compression=Compression('gzip', None), threads=1):
+    """Run a CopyExport into its file in output_folder
+
+    A file that was not compressed before is not compressed now.
+
+    :return: a Written; its rows are None if the server does not say
+    """
+    if not copy_export.compressed:
+        compression = Compression('none', None)
+    path = os.path.join(
+        output_folder, copy_export.file_name + compression.extension)
+    with metrics.stage('export/' + name, codec=compression.codec) as stage:
+        cursor = conn.cursor()
+        try:
+            with ParallelBlockWriter(path, compression, threads) as output:
+                cursor.copy_expert(copy_export.statement, output,
+                                   size=1024 * 1024)
+        finally:
+            conn.rollback()
+        if cursor.rowcount >= 0:
+            stage.rows = cursor.rowcount
+        stage.bytes_in = output.bytes_in
+        stage.bytes_out = output.bytes_out
+    return Written(os.path.basename(path), stage.rows, output.bytes_out,
+                   output.sha256)
+
+
+def run_exports(jobs, connect, workers):
+    """Run export jobs, `workers` at a time, each with a connection
+
+    :param jobs: (name, function) pairs; a function is called with a
+        connection, which is not in autocommit mode
+    :param connect: opens a connection, e.g. connections.connect('export')
+    :return: {name: what its function returned}
+    :raises Exception: once all the jobs have run, if any of them failed
+    """
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def run(name, function):
+        if getattr(local, 'conn', None) is None:
+            local.conn = connect()
+            local.conn.autocommit = False
+            with lock:
+                opened.append(local.conn)
+        return function(local.conn)
+
+    results = OrderedDict()
+    failures = []
+    try:
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            futures = [(name, pool.submit(run, name, function))
+                       for name, function in jobs]
+            for name, future in futures:
+                error = future.exception()
+                if error is None:
+                    results[name] = future.result()
+                else:
+                    failures.append('{}: {}'.format(name, error))
+    finally:
+        for conn in opened:
+            conn.close()
+    if failures:
+        raise Exception('{} of {} exports failed:\n{}'.format(
+            len(failures), len(jobs), '\n'.join(failures)))
+    return results
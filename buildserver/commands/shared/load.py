@@ -4,33 +4,38 @@ from __future__ import absolute_import
 
 import multiprocessing
 import os
-import shutil
 import logging
 import contextlib
+import queue
+import time
+import zlib
 import wrapt
-from sqlalchemy import text
-from sil_snomed_server.app import db
-from sil_snomed_server.config.config import basedir
+from . import (
+    binary_copy, connections, load_plan, metrics, presnapshot, progress,
+    snapshot, sql_script, validate)
+from .discover import SNAPSHOT_FOLDER, ReleaseFile
 
-from sarge import run
-from collections import Iterable
-from datetime import datetime
+from collections import Iterable, OrderedDict
 
 LOGGER = logging.getLogger(__name__)
 MULTIPROCESSING_POOL_SIZE = multiprocessing.cpu_count()
+# Files bigger than this (uncompressed) are COPYed over several connections
+PARALLEL_COPY_THRESHOLD = 256 * 1024 * 1024
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+# Set in a pool worker to the pool's stop event; see execute_map_on_pool
+_pool_stop = None
 
-def _sqlalchemy_connection():
-    return db.session.connection().connection
 
 @contextlib.contextmanager
 def time_execution(fn):
-    """Measure the execution time fn ( a supplied function )"""
-    try:
-        start_time = datetime.now()
-        yield
-    finally:
-        secs = (datetime.now() - start_time).total_seconds()
-    LOGGER.debug('EXECUTED {}, took {}s'.format(fn.func_name, secs))
+    """Measure the execution time fn ( a supplied function )
+
+    It is recorded as a build metrics stage named after the function.
+    """
+    with metrics.stage(fn.__name__) as stage:
+        yield stage
+    LOGGER.debug('EXECUTED {}, took {}s'.format(
+        fn.__name__, stage.wall_seconds))
 
 
 @wrapt.decorator
@@ -40,17 +45,194 @@ def instrument(wrapped, instance, args, kwargs):
         return wrapped(*args, **kwargs)
 
 
-def _strip_first_line(source_file_path):
+def _open_source(release_file):
+    """Open a ReleaseFile in its zip, or a plain path to an extracted file"""
+    if isinstance(release_file, ReleaseFile):
+        return release_file.open()
+    return open(release_file, 'rb')
+
+
+@contextlib.contextmanager
+def _open_rf2(release_file):
     """
-    Discard the header row before loading the data.
-    Makes a backup file 'source_file_path.bak'.
+    Open an RF2 file for COPY, positioned after the header row.
+
+    The header is consumed as the file is read, so the data goes straight
+    from the release zip to the server; nothing is written to disk.
     """
-    run("sed -i.bak -e '1d' {}".format(source_file_path))
-    run("head -1 {}".format(source_file_path))
-    return source_file_path  # Should exist from here
+    with _open_source(release_file) as source:
+        source.readline()
+        yield source
+
+
+def _column_types(cursor, table_name, cols):
+    """The PostgreSQL types of the columns that a loader declares"""
+    cursor.execute(
+        'SELECT attname, format_type(atttypid, NULL) FROM pg_attribute '
+        'WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped',
+        (table_name,))
+    types = dict(cursor.fetchall())
+    return [types[col.strip('"')] for col in cols]
+
+
+def _copy_blocks(cursor, table_name, blocks, cols, freeze=False,
+                 binary=False):
+    """COPY line-aligned blocks of RF2 rows into a table"""
+    options = []
+    if binary:
+        blocks = binary_copy.encode_rf2(
+            blocks, _column_types(cursor, table_name, cols))
+        options.append('FORMAT binary')
+    if freeze:
+        options.append('FREEZE')
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN{}'.format(
+            table_name, ', '.join(cols),
+            ' WITH ({})'.format(', '.join(options)) if options else ''),
+        binary_copy.BlockReader(blocks), size=32768)
+
+
+def _unless_stopped(blocks):
+    """Pass blocks on until the pool that runs this job is stopped"""
+    for block in blocks:
+        if _pool_stop is not None and _pool_stop.is_set():
+            raise Exception('stopped, as another job failed')
+        yield block
+
+
+def _queued_blocks(block_queue):
+    """The blocks sent to a part; a string instead of a block is an error"""
+    for block in iter(block_queue.get, None):
+        if isinstance(block, str):
+            raise Exception(block)
+        yield block
+
+
+def _copy_part(table_name, release_file, checksum, cols, binary, parts,
+               block_queue, result_queue, part):
+    """COPY the blocks sent to one part over a connection of its own
+
+    The part always reports a result, and always drains its queue, so that
+    the reader is never left waiting on it; even when it cannot connect.
+    """
+    blocks = _queued_blocks(block_queue)
+    conn = None
+    try:
+        conn = connections.connect('load')
+        cursor = conn.cursor()
+        _copy_blocks(cursor, table_name, blocks, cols, binary=binary)
+        rows = cursor.rowcount
+        _record_load(cursor, table_name, release_file, checksum, part, parts,
+                     rows)
+        conn.commit()
+        result_queue.put((part, rows, None))
+    except Exception as exception:
+        result_queue.put((part, 0, str(exception)))
+        try:
+            for _ in blocks:
+                pass  # Keep draining, so that the reader does not block
+        except Exception:
+            pass
+        if conn is not None:
+            conn.rollback()
+            _record_load(conn.cursor(), table_name, release_file, checksum,
+                         part, parts, None, error=str(exception))
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
 
-    # Exiting from here is a bug
-    raise Exception('Unable to rewrite %s' % source_file_path)
+
+def _put_block(block_queue, block, worker):
+    """Queue a block for a part; give up on it if its process has died"""
+    while worker.is_alive():
+        try:
+            block_queue.put(block, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _parallel_copy(table_name, release_file, checksum, cols, parts,
+                   binary=False, loaded_parts=(), watermark=None,
+                   id_columns=None):
+    """COPY one big file into a table over several connections at once
+
+    The file is read once, cut into line-aligned blocks and dealt out
+    round-robin to `parts` processes, each with its own connection and
+    transaction. A part that fails does not undo the parts that committed.
+    The blocks are dealt out the same way on every run, so a resumed load
+    only sends the parts that are not in the manifest yet. A part whose
+    process dies is a failed part; it is not waited for.
+
+    :param checksum: of the file, for the manifest; see _source_checksum
+    :param loaded_parts: the part numbers that are already loaded
+    :param watermark: only COPY the rows after it; see
+        load_plan.newer_rows
+    :param id_columns: check the ids of these columns as the file is read;
+        see validate.checked_blocks
+    """
+    block_queues = {
+        part: multiprocessing.Queue(maxsize=2)
+        for part in range(parts) if part not in loaded_parts
+    }
+    result_queue = multiprocessing.Queue()
+    workers = {
+        part: multiprocessing.Process(
+            target=_copy_part,
+            args=(table_name, release_file, checksum, cols, binary, parts,
+                  block_queue, result_queue, part))
+        for part, block_queue in block_queues.items()
+    }
+    for worker in workers.values():
+        worker.start()
+    read_error = None
+    try:
+        with _open_rf2(release_file) as source:
+            blocks = _unless_stopped(progress.counted(
+                load_plan.iter_blocks(source, COPY_BLOCK_SIZE), table_name,
+                release_file, _source_size(release_file)))
+            if id_columns is not None:
+                blocks = validate.checked_blocks(blocks, id_columns)
+            if watermark is not None:
+                blocks = load_plan.newer_rows(blocks, watermark)
+            for part, block in load_plan.deal_blocks(blocks, parts):
+                if part in block_queues:
+                    _put_block(block_queues[part], block, workers[part])
+    except Exception as exception:
+        # Also covers a CRC mismatch, which zipfile raises at the very end
+        read_error = 'Unable to read {}: {}'.format(release_file, exception)
+    for part, block_queue in block_queues.items():
+        _put_block(block_queue, read_error, workers[part])
+
+    results = {}
+    while len(results) < len(workers):
+        try:
+            part, rows, error = result_queue.get(timeout=1)
+        except queue.Empty:
+            if any(worker.is_alive() for worker in workers.values()):
+                continue
+            try:  # What the last parts sent before they ended
+                part, rows, error = result_queue.get(timeout=1)
+            except queue.Empty:
+                break  # A part died without reporting; do not hang
+        results[part] = (rows, error)
+    for part in workers:
+        if part not in results:
+            results[part] = (0, 'part {} of {} ended without a result'.format(
+                part, release_file))
+    for worker in workers.values():
+        worker.join()
+    for block_queue in block_queues.values():
+        # What was queued for a part that died is never read; do not wait
+        # to flush it when this process exits
+        block_queue.cancel_join_thread()
+        block_queue.close()
+    errors = [error for _, error in results.values() if error is not None]
+    if errors:
+        raise Exception('; '.join(sorted(set(errors))))
+    return sum(rows for rows, _ in results.values())
 
 
 def _confirm_param_is_an_iterable(param):
@@ -59,66 +241,640 @@ def _confirm_param_is_an_iterable(param):
         raise Exception('Expected an iterable')
 
 
-def _load(table_name, file_path_list, cols):
-    """The actual worker method that reads the data into the database"""
+def _copy_with_freeze(cursor, table_name, blocks, cols, binary=False):
+    """COPY FREEZE if this job gets to own the table, else plain COPY
+
+    FREEZE is only allowed into a table that was truncated in the same
+    transaction, so one job per table does it: the first that claims the
+    table's bulk_load_freeze row (see prepare_bulk_load). The other jobs
+    skip the claimed row and do a plain COPY without locking anything. The
+    claimant locks the table before it reads it, and truncates it only if
+    it is still empty; rows that another job committed first are kept.
+    The claim is committed with the COPY, or given back if it fails.
+    """
+    cursor.execute(
+        'SELECT 1 FROM bulk_load_freeze WHERE table_name = %s '
+        'AND NOT claimed FOR UPDATE SKIP LOCKED', (table_name,))
+    if cursor.fetchone() is None:
+        _copy_blocks(cursor, table_name, blocks, cols, binary=binary)
+        return
+    cursor.execute(
+        'UPDATE bulk_load_freeze SET claimed = true WHERE table_name = %s',
+        (table_name,))
+    cursor.execute(
+        'LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(table_name))
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM {})'.format(table_name))
+    if not cursor.fetchone()[0]:
+        cursor.execute('TRUNCATE {}'.format(table_name))
+        _copy_blocks(cursor, table_name, blocks, cols, freeze=True,
+                     binary=binary)
+        return
+    _copy_blocks(cursor, table_name, blocks, cols, binary=binary)
+
+
+def _load(table_name, file_path_list, cols, freeze=False, binary=False,
+          watermarks=None, copy_parts=1, checksums=None, id_columns=None):
+    """The actual worker method that reads the data into the database
+
+    Each file, or each part of a file that is split over several
+    connections, is recorded in the load manifest in the same transaction
+    as its COPY; files that the manifest already has are skipped.
+
+    :param freeze: COPY FREEZE where possible; see prepare_bulk_load
+    :param binary: encode the rows for binary COPY; see
+        binary_copy.encode_rf2
+    :param watermarks: for a delta load, only the rows after the watermark
+        of the table are loaded; see prepare_delta_load
+    :param copy_parts: the connections that a big file is COPYed over; see
+        split_copy_budget
+    :param checksums: {file: checksum}, from prepare_manifest; a file that
+        is not in it is read for its checksum here
+    :param id_columns: check the SCTIDs of these columns as the rows are
+        sent, and fail the file's COPY at a bad one (see validate.py)
+    """
     _confirm_param_is_an_iterable(file_path_list)
-    conn = _sqlalchemy_connection()
+    watermark = (watermarks or {}).get(table_name)
+    conn = connections.for_stage('load')
     cursor = conn.cursor()
 
     for file_path in file_path_list:
-        rewritten_file = _strip_first_line(file_path)
+        cursor.execute(
+            "SELECT part, parts FROM load_manifest "
+            "WHERE source = %s AND status = 'loaded'", (str(file_path),))
+        loaded_parts = cursor.fetchall()
+        conn.commit()
+        parts, pending = load_plan.file_parts(
+            loaded_parts, copy_parts,
+            _source_size(file_path) >= PARALLEL_COPY_THRESHOLD)
+        if not pending:
+            print('Skipping {}; the manifest has it as loaded'.format(
+                file_path))
+            continue
+        checksum = (checksums or {}).get(str(file_path))
+        if checksum is None:
+            checksum = _source_checksum(file_path)
+
         try:
-            with open(rewritten_file) as rewrite:
-                cursor.copy_from(
-                    rewrite, table_name, size=32768, columns=cols)
-                cursor.execute('ANALYZE {};'.format(table_name))
+            with metrics.stage('load/' + table_name,
+                               source=str(file_path)) as stage:
+                stage.bytes_in = _source_size(file_path)
+                if parts > 1:
+                    stage.rows = _parallel_copy(
+                        table_name, file_path, checksum, cols, parts,
+                        binary=binary,
+                        loaded_parts={part for part, _ in loaded_parts},
+                        watermark=watermark, id_columns=id_columns)
+                else:
+                    with _open_rf2(file_path) as source:
+                        blocks = _unless_stopped(progress.counted(
+                            load_plan.iter_blocks(source, COPY_BLOCK_SIZE),
+                            table_name, file_path, stage.bytes_in))
+                        if id_columns is not None:
+                            blocks = validate.checked_blocks(
+                                blocks, id_columns)
+                        if watermark is not None:
+                            blocks = load_plan.newer_rows(blocks, watermark)
+                        if freeze:
+                            _copy_with_freeze(cursor, table_name, blocks,
+                                              cols, binary=binary)
+                        else:
+                            _copy_blocks(cursor, table_name, blocks, cols,
+                                         binary=binary)
+                    stage.rows = cursor.rowcount
+                    _record_load(cursor, table_name, file_path, checksum, 0,
+                                 1, stage.rows)
                 conn.commit()
-            # Now restore the file (reduces space used by half!)
-            os.rename(file_path + '.bak', file_path)
         except Exception as exception:
-            os.rename(file_path + '.bak', file_path)
-            print("Unable to load data from file: {}. Exception: {}".
-                  format(file_path, exception))
+            conn.rollback()
+            if parts == 1:  # The parts of a split file record their own
+                _record_load(cursor, table_name, file_path, checksum, 0, 1,
+                             None, error=str(exception))
+                conn.commit()
+            raise Exception('Unable to load data from file: {}. '
+                            'Exception: {}'.format(file_path, exception))
+
+
+def _record_load(cursor, table_name, release_file, checksum, part, parts,
+                 rows, error=None):
+    """Write the manifest row of a file (or a part of one)
+
+    Call it in the transaction of the COPY, so that the two commit together.
+
+    :param checksum: from _source_checksum
+    """
+    cursor.execute(
+        "INSERT INTO load_manifest (source, part, parts, table_name, size, "
+        "checksum, rows, status, error) VALUES (%(source)s, %(part)s, "
+        "%(parts)s, %(table_name)s, %(size)s, %(checksum)s, %(rows)s, "
+        "%(status)s, %(error)s) "
+        "ON CONFLICT (source, part) DO UPDATE SET parts = EXCLUDED.parts, "
+        "table_name = EXCLUDED.table_name, size = EXCLUDED.size, "
+        "checksum = EXCLUDED.checksum, rows = EXCLUDED.rows, "
+        "status = EXCLUDED.status, error = EXCLUDED.error, "
+        "updated_at = now()", {
+            'source': str(release_file),
+            'part': part,
+            'parts': parts,
+            'table_name': table_name,
+            'size': _source_size(release_file),
+            'checksum': checksum,
+            'rows': rows,
+            'status': 'loaded' if error is None else 'failed',
+            'error': error,
+        })
+
+
+@instrument
+def prepare_manifest(tables, path_dict, delta=False):
+    """Create the load manifest, and drop whatever it can no longer vouch for
+
+    load_manifest has a row per file (or per part of a split file), with
+    its size, CRC-32, row count and status. A 'loaded' row is committed
+    together with its rows, so a rerun can skip it. A table is truncated
+    and loaded again, together with its manifest rows, when those rows are
+    not for the release files on disk, or do not add up to the rows in the
+    table; e.g. after crash recovery has emptied an UNLOGGED table.
+
+    A delta load appends to what earlier releases loaded, so there only
+    the row counts are checked, and a mismatch is an error.
+
+    :param tables: e.g. from rf2_tables()
+    :param path_dict: the enumerate_release_files inventory to be loaded
+    :param delta: whether this is a delta load (see prepare_delta_load)
+    :return: {file: checksum}, for the loaders, so that a plain file is
+        read for its checksum once
+    """
+    checksums = {
+        str(release_file): _source_checksum(release_file)
+        for file_list in path_dict.values() for release_file in file_list
+    }
+    release_files = {
+        (str(release_file), _source_size(release_file),
+         checksums[str(release_file)])
+        for file_list in path_dict.values() for release_file in file_list
+    }
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS load_manifest ('
+        'source text NOT NULL, part integer NOT NULL, '
+        'parts integer NOT NULL, table_name text NOT NULL, '
+        'size bigint NOT NULL, checksum text NOT NULL, rows bigint, '
+        'status text NOT NULL, error text, '
+        'updated_at timestamp with time zone NOT NULL DEFAULT now(), '
+        'PRIMARY KEY (source, part))')
+    for table_name in tables:
+        cursor.execute(
+            "SELECT source, size, checksum, rows FROM load_manifest "
+            "WHERE table_name = %s AND status = 'loaded'", (table_name,))
+        loaded = cursor.fetchall()
+        cursor.execute('SELECT count(*) FROM {}'.format(table_name))
+        row_count = cursor.fetchone()[0]
+        if load_plan.table_is_loaded(row_count, loaded, release_files,
+                                     delta):
+            if loaded:
+                print('Resuming {}: {} rows in {} manifest entries'.format(
+                    table_name, row_count, len(loaded)))
+            continue
+        if delta:
+            raise Exception(
+                'The {} rows of {} do not match the load manifest; it needs '
+                'a full load before deltas can be added'.format(
+                    row_count, table_name))
+        print('Reloading {}: its {} rows do not match the manifest'.format(
+            table_name, row_count))
+        cursor.execute('TRUNCATE {}'.format(table_name))
+        cursor.execute(
+            'DELETE FROM load_manifest WHERE table_name = %s', (table_name,))
+    conn.commit()
+    return checksums
+
+
+@instrument
+def prepare_delta_load(tables):
+    """Work out the rows that a delta load is to append to each table
+
+    A table's watermark is its latest effective_time before the load; only
+    the rows after it are loaded. The watermarks are kept in
+    delta_watermark until finish_delta_load, so that a resumed load filters
+    against the same ones. A new delta load also clears the ids that the
+    previous one marked as changed.
+
+    :param tables: e.g. from rf2_tables()
+    :return: {table name: YYYYMMDD bytes, or None for an empty table}
+    """
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS delta_watermark ('
+        'table_name text PRIMARY KEY, effective_time date)')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS changed_components ('
+        'table_name text NOT NULL, id text NOT NULL, '
+        'PRIMARY KEY (table_name, id))')
+    cursor.execute('SELECT NOT EXISTS (SELECT 1 FROM delta_watermark)')
+    if cursor.fetchone()[0]:
+        cursor.execute('TRUNCATE changed_components')
+    for table_name in tables:
+        cursor.execute(
+            'INSERT INTO delta_watermark '
+            'SELECT %s, max(effective_time) FROM {} '
+            'ON CONFLICT (table_name) DO NOTHING'.format(table_name),
+            (table_name,))
+    cursor.execute(
+        'SELECT table_name, effective_time FROM delta_watermark '
+        'WHERE table_name = ANY(%s)', (list(tables),))
+    watermarks = {
+        table_name: None if effective_time is None else
+        effective_time.strftime('%Y%m%d').encode('ascii')
+        for table_name, effective_time in cursor.fetchall()
+    }
+    conn.commit()
+    return watermarks
+
+
+@instrument
+def finish_delta_load(watermarks):
+    """Mark the ids that the delta load appended rows for as changed
+
+    Later stages can read changed_components to limit their work to them.
+
+    :param watermarks: from prepare_delta_load
+    """
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    for table_name, watermark in sorted(watermarks.items()):
+        cursor.execute(
+            'INSERT INTO changed_components (table_name, id) '
+            'SELECT DISTINCT %s, id::text FROM {} '
+            'WHERE %s::date IS NULL OR effective_time > %s::date '
+            'ON CONFLICT DO NOTHING'.format(table_name),
+            (table_name, watermark and watermark.decode('ascii'),
+             watermark and watermark.decode('ascii')))
+        print('{}: {} ids changed'.format(table_name, cursor.rowcount))
+    cursor.execute('TRUNCATE delta_watermark')
+    conn.commit()
+
+
+def rf2_tables():
+    """The curr_*_f tables that the RF2 files are loaded into"""
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT tablename FROM pg_tables "
+        "WHERE schemaname = current_schema() "
+        "AND tablename LIKE 'curr\\_%\\_f' ORDER BY tablename")
+    tables = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return tables
+
+
+@instrument
+def prepare_bulk_load(tables):
+    """Strip the RF2 tables down for a fast first load
+
+    The primary keys and indexes are dropped, so that they are built once
+    after the load instead of row by row during it. Their definitions are
+    kept in bulk_load_deferred_ddl until finish_bulk_load rebuilds them.
+    The tables are made UNLOGGED, so the load writes no WAL; they stay that
+    way, since the build database is thrown away with the build instance.
+
+    Each table gets a row in bulk_load_freeze, which one load job claims
+    to truncate the table and COPY FREEZE into it (see _copy_with_freeze).
+    The parts of a split file, and the other jobs, cannot FREEZE their
+    rows, so finish_load freezes the tables with VACUUM before it builds
+    their indexes.
+
+    :param tables: e.g. from rf2_tables()
+    """
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS bulk_load_deferred_ddl ('
+        'object_name text PRIMARY KEY, table_name text NOT NULL, '
+        'is_constraint boolean NOT NULL, ddl text NOT NULL)')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS bulk_load_freeze ('
+        'table_name text PRIMARY KEY, claimed boolean NOT NULL DEFAULT false)')
+    for table_name in tables:
+        cursor.execute(
+            'INSERT INTO bulk_load_freeze (table_name) VALUES (%s) '
+            'ON CONFLICT (table_name) DO NOTHING', (table_name,))
+        cursor.execute(
+            "INSERT INTO bulk_load_deferred_ddl "
+            "SELECT conname, %(table)s, true, format("
+            "'ALTER TABLE %%s ADD CONSTRAINT %%I %%s', %(table)s, conname, "
+            "pg_get_constraintdef(oid)) "
+            "FROM pg_constraint "
+            "WHERE conrelid = %(table)s::regclass AND contype = 'p' "
+            "UNION ALL "
+            "SELECT indexname, %(table)s, false, indexdef FROM pg_indexes "
+            "WHERE schemaname = current_schema() AND tablename = %(table)s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %(table)s::regclass) "
+            "ON CONFLICT (object_name) DO NOTHING",
+            {'table': table_name})
+        cursor.execute(
+            "SELECT object_name, is_constraint FROM bulk_load_deferred_ddl "
+            "WHERE table_name = %s", (table_name,))
+        for object_name, is_constraint in cursor.fetchall():
+            if is_constraint:
+                cursor.execute(
+                    'ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}'.format(
+                        table_name, object_name))
+            else:
+                cursor.execute('DROP INDEX IF EXISTS {}'.format(object_name))
+        cursor.execute('ALTER TABLE {} SET UNLOGGED'.format(table_name))
+    conn.commit()
+
+
+def _finish_table(table_name):
+    """Rebuild the deferred keys and indexes of a table, then ANALYZE it
+
+    A bulk loaded table is frozen first, while it has no indexes, so that
+    its rows are not written again when they are first read.
+    """
+    conn = connections.connect('index')
+    try:
+        with metrics.stage('finish/' + table_name):
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT to_regclass('bulk_load_freeze') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute(
+                    'SELECT EXISTS (SELECT 1 FROM bulk_load_freeze '
+                    'WHERE table_name = %s)', (table_name,))
+                if cursor.fetchone()[0]:
+                    conn.commit()
+                    conn.autocommit = True  # VACUUM needs it
+                    cursor.execute('VACUUM (FREEZE) {}'.format(table_name))
+                    conn.autocommit = False
+                    cursor.execute(
+                        'DELETE FROM bulk_load_freeze WHERE table_name = %s',
+                        (table_name,))
+            cursor.execute(
+                "SELECT to_regclass('bulk_load_deferred_ddl') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute(
+                    "DELETE FROM bulk_load_deferred_ddl "
+                    "WHERE table_name = %s RETURNING ddl, is_constraint",
+                    (table_name,))
+                # The primary key first, then the plain indexes
+                deferred = sorted(
+                    cursor.fetchall(), key=lambda row: not row[1])
+                for ddl, _ in deferred:
+                    cursor.execute(ddl)
+            cursor.execute('ANALYZE {}'.format(table_name))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+@instrument
+def finish_load(tables, process_count=MULTIPROCESSING_POOL_SIZE):
+    """Build any deferred keys and indexes, and ANALYZE each table once
+
+    The tables are finished in parallel, the largest first.
+
+    :param tables: e.g. from rf2_tables()
+    """
+    conn = connections.for_stage('load')
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT relname FROM pg_class WHERE relname = ANY(%s) '
+        'ORDER BY pg_total_relation_size(oid) DESC', (list(tables),))
+    jobs = [(table_name,) for table_name, in cursor.fetchall()]
+    conn.commit()
+    return execute_map_on_pool(
+        jobs, process_count, run_job=_finish_table, describe=str,
+        measure=None)
+
+
+def _source_size(release_file):
+    """Uncompressed size in bytes; used to schedule the largest files first"""
+    if isinstance(release_file, ReleaseFile):
+        return release_file.size
+    return os.path.getsize(release_file)
+
 
+def _source_checksum(release_file):
+    """CRC-32 of the uncompressed content, in hex, for the load manifest
+
+    A ReleaseFile has it in the zip directory; a plain file is read for it.
+    """
+    if isinstance(release_file, ReleaseFile):
+        crc = release_file.crc
+    else:
+        crc = 0
+        with open(release_file, 'rb') as source:
+            for block in iter(lambda: source.read(COPY_BLOCK_SIZE), b''):
+                crc = zlib.crc32(block, crc)
+    return '{:08x}'.format(crc & 0xffffffff)
+
+
+def split_copy_budget(jobs, process_count=MULTIPROCESSING_POOL_SIZE):
+    """Share the worker budget between the load pool and the big files
+
+    Each big file (see PARALLEL_COPY_THRESHOLD) is COPYed over `parts`
+    connections, from a pool worker that then only reads it. The pool is
+    shrunk by what the parts add, so that about process_count COPYs run at
+    once, and not process_count for each big file.
+
+    :param jobs: from schedule_load_jobs
+    :return: (the number of pool workers, the parts of a big file)
+    """
+    big_files = sum(1 for job in jobs
+                    if _source_size(job[1]) >= PARALLEL_COPY_THRESHOLD)
+    parts = max(1, process_count // max(1, big_files))
+    return max(1, process_count - big_files * (parts - 1)), parts
 
-def _execute_and_commit(statement, view_name=None):
-    """Execute an SQL statement; used to parallelize view refereshes"""
-    with _sqlalchemy_connection() as conn:
-        with conn.begin() as trans:
-            trans.execute(statement)
-            if view_name:
-              cur.execute('ANALYZE {};'.format(view_name))
-        trans.commit()
 
+def schedule_load_jobs(path_dict, **options):
+    """Turn an enumerate_release_files inventory into (category, file) jobs
 
-def execute_map_on_pool(callable_input_map,
-                        process_count=MULTIPROCESSING_POOL_SIZE):
-    """The obvious choice ( Pool ) has not been used because it does not play
-    well with our performance measuring decorator
+    Each job loads a single file. The jobs are ordered largest first, so
+    that the big Description and Relationship files start straight away
+    and the small refsets fill in the gaps around them.
 
-    :param: callable_input_map
+    :param path_dict:
+    :param options: passed on to the loaders, e.g. freeze=True
     """
-    processes = [
-        multiprocessing.Process(target=fn, args=(inp,) if inp is not None else ())
-        for fn, inp in iter(callable_input_map.items())
+    jobs = [
+        (category, release_file, options)
+        for category in LOADERS
+        for release_file in path_dict.get(category, [])
     ]
-    for p in processes:
-      p.start()
-    for p in processes:
-      p.join()
+    return sorted(
+        jobs, key=lambda job: _source_size(job[1]), reverse=True)
+
+
+def _run_load_job(category, release_file, options):
+    options = dict(options)
+    if options.pop('validate_ids', False):
+        options['id_columns'] = validate.ID_COLUMNS.get(
+            category, validate.REFSET_COLUMNS)
+    LOADERS[category]([release_file], **options)
+
+
+def _describe_load_job(category, release_file, options):
+    return '{} {} ({:.1f}MB)'.format(
+        category, release_file, _source_size(release_file) / 1e6)
+
+
+def _measure_load_job(category, release_file, options):
+    return _source_size(release_file)
 
 
-def load_concepts(file_path_list):
+def _presnapshot_path(folder, release_file):
+    if isinstance(release_file, ReleaseFile):
+        release_file = release_file.member
+    return os.path.join(folder, os.path.basename(release_file))
+
+
+def _presnapshot_job(category, release_file, options):
+    """Write the current snapshot of one file (see presnapshot.py)"""
+    output_path = _presnapshot_path(options['folder'], release_file)
+    with metrics.stage('presnapshot/' + category,
+                       source=str(release_file)) as stage, \
+            _open_source(release_file) as source:
+        header = source.readline()
+        stage.bytes_in = _source_size(release_file)
+        stage.rows = presnapshot.write_snapshot(
+            header, progress.counted(
+                load_plan.iter_blocks(source, COPY_BLOCK_SIZE), category,
+                release_file, stage.bytes_in),
+            output_path, snapshot_date=options['snapshot_date'],
+            temp_folder=options['folder'])
+        stage.bytes_out = os.path.getsize(output_path)
+
+
+def presnapshot_release_files(path_dict, folder=SNAPSHOT_FOLDER,
+                              snapshot_date=None):
+    """Cut every file down to its current snapshot, before the load
+
+    The snapshots are written to folder, a file per worker, and take the
+    place of the files in the inventory that is returned, so the loaders
+    and the load manifest only ever see the snapshot rows.
+
+    :param snapshot_date: a date; the rows after it are left out
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    jobs = schedule_load_jobs(
+        path_dict, folder=folder, snapshot_date=snapshot_date.strftime(
+            '%Y%m%d').encode('ascii') if snapshot_date else None)
+    with metrics.stage('presnapshot_release_files', files=len(jobs)):
+        results = execute_map_on_pool(jobs, run_job=_presnapshot_job)
+    errors = [error for _, _, error in results if error is not None]
+    if errors or len(results) < len(jobs):
+        raise Exception('Unable to write the snapshot files:\n{}'.format(
+            '\n'.join(errors)))
+    return {
+        category: [_presnapshot_path(folder, release_file)
+                   for release_file in path_dict.get(category, [])]
+        for category in LOADERS
+    }
+
+
+def _pool_worker(run_job, job_queue, result_queue, stop, stop_on):
+    """Run queued jobs until the None sentinel; report the time per job
+
+    Once the pool is stopped, the jobs left are reported as failed without
+    being run.
+    """
+    global _pool_stop
+    _pool_stop = stop
+    for job in iter(job_queue.get, None):
+        if stop.is_set():
+            result_queue.put((job, 0, 'not run, as another job failed'))
+            continue
+        start_time = time.time()
+        error = None
+        try:
+            run_job(*job)
+        except Exception as exception:
+            error = str(exception)
+            if stop_on is not None and stop_on(error):
+                stop.set()
+        result_queue.put((job, time.time() - start_time, error))
+
+
+def execute_map_on_pool(jobs, process_count=MULTIPROCESSING_POOL_SIZE,
+                        run_job=_run_load_job, describe=_describe_load_job,
+                        measure=_measure_load_job, stop_on=None):
+    """Run jobs on a bounded pool of worker processes
+
+    Pool has not been used because it pickles the callables, which does not
+    play well with our performance measuring decorator. Here, the workers are
+    forked with run_job in hand, and only the job arguments (category names,
+    file handles, table names) cross the process boundary.
+
+    While the jobs run, the progress that they report is printed every
+    progress.PROGRESS_INTERVAL seconds.
+
+    :param jobs: argument tuples for run_job, e.g. from schedule_load_jobs
+    :param process_count: the number of jobs that run at the same time
+    :param measure: the size in bytes of a job, for the progress view
+    :param stop_on: whether the error of a job stops the pool; the jobs
+        that are running then fail at their next block (see
+        _unless_stopped), and the others are not run
+    """
+    job_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    for job in jobs:
+        job_queue.put(job)
+    view = progress.ProgressView(
+        sum(measure(*job) for job in jobs) if measure else 0)
+    reports = progress.start()
+
+    workers = [
+        multiprocessing.Process(
+            target=_pool_worker,
+            args=(run_job, job_queue, result_queue, stop, stop_on))
+        for _ in range(max(1, min(process_count, len(jobs))))
+    ]
+    for _ in workers:
+        job_queue.put(None)
+    for worker in workers:
+        worker.start()
+    progress.stop()
+
+    results = []
+    while len(results) < len(jobs):
+        view.update(reports)
+        if view.due():
+            print('\n'.join(view.render()))
+        try:
+            job, secs, error = result_queue.get(timeout=1)
+        except queue.Empty:
+            if any(worker.is_alive() for worker in workers):
+                continue
+            try:  # What the last workers sent before they ended
+                job, secs, error = result_queue.get(timeout=1)
+            except queue.Empty:
+                break  # A worker died without reporting; do not hang
+        results.append((job, secs, error))
+        print("[{}/{}] {} took {:.1f}s{}".format(
+            len(results), len(jobs), describe(*job), secs,
+            '' if error is None else ', FAILED: {}'.format(error)))
+
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def load_concepts(file_path_list, **options):
     """Load concepts from RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_concept_f', file_path_list,
           ['id', 'effective_time', 'active',
-           'module_id', 'definition_status_id'])
+           'module_id', 'definition_status_id'], **options)
 
 
-def load_descriptions(file_path_list):
+def load_descriptions(file_path_list, **options):
     """Load descriptions from RF2 distribution file
 
     :param file_path_list:
@@ -126,10 +882,10 @@ def load_descriptions(file_path_list):
     _load('curr_description_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id',
            'concept_id', 'language_code', 'type_id', 'term',
-           'case_significance_id'])
+           'case_significance_id'], **options)
 
 
-def load_relationships(file_path_list):
+def load_relationships(file_path_list, **options):
     """Load relationships from RF2 distribution file
 
     :param file_path_list:
@@ -137,57 +893,57 @@ def load_relationships(file_path_list):
     _load('curr_relationship_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id',
            'source_id', 'destination_id', 'relationship_group', 'type_id',
-           'characteristic_type_id', 'modifier_id'])
+           'characteristic_type_id', 'modifier_id'], **options)
 
 
-def load_text_definitions(file_path_list):
+def load_text_definitions(file_path_list, **options):
     """Delegate to the description loading logic
     :param file_path_list:
     """
-    load_descriptions(file_path_list)
+    load_descriptions(file_path_list, **options)
 
 
-def load_simple_reference_sets(file_path_list):
+def load_simple_reference_sets(file_path_list, **options):
     """Load simple reference sets from RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_simplerefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id'])
+           'referenced_component_id'], **options)
 
 
-def load_ordered_reference_sets(file_path_list):
+def load_ordered_reference_sets(file_path_list, **options):
     """Load ordered reference sets from RF2 distribution file
 
     :param file_path_list:
     """
-    _load('curr_orderedrefset_full', file_path_list,
+    _load('curr_orderedrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', '"order"', 'linked_to_id'])
+           'referenced_component_id', '"order"', 'linked_to_id'], **options)
 
 
-def load_attribute_value_reference_sets(file_path_list):
+def load_attribute_value_reference_sets(file_path_list, **options):
     """Load attribute value reference set from RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_attributevaluerefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'value_id'])
+           'referenced_component_id', 'value_id'], **options)
 
 
-def load_simple_map_reference_sets(file_path_list):
+def load_simple_map_reference_sets(file_path_list, **options):
     """Load simple map reference sets from RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_simplemaprefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'map_target'])
+           'referenced_component_id', 'map_target'], **options)
 
 
-def load_complex_map_int_reference_sets(file_path_list):
+def load_complex_map_int_reference_sets(file_path_list, **options):
     """Load complex map reference sets from RF2 distribution files
 
     :param file_path_list:
@@ -195,10 +951,10 @@ def load_complex_map_int_reference_sets(file_path_list):
     _load('curr_complexmaprefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'map_group', 'map_priority', 'map_rule',
-           'map_advice', 'map_target', 'correlation_id'])
+           'map_advice', 'map_target', 'correlation_id'], **options)
 
 
-def load_complex_map_gb_reference_sets(file_path_list):
+def load_complex_map_gb_reference_sets(file_path_list, **options):
     """Like for INTernational above, but with an extra map_block column
 
     For United Kingdom SNOMED->OPCS and SNOMED->ICD 10 maps
@@ -206,10 +962,10 @@ def load_complex_map_gb_reference_sets(file_path_list):
     _load('curr_complexmaprefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'map_group', 'map_priority', 'map_rule',
-           'map_advice', 'map_target', 'correlation_id', 'map_block'])
+           'map_advice', 'map_target', 'correlation_id', 'map_block'], **options)
 
 
-def load_extended_map_reference_sets(file_path_list):
+def load_extended_map_reference_sets(file_path_list, **options):
     """Load extended map reference sets from the RF2 distribution file
 
     :param file_path_list:
@@ -217,20 +973,20 @@ def load_extended_map_reference_sets(file_path_list):
     _load('curr_extendedmaprefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'map_group', 'map_priority', 'map_rule',
-           'map_advice', 'map_target', 'correlation_id', 'map_category_id'])
+           'map_advice', 'map_target', 'correlation_id', 'map_category_id'], **options)
 
 
-def load_language_reference_sets(file_path_list):
+def load_language_reference_sets(file_path_list, **options):
     """Load language reference sets from the RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_langrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'acceptability_id'])
+           'referenced_component_id', 'acceptability_id'], **options)
 
 
-def load_query_specification_reference_sets(file_path_list):
+def load_query_specification_reference_sets(file_path_list, **options):
     """
     Load query specification reference sets from the RF2 distribution file
 
@@ -238,30 +994,30 @@ def load_query_specification_reference_sets(file_path_list):
     """
     _load('curr_queryspecificationrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'query'])
+           'referenced_component_id', 'query'], **options)
 
 
-def load_annotation_reference_sets(file_path_list):
+def load_annotation_reference_sets(file_path_list, **options):
     """Load annotation reference sets from the RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_annotationrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'annotation'])
+           'referenced_component_id', 'annotation'], **options)
 
 
-def load_association_reference_sets(file_path_list):
+def load_association_reference_sets(file_path_list, **options):
     """Load association reference sets from the RF2 distribution file
 
     :param file_path_list:
     """
     _load('curr_associationrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
-           'referenced_component_id', 'target_component_id'])
+           'referenced_component_id', 'target_component_id'], **options)
 
 
-def load_module_dependency_reference_sets(file_path_list):
+def load_module_dependency_reference_sets(file_path_list, **options):
     """Load module dependency reference sets from the RF2 distribution file
 
     :param file_path_list:
@@ -269,10 +1025,10 @@ def load_module_dependency_reference_sets(file_path_list):
     _load('curr_moduledependencyrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'source_effective_time',
-           'target_effective_time'])
+           'target_effective_time'], **options)
 
 
-def load_description_format_reference_sets(file_path_list):
+def load_description_format_reference_sets(file_path_list, **options):
     """Load description format reference sets from the RF2 distribution file
 
     :param file_path_list:
@@ -280,10 +1036,10 @@ def load_description_format_reference_sets(file_path_list):
     _load('curr_descriptionformatrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'description_format_id',
-           'description_length'])
+           'description_length'], **options)
 
 
-def load_refset_descriptor_reference_sets(file_path_list):
+def load_refset_descriptor_reference_sets(file_path_list, **options):
     """Load refset descriptor refsets from the RF2 distribution file
 
     :param file_path_list:
@@ -291,72 +1047,130 @@ def load_refset_descriptor_reference_sets(file_path_list):
     _load('curr_referencesetdescriptorrefset_f', file_path_list,
           ['id', 'effective_time', 'active', 'module_id', 'refset_id',
            'referenced_component_id', 'attribute_description_id',
-           'attribute_type_id', 'attribute_order'])
+           'attribute_type_id', 'attribute_order'], **options)
 
 
-def load_description_type_reference_sets(file_path_list):
+def load_description_type_reference_sets(file_path_list, **options):
     """Delegate to the description format reference set loader
     :param file_path_list:
     """
-    load_description_format_reference_sets(file_path_list)
-
-def run_file(filename):
-    """
-    Run sql statements in a file
-    :param filename of the file with sql statements
-    :return a list of ResultProxy objects (results from each of
-    the sql statements being run)
-    """
-    conn = _sqlalchemy_connection()
-    cursor = conn.cursor()
+    load_description_format_reference_sets(file_path_list, **options)
 
-    with open(filename, "r") as query_file:
-        queries = query_file.read().replace("\n", "").split(";")
-        queries = [q.strip() for q in queries]
-        queries = [q for q in queries if q != '']
-        for query in queries:
-            print(">> {}".format(query))
-            cursor.execute(query)
-            conn.commit()
+@instrument
+def make_current_snapshot(snapshot_date=None):
+    """Build the snapshot views, and then their indexes, in parallel
 
-def make_current_snapshot():
-    snapshot_script = os.path.join(basedir, 'migrations/sql/snapshot.sql')
-    run_file(snapshot_script)
-
-def load_release_files(path_dict):
+    :param snapshot_date: build them as of this date, instead of the latest
+        release that is loaded
+    """
+    sql_script.run_statements(
+        sql_script.parse_script(snapshot.snapshot_script(
+            snapshot_date=snapshot_date)),
+        'snapshot.sql', MULTIPROCESSING_POOL_SIZE)
+
+
+@instrument
+def refresh_current_snapshot():
+    """Refresh the snapshot views in place, e.g. after a delta load"""
+    sql_script.run_statements(
+        sql_script.parse_script(''.join(
+            'REFRESH MATERIALIZED VIEW {};\n'.format(view)
+            for view in snapshot.SNAPSHOT_VIEWS)),
+        'refresh_snapshot.sql', MULTIPROCESSING_POOL_SIZE)
+
+
+# RF2 category (the SUBFOLDERS keys in discover.py) -> loader
+LOADERS = OrderedDict([
+    ('CONCEPTS', load_concepts),
+    ('DESCRIPTIONS', load_descriptions),
+    ('RELATIONSHIPS', load_relationships),
+    ('TEXT_DEFINITIONS', load_text_definitions),
+    ('LANGUAGE_REFERENCE_SET', load_language_reference_sets),
+    ('SIMPLE_REFERENCE_SET', load_simple_reference_sets),
+    ('ORDERED_REFERENCE_SET', load_ordered_reference_sets),
+    ('ATTRIBUTE_VALUE_REFERENCE_SET', load_attribute_value_reference_sets),
+    ('SIMPLE_MAP_REFERENCE_SET', load_simple_map_reference_sets),
+    ('COMPLEX_MAP_INT_REFERENCE_SET', load_complex_map_int_reference_sets),
+    ('COMPLEX_MAP_GB_REFERENCE_SET', load_complex_map_gb_reference_sets),
+    ('EXTENDED_MAP_REFERENCE_SET', load_extended_map_reference_sets),
+    ('QUERY_SPECIFICATION_REFERENCE_SET',
+     load_query_specification_reference_sets),
+    ('ANNOTATION_REFERENCE_SET', load_annotation_reference_sets),
+    ('ASSOCIATION_REFERENCE_SET', load_association_reference_sets),
+    ('MODULE_DEPENDENCY_REFERENCE_SET',
+     load_module_dependency_reference_sets),
+    ('DESCRIPTION_FORMAT_REFERENCE_SET',
+     load_description_format_reference_sets),
+    ('REFSET_DESCRIPTOR', load_refset_descriptor_reference_sets),
+    ('DESCRIPTION_TYPE', load_description_type_reference_sets),
+])
+
+
+def load_release_files(path_dict, bulk=False, binary=False, delta=False,
+                       validate_ids=True, snapshot_date=None,
+                       presnapshot=False):
     """Take a dict from discover.py->enumerate_release_files & trigger db load
     As an entry point method, it is not "intrumented" for performance
     measurement; that would simply make the console output less readable
 
     :param path_dict:
+    :param bulk: load into unlogged, index-free tables with COPY FREEZE,
+        and build the keys and indexes afterwards (see prepare_bulk_load)
+    :param binary: send the rows in binary COPY format (see
+        binary_copy.encode_rf2)
+    :param delta: append only the rows that are newer than what is loaded,
+        mark their ids as changed and refresh the snapshot in place (see
+        prepare_delta_load); the files can be from a Full or Delta release
+    :param validate_ids: check every SCTID as it is loaded; the first file
+        with a bad id stops the whole load (see validate.checked_blocks)
+    :param snapshot_date: build the snapshot as of this date (see
+        snapshot.py); a delta load refreshes the one that is there
+    :param presnapshot: load only the current snapshot of each file, cut
+        down before the load (see presnapshot_release_files); the Full
+        tables then have no history
+
+    Files that the load manifest has as loaded are skipped (see
+    prepare_manifest), so after a failure or a preemption a rerun resumes
+    where the last run stopped.
     """
-    execute_map_on_pool({
-      load_concepts: path_dict["CONCEPTS"],
-      load_descriptions: path_dict["DESCRIPTIONS"],
-      load_relationships: path_dict["RELATIONSHIPS"],
-      load_text_definitions: path_dict["TEXT_DEFINITIONS"],
-      load_language_reference_sets: path_dict["LANGUAGE_REFERENCE_SET"],
-      load_simple_reference_sets: path_dict["SIMPLE_REFERENCE_SET"],
-      load_ordered_reference_sets: path_dict["ORDERED_REFERENCE_SET"],
-      load_attribute_value_reference_sets:
-        path_dict["ATTRIBUTE_VALUE_REFERENCE_SET"],
-      load_simple_map_reference_sets: path_dict["SIMPLE_MAP_REFERENCE_SET"],
-      load_complex_map_int_reference_sets:
-        path_dict["COMPLEX_MAP_INT_REFERENCE_SET"],
-      load_complex_map_gb_reference_sets:
-        path_dict["COMPLEX_MAP_GB_REFERENCE_SET"],
-      load_extended_map_reference_sets:
-        path_dict["EXTENDED_MAP_REFERENCE_SET"],
-      load_query_specification_reference_sets:
-        path_dict["QUERY_SPECIFICATION_REFERENCE_SET"],
-      load_annotation_reference_sets: path_dict["ANNOTATION_REFERENCE_SET"],
-      load_association_reference_sets: path_dict["ASSOCIATION_REFERENCE_SET"],
-      load_module_dependency_reference_sets:
-        path_dict["MODULE_DEPENDENCY_REFERENCE_SET"],
-      load_description_format_reference_sets:
-        path_dict["DESCRIPTION_FORMAT_REFERENCE_SET"],
-      load_refset_descriptor_reference_sets: path_dict["REFSET_DESCRIPTOR"],
-      load_description_type_reference_sets: path_dict["DESCRIPTION_TYPE"]
-    })
-
-    make_current_snapshot()
+    if bulk and delta:
+        raise ValueError('A delta load appends to the loaded tables; it '
+                         'cannot be a bulk load')
+    if presnapshot:
+        path_dict = presnapshot_release_files(
+            path_dict, snapshot_date=snapshot_date)
+    tables = rf2_tables()
+    checksums = prepare_manifest(tables, path_dict, delta=delta)
+    watermarks = prepare_delta_load(tables) if delta else None
+    if bulk:
+        prepare_bulk_load(tables)
+    process_count, copy_parts = split_copy_budget(
+        schedule_load_jobs(path_dict))
+    jobs = schedule_load_jobs(
+        path_dict, freeze=bulk, binary=binary, watermarks=watermarks,
+        copy_parts=copy_parts, checksums=checksums,
+        validate_ids=validate_ids)
+    with metrics.stage('load_release_files', files=len(jobs),
+                       workers=process_count, copy_parts=copy_parts) as stage:
+        stage.bytes_in = sum(_source_size(job[1]) for job in jobs)
+        results = execute_map_on_pool(
+            jobs, process_count,
+            stop_on=validate.invalid_ids if validate_ids else None)
+    invalid = [error for _, _, error in results
+               if error is not None and validate.invalid_ids(error)]
+    if invalid:
+        raise Exception('The load was stopped at a file with bad ids:\n'
+                        '{}'.format('\n'.join(invalid)))
+    failed = len(jobs) - sum(1 for _, _, error in results if error is None)
+    if failed:
+        raise Exception(
+            '{} of {} files did not load; run the load again to resume '
+            'it'.format(failed, len(jobs)))
+    if delta:
+        finish_delta_load(watermarks)
+    finish_load(tables)
+
+    if delta:
+        refresh_current_snapshot()
+    else:
+        make_current_snapshot(snapshot_date)
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""How the loader reads a file, deals it out, and resumes, without a database
+
+An RF2 file is read as line-aligned blocks, which are filtered and then
+dealt out round-robin to the parts that COPY a big file over several
+connections. The load manifest records each loaded file, or part of one,
+so that a rerun can skip it; the decisions that it drives are here too.
+"""
+
+
+def iter_blocks(source, block_size):
+    """Read a stream as blocks of about block_size that end on a line end"""
+    while True:
+        block = source.read(block_size)
+        if not block:
+            return
+        if not block.endswith(b'\n'):
+            block += source.readline()
+        yield block
+
+
+def newer_rows(blocks, watermark):
+    """Keep the rows of each block whose effectiveTime is after watermark
+
+    :param watermark: a YYYYMMDD bytes string; RF2 dates compare as bytes
+    """
+    for block in blocks:
+        rows = [
+            line for line in block.splitlines(True)
+            if line.split(b'\t', 2)[1] > watermark
+        ]
+        if rows:
+            yield b''.join(rows)
+
+
+def deal_blocks(blocks, parts):
+    """(part, block) for each block, dealt out round-robin to the parts
+
+    A file is dealt out the same way on every run, so a resumed load can
+    send only the blocks of the parts that are not loaded yet.
+    """
+    for number, block in enumerate(blocks):
+        yield number % parts, block
+
+
+def file_parts(loaded_parts, copy_parts, big):
+    """The parts that a file is COPYed in, and those that are left to load
+
+    A file that the manifest already has parts of keeps the split that it
+    was started with, so that its blocks go to the same parts again.
+
+    :param loaded_parts: the (part, parts) of its 'loaded' manifest rows
+    :param copy_parts: the parts of a big file in this load
+    :param big: whether the file is big enough to be split
+    :return: (parts, the part numbers that are not loaded); none are left
+        when the manifest has the whole file
+    """
+    if loaded_parts:
+        parts = loaded_parts[0][1]
+    elif copy_parts > 1 and big:
+        parts = copy_parts
+    else:
+        parts = 1
+    loaded = {part for part, _ in loaded_parts}
+    return parts, [part for part in range(parts) if part not in loaded]
+
+
+def table_is_loaded(row_count, loaded, release_files, delta=False):
+    """Whether the manifest still vouches for the rows of a table
+
+    :param row_count: the rows in the table
+    :param loaded: its (source, size, checksum, rows) 'loaded' manifest rows
+    :param release_files: the (source, size, checksum) of the files on disk
+    :param delta: in a delta load, only the row counts have to match
+    """
+    return (row_count == sum(rows for _, _, _, rows in loaded) and
+            (delta or all(row[:3] in release_files for row in loaded)))
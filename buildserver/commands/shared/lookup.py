@@ -0,0 +1,128 @@
+# coding=utf-8
+"""Build the concept lookup file
+
+See lookup_reader for the file format and the lookups.
+"""
+import os
+
+from collections import namedtuple
+
+import numpy as np
+
+from . import lookup_reader
+
+CONCEPTS_QUERY = (
+    'SELECT concept.id, concept.active, pt.preferred_term, '
+    '(fsn.fully_specified_name).term FROM current_concept_snapshot concept '
+    'LEFT JOIN concept_preferred_terms pt ON pt.concept_id = concept.id '
+    'LEFT JOIN concept_fully_specified_names fsn '
+    'ON fsn.concept_id = concept.id')
+DESCRIPTIONS_QUERY = (
+    'SELECT id, concept_id, type_id, term FROM current_description_snapshot '
+    'WHERE active = true')
+FETCH_ROWS = 100000
+
+Lookup = namedtuple('Lookup', [
+    'ids', 'active', 'preferred_terms', 'fully_specified_names',
+    'description_starts', 'description_ids', 'description_types', 'terms',
+    'description_index', 'description_rows', 'pt_blob', 'fsn_blob',
+    'term_blob'])
+
+
+def _blob(texts):
+    """The offsets and the UTF-8 blob of a list of texts; None is empty"""
+    encoded = [(text or '').encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def build_lookup(concepts, descriptions):
+    """A Lookup of the concepts and their descriptions
+
+    :param concepts: (id, active, preferred term, FSN) rows, in any order
+    :param descriptions: (id, concept id, type id, term) rows, in any
+        order; those of concepts that are not in concepts are left out
+    """
+    concepts = sorted(concepts)
+    ids = np.array([row[0] for row in concepts], dtype=np.int64)
+    descriptions = sorted(descriptions, key=lambda row: (row[1], row[0]))
+    concept_ids = np.array([row[1] for row in descriptions], dtype=np.int64)
+    if len(ids):
+        positions = np.minimum(np.searchsorted(ids, concept_ids),
+                               len(ids) - 1)
+        known = ids[positions] == concept_ids
+    else:
+        known = np.zeros(len(descriptions), dtype=bool)
+    descriptions = [row for row, keep in zip(descriptions, known.tolist())
+                    if keep]
+    concept_ids = concept_ids[known]
+    description_ids = np.array([row[0] for row in descriptions],
+                               dtype=np.int64)
+    description_index = np.argsort(description_ids, kind='mergesort')
+    preferred_terms, pt_blob = _blob([row[2] for row in concepts])
+    fully_specified_names, fsn_blob = _blob([row[3] for row in concepts])
+    terms, term_blob = _blob([row[3] for row in descriptions])
+    return Lookup(
+        ids=ids,
+        active=np.array([bool(row[1]) for row in concepts], dtype=np.uint8),
+        preferred_terms=preferred_terms,
+        fully_specified_names=fully_specified_names,
+        description_starts=np.searchsorted(
+            concept_ids, np.append(ids, np.iinfo(np.int64).max)),
+        description_ids=description_ids,
+        description_types=np.array([row[2] for row in descriptions],
+                                   dtype=np.int64),
+        terms=terms,
+        description_index=description_ids[description_index],
+        description_rows=description_index,
+        pt_blob=pt_blob, fsn_blob=fsn_blob, term_blob=term_blob)
+
+
+def read_lookup(conn):
+    """Build the Lookup of the current snapshot
+
+    :param conn: a connection that is not in autocommit mode
+    """
+    rows = {}
+    try:
+        for name, query in (('concepts', CONCEPTS_QUERY),
+                            ('descriptions', DESCRIPTIONS_QUERY)):
+            cursor = conn.cursor(name='lookup_' + name)
+            cursor.itersize = FETCH_ROWS
+            cursor.execute(query)
+            rows[name] = list(cursor)
+            cursor.close()
+    finally:
+        conn.rollback()
+    return build_lookup(rows['concepts'], rows['descriptions'])
+
+
+def write_lookup(lookup, path):
+    """Write a Lookup to path, for lookup_reader.ConceptLookup
+
+    :return: the size of the file, in bytes
+    """
+    counts = (len(lookup.ids), len(lookup.description_ids),
+              len(lookup.pt_blob), len(lookup.fsn_blob),
+              len(lookup.term_blob))
+    offsets, size = lookup_reader.section_offsets(*counts)
+    partial_path = path + '.partial'
+    with open(partial_path, 'wb') as output:
+        output.write(lookup_reader.header(*counts))
+        for name, dtype in (('ids', '<i8'), ('active', 'u1'),
+                            ('preferred_terms', '<i8'),
+                            ('fully_specified_names', '<i8'),
+                            ('description_starts', '<i8'),
+                            ('description_ids', '<i8'),
+                            ('description_types', '<i8'),
+                            ('terms', '<i8'), ('description_index', '<i8'),
+                            ('description_rows', '<i4')):
+            output.seek(offsets[name])
+            output.write(getattr(lookup, name).astype(dtype).tobytes())
+        for name in ('pt_blob', 'fsn_blob', 'term_blob'):
+            output.seek(offsets[name])
+            output.write(getattr(lookup, name))
+        output.truncate(size)
+    os.rename(partial_path, path)
+    return size
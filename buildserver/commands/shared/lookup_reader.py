@@ -0,0 +1,211 @@
+# coding=utf-8
+"""Read the concept lookup file that the build ships
+
+It has the preferred term, FSN and active descriptions of every concept,
+so that a service can look a concept (or a description) up without loading
+the concept export into a database: the file is memory-mapped, an id is
+found with a binary search, and only the terms that are asked for are
+decoded.
+
+The file, little-endian, with every section 8 byte aligned:
+
+    MAGIC, concept count, description count, and the sizes of the
+        preferred term, FSN and description term blobs (uint64 each)
+    ids                  int64[concepts]      the SCTIDs, sorted
+    active               uint8[concepts]      1 for an active concept
+    preferred_terms      int64[concepts + 1]  the preferred term of
+                                              concept i is
+                                              pt_blob[preferred_terms[i]:
+                                                      preferred_terms[i + 1]]
+    fully_specified_names int64[concepts + 1] the same, in fsn_blob
+    description_starts   int64[concepts + 1]  the descriptions of concept
+                                              i are rows description_starts
+                                              [i] to [i + 1] of:
+    description_ids      int64[descriptions]
+    description_types    int64[descriptions]  their type_id
+    terms                int64[descriptions + 1]  offsets in term_blob
+    description_index    int64[descriptions]  the description ids, sorted
+    description_rows     int32[descriptions]  the row of each of them
+    pt_blob, fsn_blob, term_blob              UTF-8
+
+A concept without a preferred term (or FSN) has an empty one, which reads
+as None. This module only uses the standard library, so that it can be
+copied into the services that use the file.
+"""
+import bisect
+import mmap
+import struct
+import sys
+
+from collections import namedtuple
+
+MAGIC = b'SCTLKP01'
+_HEADER = struct.Struct('<8sQQQQQ')
+
+Concept = namedtuple('Concept', ['id', 'active', 'preferred_term',
+                                 'fully_specified_name', 'descriptions'])
+Description = namedtuple('Description', ['id', 'concept_id', 'type_id',
+                                         'term'])
+
+
+def section_offsets(concepts, descriptions, pt_bytes, fsn_bytes,
+                    term_bytes):
+    """The byte offsets of the sections, and the file size"""
+    offsets = {}
+    position = _HEADER.size
+    for name, size in (('ids', 8 * concepts),
+                       ('active', concepts),
+                       ('preferred_terms', 8 * (concepts + 1)),
+                       ('fully_specified_names', 8 * (concepts + 1)),
+                       ('description_starts', 8 * (concepts + 1)),
+                       ('description_ids', 8 * descriptions),
+                       ('description_types', 8 * descriptions),
+                       ('terms', 8 * (descriptions + 1)),
+                       ('description_index', 8 * descriptions),
+                       ('description_rows', 4 * descriptions),
+                       ('pt_blob', pt_bytes),
+                       ('fsn_blob', fsn_bytes),
+                       ('term_blob', term_bytes)):
+        offsets[name] = position
+        position += size + -size % 8
+    return offsets, position
+
+
+def header(concepts, descriptions, pt_bytes, fsn_bytes, term_bytes):
+    return _HEADER.pack(MAGIC, concepts, descriptions, pt_bytes, fsn_bytes,
+                        term_bytes)
+
+
+class ConceptLookup(object):
+    """A memory-mapped concept lookup file
+
+    Use it as a context manager, or close() it when done.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('The concept lookup file is little-endian')
+        with open(path, 'rb') as lookup_file:
+            self._map = mmap.mmap(lookup_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, concepts, descriptions, pt_bytes, fsn_bytes, term_bytes = (
+            _HEADER.unpack_from(self._map))
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('{} is not a concept lookup file'.format(path))
+        offsets, size = section_offsets(concepts, descriptions, pt_bytes,
+                                        fsn_bytes, term_bytes)
+        if len(self._map) != size:
+            self._map.close()
+            raise ValueError('{} is truncated'.format(path))
+        view = memoryview(self._map)
+        self._views = [view]
+
+        def section(name, count, code):
+            part = view[offsets[name]:offsets[name] + count *
+                        struct.calcsize(code)].cast(code)
+            self._views.append(part)
+            return part
+
+        self._ids = section('ids', concepts, 'q')
+        self._active = section('active', concepts, 'B')
+        self._preferred_terms = section('preferred_terms', concepts + 1, 'q')
+        self._fully_specified_names = section(
+            'fully_specified_names', concepts + 1, 'q')
+        self._description_starts = section(
+            'description_starts', concepts + 1, 'q')
+        self._description_ids = section('description_ids', descriptions, 'q')
+        self._description_types = section(
+            'description_types', descriptions, 'q')
+        self._terms = section('terms', descriptions + 1, 'q')
+        self._description_index = section(
+            'description_index', descriptions, 'q')
+        self._description_rows = section('description_rows', descriptions,
+                                         'i')
+        self._pt_blob = section('pt_blob', pt_bytes, 'B')
+        self._fsn_blob = section('fsn_blob', fsn_bytes, 'B')
+        self._term_blob = section('term_blob', term_bytes, 'B')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._map.close()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _index(self, concept_id):
+        index = bisect.bisect_left(self._ids, concept_id)
+        if index == len(self._ids) or self._ids[index] != concept_id:
+            raise KeyError(concept_id)
+        return index
+
+    def __contains__(self, concept_id):
+        try:
+            self._index(concept_id)
+        except KeyError:
+            return False
+        return True
+
+    @staticmethod
+    def _text(blob, offsets, index):
+        start, end = offsets[index], offsets[index + 1]
+        if start == end:
+            return None
+        return blob[start:end].tobytes().decode('utf-8')
+
+    def preferred_term(self, concept_id):
+        """:raises KeyError: if the concept is not in the file"""
+        return self._text(self._pt_blob, self._preferred_terms,
+                          self._index(concept_id))
+
+    def fully_specified_name(self, concept_id):
+        """:raises KeyError: if the concept is not in the file"""
+        return self._text(self._fsn_blob, self._fully_specified_names,
+                          self._index(concept_id))
+
+    def _description(self, row, concept_id):
+        return Description(self._description_ids[row], concept_id,
+                           self._description_types[row],
+                           self._text(self._term_blob, self._terms, row))
+
+    def descriptions(self, concept_id):
+        """The active descriptions of a concept, by id, as Descriptions
+
+        :raises KeyError: if the concept is not in the file
+        """
+        index = self._index(concept_id)
+        return [self._description(row, concept_id) for row in range(
+            self._description_starts[index],
+            self._description_starts[index + 1])]
+
+    def concept(self, concept_id):
+        """Everything that the file has on a concept, as a Concept
+
+        :raises KeyError: if the concept is not in the file
+        """
+        index = self._index(concept_id)
+        return Concept(
+            concept_id, bool(self._active[index]),
+            self._text(self._pt_blob, self._preferred_terms, index),
+            self._text(self._fsn_blob, self._fully_specified_names, index),
+            self.descriptions(concept_id))
+
+    def description(self, description_id):
+        """An active description, as a Description
+
+        :raises KeyError: if the description is not in the file
+        """
+        index = bisect.bisect_left(self._description_index, description_id)
+        if (index == len(self._description_index) or
+                self._description_index[index] != description_id):
+            raise KeyError(description_id)
+        row = self._description_rows[index]
+        concept = bisect.bisect_right(self._description_starts, row) - 1
+        return self._description(row, self._ids[concept])
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""Per-stage build metrics, summarized into a JSON build report
+
+Each stage of the build (a download, a table load, an SQL script...)
+appends one JSON line to METRICS_FILE when it ends, from whichever process
+or user ran it. `build_metrics report` then summarizes the lines into
+final_build_data.
+
+This module only uses the standard library, and does not import the app
+config, so that the psql stages that run as postgres can use it too.
+"""
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+
+METRICS_FILE = os.environ.get(
+    'BUILD_METRICS_FILE',
+    os.path.join(tempfile.gettempdir(), 'snomedct_build_metrics.jsonl'))
+REPORT_FILE = os.path.join(
+    os.environ.get('FINAL_BUILD_DATA',
+                   '/opt/snomedct_buildserver/final_build_data'),
+    'build_report.json')
+
+
+class Stage(object):
+    """A running stage; set rows, bytes_in and bytes_out as they are known
+
+    `cpu_seconds` is the time used by this process and by the child
+    processes that it has waited for, e.g. the load workers; the database
+    server's own CPU time is not part of it.
+    """
+
+    def __init__(self, name, **details):
+        self.name = name
+        self.details = details
+        self.rows = None
+        self.bytes_in = None
+        self.bytes_out = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+
+
+def _cpu_seconds():
+    user, system, children_user, children_system, _ = os.times()
+    return user + system + children_user + children_system
+
+
+def _per_second(amount, seconds):
+    if amount is None or not seconds:
+        return None
+    return round(amount / seconds, 1)
+
+
+@contextlib.contextmanager
+def stage(name, **details):
+    """Measure a block of work; it is recorded even if it fails
+
+    :param name: e.g. 'download' or 'load/curr_concept_f'; the part before
+        the '/' is the group that the report totals it under
+    :param details: anything else to record, e.g. the source file
+    """
+    current = Stage(name, **details)
+    started_at = datetime.utcnow()
+    start_time = time.time()
+    start_cpu = _cpu_seconds()
+    error = None
+    try:
+        yield current
+    except BaseException as exception:
+        error = str(exception) or type(exception).__name__
+        raise
+    finally:
+        current.wall_seconds = time.time() - start_time
+        current.cpu_seconds = _cpu_seconds() - start_cpu
+        record(current, started_at, error)
+
+
+def record(current, started_at, error=None):
+    """Append a finished stage to METRICS_FILE"""
+    event = OrderedDict([
+        ('stage', current.name),
+        ('started_at', started_at.isoformat() + 'Z'),
+        ('wall_seconds', round(current.wall_seconds, 3)),
+        ('cpu_seconds', round(current.cpu_seconds, 3)),
+        ('rows', current.rows),
+        ('bytes_in', current.bytes_in),
+        ('bytes_out', current.bytes_out),
+        ('rows_per_second',
+         _per_second(current.rows, current.wall_seconds)),
+        ('mb_per_second', _per_second(
+            current.bytes_in if current.bytes_in is not None
+            else current.bytes_out, current.wall_seconds * 1e6)),
+        ('pid', os.getpid()),
+        ('error', error),
+    ])
+    event.update(sorted(current.details.items()))
+    line = (json.dumps(event) + '\n').encode('utf-8')
+    # One write to an O_APPEND file, so that the lines of concurrent
+    # workers do not interleave
+    descriptor = os.open(
+        METRICS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        try:
+            # The loader and the psql stages run as different users
+            os.fchmod(descriptor, 0o666)
+        except OSError:
+            pass  # Not ours; whoever created it has done this
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+def reset():
+    """Forget the stages of the previous build"""
+    if os.path.exists(METRICS_FILE):
+        os.remove(METRICS_FILE)
+
+
+def read_events(metrics_file=METRICS_FILE):
+    if not os.path.exists(metrics_file):
+        return []
+    with open(metrics_file) as events:
+        return [json.loads(line) for line in events if line.strip()]
+
+
+def _add(total, key, value):
+    if value is not None:
+        total[key] = round((total.get(key) or 0) + value, 3)
+
+
+def build_report(metrics_file=METRICS_FILE):
+    """Summarize the recorded stages: totals per group, then every stage"""
+    events = sorted(read_events(metrics_file), key=lambda e: e['started_at'])
+    groups = OrderedDict()
+    for event in events:
+        group = groups.setdefault(
+            event['stage'].split('/')[0],
+            OrderedDict([('stages', 0), ('failed', 0)]))
+        group['stages'] += 1
+        group['failed'] += event['error'] is not None
+        for key in ('wall_seconds', 'cpu_seconds', 'rows', 'bytes_in',
+                    'bytes_out'):
+            _add(group, key, event[key])
+    return OrderedDict([
+        ('generated_at', datetime.utcnow().isoformat() + 'Z'),
+        ('failed', sum(group['failed'] for group in groups.values())),
+        ('groups', groups),
+        ('stages', events),
+    ])
+
+
+def write_report(report_file=REPORT_FILE, metrics_file=METRICS_FILE):
+    report = build_report(metrics_file)
+    with open(report_file, 'w') as output:
+        json.dump(report, output, indent=2)
+    return report
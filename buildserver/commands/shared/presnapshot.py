@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Reduce an RF2 Full file to its current snapshot before it is loaded
+
+Most rows of a Full file are versions that the snapshot views throw away.
+latest_rows keeps, for each id, only the rows of its latest effective_time
+(up to a snapshot date, if there is one), with an external merge sort on
+(id, effective_time) whose memory use is bounded: rows are sorted in runs
+of about memory_limit bytes, each run is cut down to its latest rows and
+spilled to a temporary file, and the runs are then merged.
+
+The output is sorted by id, and keeps the rows exactly as they are in the
+file, so the loaders read it like any other RF2 file.
+"""
+import heapq
+import itertools
+import os
+import tempfile
+
+# Bytes of rows that are sorted in memory at a time, per process
+MEMORY_LIMIT = int(os.environ.get('PRESNAPSHOT_MEMORY_MB', 256)) * 1024 * 1024
+
+
+def _key(line):
+    """(id, effectiveTime), the first two fields, as bytes"""
+    fields = line.split(b'\t', 2)
+    return fields[0], fields[1]
+
+
+def _id(line):
+    return line.split(b'\t', 1)[0]
+
+
+def _latest(sorted_lines):
+    """The lines of the latest effectiveTime of each id, from sorted lines"""
+    for _, lines in itertools.groupby(sorted_lines, key=_id):
+        lines = list(lines)
+        latest = _key(lines[-1])[1]
+        for line in lines:
+            if _key(line)[1] == latest:
+                yield line
+
+
+def _lines(blocks, snapshot_date=None):
+    """The rows of line-aligned blocks, each ending in a line end"""
+    for block in blocks:
+        for line in block.splitlines(True):
+            if not line.endswith(b'\n'):
+                line += b'\r\n'
+            if snapshot_date is not None and _key(line)[1] > snapshot_date:
+                continue
+            yield line
+
+
+def _spill(lines, folder):
+    """Write a run to a temporary file; return the file, rewound"""
+    run = tempfile.TemporaryFile(dir=folder)
+    run.writelines(lines)
+    run.seek(0)
+    return run
+
+
+def latest_rows(blocks, snapshot_date=None, memory_limit=MEMORY_LIMIT,
+                temp_folder=None):
+    """The current snapshot of blocks of RF2 rows (without the header)
+
+    :param blocks: line-aligned blocks, e.g. from load_plan.iter_blocks
+    :param snapshot_date: b'YYYYMMDD'; the rows after it are left out
+    :param temp_folder: where the sorted runs go; the system default if None
+    :return: a generator of lines, sorted by id
+    """
+    runs = []
+    try:
+        run = []
+        size = 0
+        for line in _lines(blocks, snapshot_date):
+            run.append(line)
+            size += len(line)
+            if size >= memory_limit:
+                run.sort(key=_key)
+                runs.append(_spill(_latest(run), temp_folder))
+                run = []
+                size = 0
+        run.sort(key=_key)
+        if not runs:
+            for line in _latest(run):
+                yield line
+            return
+        runs.append(_spill(_latest(run), temp_folder))
+        del run
+        for line in _latest(heapq.merge(*runs, key=_key)):
+            yield line
+    finally:
+        for run in runs:
+            run.close()
+
+
+def write_snapshot(header, blocks, output_path, **options):
+    """Write the current snapshot of an RF2 file, with its header
+
+    :param options: passed on to latest_rows
+    :return: the number of rows written
+    """
+    rows = 0
+    partial_path = output_path + '.partial'
+    with open(partial_path, 'wb') as output:
+        output.write(header)
+        for line in latest_rows(blocks, **options):
+            output.write(line)
+            rows += 1
+    # Only a complete file gets the final name, so that a rerun after a
+    # failure does not load half a file
+    os.rename(partial_path, output_path)
+    return rows
@@ -0,0 +1,157 @@
+# coding=utf-8
+"""Live progress of the RF2 load, gathered from the worker processes
+
+The loaders count the bytes and rows of each file as they are sent to
+COPY (see counted) and report them over a queue that the pool workers
+inherit. The process that runs the pool merges the reports into one view
+and prints it every PROGRESS_INTERVAL seconds, so that a stalled server or
+a saturated disk shows up while the build is still running.
+"""
+import multiprocessing
+import os
+import queue
+import time
+
+from collections import OrderedDict
+from datetime import timedelta
+
+# Seconds between two progress views, and between two reports of a file
+PROGRESS_INTERVAL = int(os.environ.get('LOAD_PROGRESS_INTERVAL', 10))
+REPORT_INTERVAL = 1
+
+# Set by start() in the parent before the workers are forked
+_reports = None
+
+
+def start():
+    """Open the report queue; the processes forked after this report to it"""
+    global _reports
+    _reports = multiprocessing.Queue()
+    return _reports
+
+
+def stop():
+    global _reports
+    _reports = None
+
+
+def counted(blocks, table_name, source, size):
+    """Pass the blocks through, reporting the bytes and rows sent so far
+
+    :param blocks: line-aligned blocks of RF2 rows, e.g. from
+        load_plan.iter_blocks
+    :param source: the file that is read, for the view
+    :param size: its size in bytes, for the percentage and the ETA
+    """
+    sent = rows = 0
+    reported_at = time.time()
+    for block in blocks:
+        yield block
+        sent += len(block)
+        rows += block.count(b'\n')
+        if time.time() - reported_at >= REPORT_INTERVAL:
+            _report(table_name, source, sent, rows, size, False)
+            reported_at = time.time()
+    _report(table_name, source, sent, rows, size, True)
+
+
+def _report(table_name, source, sent, rows, size, done):
+    if _reports is not None:
+        _reports.put((table_name, str(source), sent, rows, size, done,
+                      time.time()))
+
+
+def _format_bytes(amount):
+    if amount >= 1e9:
+        return '{:.2f}GB'.format(amount / 1e9)
+    return '{:.1f}MB'.format(amount / 1e6)
+
+
+def _format_rate(rate, remaining):
+    """MB/s and the ETA at that rate"""
+    if rate <= 0:
+        return '{:>7.1f}MB/s ETA ?'.format(0)
+    return '{:>7.1f}MB/s ETA {}'.format(
+        rate / 1e6, timedelta(seconds=int(remaining / rate)))
+
+
+class _Counts(object):
+    """Bytes and rows sent, and the rate since the previous view"""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.sent = 0
+        self.rows = 0
+        self.done = False
+        self.previous_sent = 0
+
+    def rate(self, seconds):
+        return (self.sent - self.previous_sent) / seconds if seconds else 0
+
+    def line(self, name, seconds):
+        remaining = max(self.size - self.sent, 0)
+        return '{:<42} {:>9} of {:>9} ({:>3.0f}%) {:>12,} rows {}'.format(
+            name, _format_bytes(self.sent), _format_bytes(self.size),
+            100.0 * self.sent / self.size if self.size else 100,
+            self.rows, 'done' if self.done else
+            _format_rate(self.rate(seconds), remaining))
+
+
+class ProgressView(object):
+    """Merge the reports of the workers into per-file and per-table counts
+
+    :param total_size: the bytes to load in all, including the files that
+        have not started yet
+    """
+
+    def __init__(self, total_size=0):
+        self.total_size = total_size
+        self.files = OrderedDict()
+        self.shown_at = time.time()
+
+    def update(self, reports):
+        try:
+            while True:
+                table_name, source, sent, rows, size, done, _ = (
+                    reports.get_nowait())
+                counts = self.files.setdefault(
+                    source, (table_name, _Counts(size)))[1]
+                counts.sent, counts.rows, counts.done = sent, rows, done
+        except queue.Empty:
+            pass
+
+    def due(self):
+        return (bool(self.files) and
+                time.time() - self.shown_at >= PROGRESS_INTERVAL)
+
+    def render(self):
+        """The view, as lines: overall, then per table and per open file"""
+        seconds = time.time() - self.shown_at
+        tables = OrderedDict()
+        total = _Counts(self.total_size)
+        for table_name, counts in self.files.values():
+            table = tables.setdefault(table_name, _Counts())
+            table.size += counts.size
+            for summed in (table, total):
+                summed.sent += counts.sent
+                summed.rows += counts.rows
+                summed.previous_sent += counts.previous_sent
+        total.size = max(total.size, total.sent)
+
+        lines = [total.line('[progress] all files', seconds)]
+        for table_name, table in tables.items():
+            open_files = [
+                (source, counts)
+                for source, (name, counts) in self.files.items()
+                if name == table_name and not counts.done
+            ]
+            table.done = not open_files
+            lines.append(table.line('  ' + table_name, seconds))
+            for source, counts in open_files:
+                lines.append(counts.line(
+                    '    ' + os.path.basename(source)[:38], seconds))
+
+        for _, counts in self.files.values():
+            counts.previous_sent = counts.sent
+        self.shown_at = time.time()
+        return lines
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""The SQL for the current_*_snapshot views, as of any release date
+
+A snapshot has, for each component id, the rows of its most recent
+effective_time (up to the snapshot date, if there is one). The Full tables
+are read in a single pass per view; see STRATEGIES. 'correlated' is the
+original per-row max(effective_time) lookup, which is kept to benchmark
+against (see commands/benchmark_snapshot.py).
+"""
+from collections import OrderedDict
+from datetime import date
+
+# Snapshot view -> the Full table that it is built from
+SNAPSHOT_VIEWS = OrderedDict([
+    ('current_concept_snapshot', 'curr_concept_f'),
+    ('current_relationship_snapshot', 'curr_relationship_f'),
+    ('current_description_snapshot', 'curr_description_f'),
+    ('current_annotation_reference_set_snapshot', 'curr_annotationrefset_f'),
+    ('current_association_reference_set_snapshot',
+     'curr_associationrefset_f'),
+    ('current_attribute_value_reference_set_snapshot',
+     'curr_attributevaluerefset_f'),
+    ('current_complex_map_reference_set_snapshot', 'curr_complexmaprefset_f'),
+    ('current_description_format_reference_set_snapshot',
+     'curr_descriptionformatrefset_f'),
+    ('current_extended_map_reference_set_snapshot',
+     'curr_extendedmaprefset_f'),
+    ('current_language_reference_set_snapshot', 'curr_langrefset_f'),
+    ('current_module_dependency_reference_set_snapshot',
+     'curr_moduledependencyrefset_f'),
+    ('current_ordered_reference_set_snapshot', 'curr_orderedrefset_f'),
+    ('current_query_specification_reference_set_snapshot',
+     'curr_queryspecificationrefset_f'),
+    ('current_reference_set_descriptor_reference_set_snapshot',
+     'curr_referencesetdescriptorrefset_f'),
+    ('current_simple_map_reference_set_snapshot', 'curr_simplemaprefset_f'),
+    ('current_simple_reference_set_snapshot', 'curr_simplerefset_f'),
+])
+
+SNAPSHOT_INDEXES = [
+    'CREATE INDEX description_index_type_id ON current_description_snapshot '
+    '(type_id)',
+    'CREATE INDEX description_index_conceptid ON current_description_snapshot '
+    '(concept_id)',
+    'CREATE INDEX description_partial_index_type_id_fsn ON '
+    'current_description_snapshot (type_id) '
+    'WHERE type_id = 900000000000003001',
+    'CREATE INDEX concept_index_conceptid ON current_concept_snapshot (id)',
+    'CREATE INDEX langrefset_referencedcomponentid_index on '
+    'current_language_reference_set_snapshot (referenced_component_id)',
+    'CREATE INDEX langrefset_partial_index_acceptability_id_pt ON '
+    'current_language_reference_set_snapshot (acceptability_id) '
+    'WHERE acceptability_id = 900000000000548007',
+    'CREATE INDEX snomed_relationship_destination_id_index ON '
+    'current_relationship_snapshot (destination_id)',
+    'CREATE INDEX snomed_relationship_sourceid_index ON '
+    'current_relationship_snapshot (source_id)',
+]
+
+# How the latest rows of each id are picked, with {table} and {cutoff} (an
+# "AND effective_time <= ..." condition, or nothing) to fill in:
+#  - distinct_on: keep the latest row of each id, in one sort. RF2 has one
+#    row per id and effective_time, so this is the same as 'correlated';
+#    the benchmark checks that on the loaded data. Should a release repeat
+#    an id and effective_time, one row is kept where 'correlated' keeps
+#    them all: the active one, and then the least by its other columns, so
+#    that every build keeps the same row.
+#  - window: rank the rows of each id by effective_time, in one sort; ties
+#    on the latest effective_time are all kept, as 'correlated' does
+#  - hash_join: the max(effective_time) of every id, joined back to the
+#    rows; both sides can be scanned in parallel
+STRATEGIES = OrderedDict([
+    ('distinct_on', (
+        'SELECT DISTINCT ON (c.id) c.* FROM {table} AS c WHERE true{cutoff}\n'
+        'ORDER BY c.id, c.effective_time DESC, c.active DESC, c')),
+    ('window', (
+        'SELECT (ranked.c).* FROM (\n'
+        '  SELECT c, rank() OVER (\n'
+        '    PARTITION BY c.id ORDER BY c.effective_time DESC) AS rank\n'
+        '  FROM {table} AS c WHERE true{cutoff}) AS ranked\n'
+        'WHERE ranked.rank = 1')),
+    ('hash_join', (
+        'SELECT c.* FROM {table} AS c JOIN (\n'
+        '  SELECT id, max(effective_time) AS effective_time\n'
+        '  FROM {table} WHERE true{cutoff} GROUP BY id) AS latest\n'
+        'ON c.id = latest.id AND c.effective_time = latest.effective_time')),
+    ('correlated', (
+        'SELECT c.* FROM {table} AS c\n'
+        'WHERE c.effective_time = (\n'
+        '  SELECT max(c2.effective_time) FROM {table} AS c2\n'
+        '  WHERE c2.id = c.id{cutoff2})')),
+])
+DEFAULT_STRATEGY = 'distinct_on'
+
+
+def snapshot_query(table_name, strategy=DEFAULT_STRATEGY,
+                   snapshot_date=None):
+    """The SELECT for the snapshot of a Full table
+
+    :param snapshot_date: a date; the rows after it are left out
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown snapshot strategy {!r}; one of {}'.format(
+            strategy, ', '.join(STRATEGIES)))
+    cutoff = cutoff2 = ''
+    if snapshot_date is not None:
+        if not isinstance(snapshot_date, date):
+            raise ValueError('snapshot_date must be a date')
+        cutoff = " AND c.effective_time <= DATE '{}'".format(
+            snapshot_date.strftime('%Y-%m-%d'))
+        cutoff2 = cutoff.replace('c.', 'c2.')
+        if strategy == 'hash_join':
+            cutoff = cutoff.replace('c.', '')
+    return STRATEGIES[strategy].format(
+        table=table_name, cutoff=cutoff, cutoff2=cutoff2)
+
+
+def snapshot_script(strategy=DEFAULT_STRATEGY, snapshot_date=None):
+    """The SQL script that builds the snapshot views and their indexes"""
+    statements = [
+        'CREATE MATERIALIZED VIEW {} AS\n{}'.format(
+            view, snapshot_query(table_name, strategy, snapshot_date))
+        for view, table_name in SNAPSHOT_VIEWS.items()
+    ]
+    return ''.join(
+        statement + ';\n\n' for statement in statements + SNAPSHOT_INDEXES)
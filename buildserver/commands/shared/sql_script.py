@@ -0,0 +1,319 @@
+# coding=utf-8
+"""Run the statements of an SQL script in parallel, in dependency order
+
+A script is split into statements the way psql would split it: the ';' in
+strings, quoted identifiers, comments and $$ function bodies do not end a
+statement. Each statement that creates something (a table, a view, an
+index, a type, a function) waits only for the earlier statements that
+create the names it refers to; the statements that do anything else
+(INSERT, DROP, SELECT...) are barriers that wait for everything before
+them. The statements that are ready run on a pool of threads, with a
+connection each.
+
+A statement whose effect stays on its connection (SET, RESET, CREATE TEMP
+...) is a barrier too, and a script that has one is run on one connection,
+so that the statements after it see it.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import metrics
+
+_TOKEN = re.compile(r"""
+    (?P<comment> --[^\n]* | /\*.*?\*/ )
+  | (?P<string> [Ee]'(?:[^'\\]|\\.|'')*' | '(?:[^']|'')*' )
+  | (?P<quoted> "(?:[^"]|"")*" )
+  | (?P<dollar> \$(?:[A-Za-z_]\w*)?\$ )
+  | (?P<word> [A-Za-z_][\w$]* )
+  | (?P<end> ; )
+  | (?P<unterminated> ['"] | /\* )
+""", re.VERBOSE | re.DOTALL)
+
+# CREATE [OR REPLACE] [UNIQUE] [MATERIALIZED | TEMP | UNLOGGED] <kind>
+_CREATE_PREFIXES = {'or', 'replace', 'unique', 'materialized', 'temporary',
+                    'temp', 'unlogged', 'recursive'}
+_CREATE_KINDS = {'table', 'view', 'index', 'type', 'function', 'sequence',
+                 'aggregate', 'domain', 'procedure'}
+_TEMPORARY = {'temporary', 'temp'}
+_SESSION_COMMANDS = {'set', 'reset', 'discard'}
+
+
+class Statement(namedtuple('Statement', ['number', 'line', 'text', 'words'])):
+    """A statement of a script
+
+    :param number: its position in the script, from 1
+    :param line: the line of the script that it starts on
+    :param words: the names it mentions, lowercased unless quoted, in
+        order; a qualifier is left out, so public.foo is just foo
+    """
+
+    @property
+    def kind(self):
+        """e.g. 'view' for CREATE MATERIALIZED VIEW; None if not a CREATE"""
+        if self.words[:1] == ['create']:
+            for word in self.words[1:]:
+                if word in _CREATE_KINDS:
+                    return word
+                if word not in _CREATE_PREFIXES:
+                    break
+        if self.words[:3] == ['refresh', 'materialized', 'view']:
+            return 'refresh'
+        return None
+
+    @property
+    def session(self):
+        """Whether its effect stays on its connection, e.g. SET or CREATE
+        TEMP TABLE"""
+        if self.words[:1] and self.words[0] in _SESSION_COMMANDS:
+            return True
+        kind = self.kind
+        if kind is None or kind == 'refresh':
+            return False
+        return bool(_TEMPORARY & set(self.words[1:self.words.index(kind)]))
+
+    @property
+    def creates(self):
+        """The name that the statement creates (or refreshes), if any"""
+        kind = self.kind
+        if kind is None:
+            return None
+        words = self.words[self.words.index(
+            'view' if kind == 'refresh' else kind) + 1:]
+        words = [word for word in words
+                 if word not in ('if', 'not', 'exists', 'concurrently')]
+        if not words or (kind == 'index' and words[0] == 'on'):
+            return None
+        return words[0]
+
+    @property
+    def table(self):
+        """The table of a CREATE INDEX"""
+        if self.kind != 'index' or 'on' not in self.words:
+            return None
+        words = self.words[self.words.index('on') + 1:]
+        words = [word for word in words if word != 'only']
+        return words[0] if words else None
+
+    def summary(self, width=100):
+        first_line = ' '.join(self.text.split())
+        if len(first_line) > width:
+            first_line = first_line[:width - 3] + '...'
+        return first_line
+
+
+def _name(token):
+    """The name that a word or quoted identifier token stands for"""
+    if token.startswith('"'):
+        return token[1:-1].replace('""', '"')
+    return token.lower()
+
+
+def _words(code):
+    """The names mentioned in code, e.g. a function body"""
+    return [word for statement in parse_script(code)
+            for word in statement.words]
+
+
+def parse_script(script):
+    """Split an SQL script into Statements
+
+    Statements that are empty, or only comments, are left out. psql
+    meta-commands (backslash commands) are not supported.
+    """
+    statements = []
+    words = []
+    first = None
+    position = 0
+    while True:
+        match = _TOKEN.search(script, position)
+        if match is None:
+            break
+        token_type = match.lastgroup
+        token = match.group()
+        position = match.end()
+        if token_type == 'comment':
+            continue
+        if token_type == 'unterminated':
+            raise ValueError('Unterminated {} on line {}'.format(
+                token, script.count('\n', 0, match.start()) + 1))
+        if token_type == 'end':
+            if first is not None:
+                statements.append(Statement(
+                    len(statements) + 1,
+                    script.count('\n', 0, first) + 1,
+                    script[first:match.start()].strip(), words))
+            words = []
+            first = None
+            continue
+        if first is None:
+            first = match.start()
+        if token_type in ('word', 'quoted'):
+            if not script.startswith('.', position):
+                words.append(_name(token))
+        elif token_type == 'dollar':
+            end = script.find(token, position)
+            if end < 0:
+                raise ValueError('Unterminated {} on line {}'.format(
+                    token, script.count('\n', 0, match.start()) + 1))
+            # A function body; what it mentions is a dependency too
+            words.extend(_words(script[position:end]))
+            position = end + len(token)
+    if first is not None and script[first:].strip():
+        statements.append(Statement(
+            len(statements) + 1, script.count('\n', 0, first) + 1,
+            script[first:].strip(), words))
+    return statements
+
+
+def view_query(statements, name):
+    """The query of the CREATE [MATERIALIZED] VIEW that creates name"""
+    for statement in statements:
+        if statement.kind == 'view' and statement.creates == name:
+            match = re.search(r'\bAS\b', statement.text, re.IGNORECASE)
+            return statement.text[match.end():].strip()
+    raise ValueError('No view {} in the script'.format(name))
+
+
+def plan(statements):
+    """The statements that each statement has to wait for, as index sets
+
+    A statement waits for the earlier statements that create a name that it
+    mentions, and for the earlier indexes on the tables that it reads, so
+    that they are there to be used; the indexes on one table are built side
+    by side. Statements that do not create anything, and session
+    statements, are barriers.
+    """
+    creators = {}
+    indexes = {}
+    barrier = None
+    since_barrier = []
+    waits = []
+    for index, statement in enumerate(statements):
+        if statement.creates is None or statement.session:
+            waiting = set(since_barrier)
+            if barrier is not None:
+                waiting.add(barrier)
+            barrier = index
+            since_barrier = []
+            creators = {}
+            indexes = {}
+        else:
+            waiting = set()
+            if barrier is not None:
+                waiting.add(barrier)
+            for word in set(statement.words):
+                waiting.update(creators.get(word, ()))
+                if word != statement.table:
+                    waiting.update(indexes.get(word, ()))
+            creators.setdefault(statement.creates, []).append(index)
+            if statement.table is not None:
+                indexes.setdefault(statement.table, []).append(index)
+            since_barrier.append(index)
+        waiting.discard(index)
+        waits.append(waiting)
+    return waits
+
+
+def _run_statement(statement, name, stage, local, opened):
+    # Imported here so that parsing a script does not need the app config
+    from . import connections
+    if getattr(local, 'conn', None) is None:
+        local.conn = connections.connect(stage)
+        opened.append(local.conn)
+    conn = local.conn
+    cursor = conn.cursor()
+    with metrics.stage('{}/{}'.format(name, statement.number),
+                       statement=statement.text[:200],
+                       line=statement.line) as measured:
+        try:
+            cursor.execute(statement.text)
+            output = cursor.fetchall() if cursor.description else []
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if cursor.rowcount >= 0 and not output:
+            measured.rows = cursor.rowcount
+    return output
+
+
+def run_statements(statements, name, workers, stage='snapshot'):
+    """Run parsed statements on `workers` connections, in dependency order
+
+    :param name: e.g. the script's file name; each statement is measured
+        as the stage '<name>/<number>'
+    :param stage: the session profile of the connections (see
+        connections.py)
+    """
+    if workers > 1 and any(statement.session for statement in statements):
+        print('>> {} has session statements; running it on one connection'
+              .format(name))
+        workers = 1
+    waits = plan(statements)
+    dependents = [[] for _ in statements]
+    for index, waiting in enumerate(waits):
+        for other in waiting:
+            dependents[other].append(index)
+    remaining = [len(waiting) for waiting in waits]
+    ready = [index for index, count in enumerate(remaining) if count == 0]
+    heapq.heapify(ready)
+
+    local = threading.local()
+    opened = []
+    running = {}
+    done_count = 0
+    failure = None
+    try:
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            while ready or running:
+                while ready and failure is None:
+                    index = heapq.heappop(ready)
+                    statement = statements[index]
+                    print('>> [{}] {}'.format(
+                        statement.number, statement.summary()))
+                    running[pool.submit(
+                        _run_statement, statement, name, stage, local,
+                        opened)] = (index, time.time())
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, started = running.pop(future)
+                    statement = statements[index]
+                    done_count += 1
+                    error = future.exception()
+                    print('[{}/{}] statement {} (line {}) took {:.1f}s{}'
+                          .format(done_count, len(statements),
+                                  statement.number, statement.line,
+                                  time.time() - started,
+                                  '' if error is None else
+                                  ', FAILED: {}'.format(error)))
+                    if error is not None:
+                        failure = failure or (statement, error)
+                        continue
+                    for row in future.result():
+                        print('\t'.join(str(value) for value in row))
+                    for other in dependents[index]:
+                        remaining[other] -= 1
+                        if remaining[other] == 0:
+                            heapq.heappush(ready, other)
+    finally:
+        for conn in opened:
+            conn.close()
+    if failure is not None:
+        statement, error = failure
+        raise Exception('Statement {} on line {} of {} failed: {}'.format(
+            statement.number, statement.line, name, error))
+
+
+def run_script(filename, workers, stage='snapshot'):
+    """Parse and run an SQL script file; see run_statements"""
+    with open(filename, 'r') as script:
+        statements = parse_script(script.read())
+    run_statements(statements, os.path.basename(filename), workers, stage)
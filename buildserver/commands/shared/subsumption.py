@@ -0,0 +1,118 @@
+# coding=utf-8
+"""Build the compact IS-A subsumption index from the transitive closure
+
+See subsumption_reader for the file format and the lookup. Each concept's
+tree parent is the parent with the most ancestors, which leaves the fewest
+ancestors to labels; in SNOMED CT most concepts end up with none.
+"""
+import os
+
+from collections import namedtuple
+
+import numpy as np
+
+from . import subsumption_reader
+
+Index = namedtuple('Index', ['ids', 'label_starts', 'pre', 'end', 'labels'])
+
+
+def _tree_parents(nodes, children, parents, ancestor_counts):
+    """The index of each node's tree parent, -1 for a root"""
+    child_index = np.searchsorted(nodes, children)
+    parent_index = np.searchsorted(nodes, parents)
+    # The last of each child's edges, by ancestor count, is its tree edge
+    order = np.lexsort((ancestor_counts[parent_index], child_index))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = child_index[order][1:] != child_index[order][:-1]
+    tree_parents = np.full(len(nodes), -1, dtype=np.int64)
+    tree_parents[child_index[order][last]] = parent_index[order][last]
+    return tree_parents
+
+
+def _preorder(tree_parents):
+    """The preorder number of each node, and the end of its tree's range"""
+    node_count = len(tree_parents)
+    order = np.argsort(tree_parents, kind='stable')
+    starts = np.searchsorted(tree_parents[order],
+                             np.arange(-1, node_count + 1))
+    pre = np.empty(node_count, dtype=np.int64)
+    size = np.ones(node_count, dtype=np.int64)
+    finished = []
+    number = 0
+    # The roots first; a node's children are pushed in reverse, to be
+    # numbered in id order
+    pending = list(order[starts[0]:starts[1]][::-1])
+    while pending:
+        node = pending.pop()
+        if node < 0:
+            finished.append(~node)
+            continue
+        pre[node] = number
+        number += 1
+        pending.append(~node)
+        pending.extend(order[starts[node + 1]:starts[node + 2]][::-1])
+    if number != node_count:
+        raise ValueError('The IS-A tree has a cycle')
+    for node in finished:
+        if tree_parents[node] >= 0:
+            size[tree_parents[node]] += size[node]
+    return pre, pre + size
+
+
+def build_index(children, parents, subtypes, supertypes):
+    """The index of a hierarchy and its closure
+
+    :param children: the child of each IS-A edge, as an integer array
+    :param parents: the parent of each edge
+    :param subtypes: the closure, e.g. from closure.transitive_closure
+    :param supertypes: the ancestor of each subtype
+    :return: an Index of arrays, for write_index
+    """
+    if np.any(subtypes == supertypes):
+        raise ValueError('The IS-A hierarchy has a cycle')
+    nodes = np.unique(np.concatenate([children, parents]))
+    sub = np.searchsorted(nodes, subtypes)
+    sup = np.searchsorted(nodes, supertypes)
+    ancestor_counts = np.bincount(sub, minlength=len(nodes))
+    pre, end = _preorder(_tree_parents(
+        nodes, children, parents, ancestor_counts))
+
+    # The ancestors of each node, and the node itself, by preorder; a
+    # member is needed as a label when no other member is in its range
+    owner = np.concatenate([sub, np.arange(len(nodes))])
+    member = np.concatenate([sup, np.arange(len(nodes))])
+    order = np.lexsort((pre[member], owner))
+    owner = owner[order]
+    member = member[order]
+    needed = np.ones(len(owner), dtype=bool)
+    same_owner = owner[1:] == owner[:-1]
+    needed[:-1] = ~same_owner | (pre[member][1:] >= end[member][:-1])
+    # The node itself is covered by its own range
+    needed &= member != owner
+    owner = owner[needed]
+    labels = pre[member[needed]]
+    label_starts = np.searchsorted(owner, np.arange(len(nodes) + 1))
+    return Index(nodes.astype(np.int64), label_starts.astype(np.int64),
+                 pre.astype(np.int32), end.astype(np.int32),
+                 labels.astype(np.int32))
+
+
+def write_index(index, path):
+    """Write an Index to path, for subsumption_reader.SubsumptionIndex
+
+    :return: the size of the file, in bytes
+    """
+    offsets, size = subsumption_reader.section_offsets(
+        len(index.ids), len(index.labels))
+    partial_path = path + '.partial'
+    with open(partial_path, 'wb') as output:
+        output.write(subsumption_reader.header(
+            len(index.ids), len(index.labels)))
+        for name, dtype in (('ids', '<i8'), ('label_starts', '<i8'),
+                            ('pre', '<i4'), ('end', '<i4'),
+                            ('labels', '<i4')):
+            output.seek(offsets[name])
+            output.write(getattr(index, name).astype(dtype).tobytes())
+        output.truncate(size)
+    os.rename(partial_path, path)
+    return size
@@ -0,0 +1,129 @@
+# coding=utf-8
+"""Read the compact IS-A subsumption index that the build ships
+
+The index is a spanning tree of the IS-A hierarchy, numbered in preorder,
+so that the tree descendants of a concept are a range of preorder numbers,
+[pre, end). A concept's other ancestors (those from its other parents) are
+covered by its labels: the preorder numbers of the fewest of its ancestors
+whose tree ancestors are all the rest. x IS-A y when x, or one of its
+labels, is in the range of y, which takes two binary searches over the
+memory-mapped file and nothing else.
+
+The file, little-endian, with every section 8 byte aligned:
+
+    MAGIC, concept count (uint64), label count (uint64)
+    ids           int64[concepts]      the SCTIDs, sorted
+    label_starts  int64[concepts + 1]  the labels of concept i are
+                                       labels[label_starts[i]:
+                                              label_starts[i + 1]]
+    pre           int32[concepts]      preorder number of each concept
+    end           int32[concepts]      pre + the size of its tree
+    labels        int32[labels]        sorted, per concept
+
+This module only uses the standard library, so that it can be copied into
+the services that use the index.
+"""
+import bisect
+import mmap
+import struct
+import sys
+
+MAGIC = b'SCTISA01'
+_HEADER = struct.Struct('<8sQQ')
+
+
+def section_offsets(concepts, labels):
+    """The byte offsets of the sections, and the file size"""
+    offsets = {}
+    position = _HEADER.size
+    for name, size in (('ids', 8 * concepts),
+                       ('label_starts', 8 * (concepts + 1)),
+                       ('pre', 4 * concepts), ('end', 4 * concepts),
+                       ('labels', 4 * labels)):
+        offsets[name] = position
+        position += size + -size % 8
+    return offsets, position
+
+
+def header(concepts, labels):
+    return _HEADER.pack(MAGIC, concepts, labels)
+
+
+class SubsumptionIndex(object):
+    """A memory-mapped subsumption index
+
+    Use it as a context manager, or close() it when done.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('The subsumption index is little-endian')
+        with open(path, 'rb') as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, concepts, labels = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('{} is not a subsumption index'.format(path))
+        offsets, size = section_offsets(concepts, labels)
+        if len(self._map) != size:
+            self._map.close()
+            raise ValueError('{} is truncated'.format(path))
+        view = memoryview(self._map)
+        self._views = [view]
+
+        def section(name, count, code):
+            part = view[offsets[name]:offsets[name] + count *
+                        struct.calcsize(code)].cast(code)
+            self._views.append(part)
+            return part
+
+        self._ids = section('ids', concepts, 'q')
+        self._label_starts = section('label_starts', concepts + 1, 'q')
+        self._pre = section('pre', concepts, 'i')
+        self._end = section('end', concepts, 'i')
+        self._labels = section('labels', labels, 'i')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._map.close()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _index(self, concept_id):
+        index = bisect.bisect_left(self._ids, concept_id)
+        if index == len(self._ids) or self._ids[index] != concept_id:
+            return None
+        return index
+
+    def __contains__(self, concept_id):
+        return self._index(concept_id) is not None
+
+    def is_a(self, concept_id, ancestor_id):
+        """Whether ancestor_id is an ancestor of concept_id
+
+        A concept is not its own ancestor, as in the closure table.
+
+        :raises KeyError: if either concept is not in the index
+        """
+        concept = self._index(concept_id)
+        ancestor = self._index(ancestor_id)
+        if concept is None or ancestor is None:
+            raise KeyError(concept_id if concept is None else ancestor_id)
+        if concept == ancestor:
+            return False
+        start, end = self._pre[ancestor], self._end[ancestor]
+        if start <= self._pre[concept] < end:
+            return True
+        first = self._label_starts[concept]
+        last = self._label_starts[concept + 1]
+        label = bisect.bisect_left(self._labels, start, first, last)
+        return label < last and self._labels[label] < end
@@ -0,0 +1,82 @@
+# coding=utf-8
+"""The preferred terms of the concepts, held in the exporting process
+
+get_concept_preferred_term() costs an index probe per call, and the
+reference set exports call it several times per row. A TermDictionary
+loads a term table once, as a sorted array of ids, the offsets of their
+terms, and one string that has all of the terms; the names of a batch of
+rows are then found with one binary search per id.
+"""
+import numpy as np
+
+PREFERRED_TERMS_QUERY = (
+    'SELECT concept_id, preferred_term FROM concept_preferred_terms '
+    'WHERE preferred_term IS NOT NULL')
+FETCH_ROWS = 100000
+
+
+class TermDictionary(object):
+    """concept id -> term; the ids without a term give None, like NULL"""
+
+    def __init__(self, ids, offsets, blob):
+        """
+        :param ids: the concept ids, a sorted int64 array
+        :param offsets: where the term of ids[i] is in blob, from
+            offsets[i] to offsets[i + 1]
+        :param blob: all of the terms, one after the other
+        """
+        self._ids = ids
+        self._offsets = offsets
+        self._blob = blob
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """A dictionary of (concept id, term) pairs, in any order"""
+        pairs = sorted(pairs)
+        ids = np.array([concept_id for concept_id, _ in pairs],
+                       dtype=np.int64)
+        offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+        np.cumsum([len(term) for _, term in pairs], out=offsets[1:])
+        return cls(ids, offsets, ''.join(term for _, term in pairs))
+
+    @classmethod
+    def load(cls, conn, query):
+        """Read (concept id, term) rows with a server-side cursor
+
+        :param conn: a connection that is not in autocommit mode
+        :param query: e.g. PREFERRED_TERMS_QUERY
+        """
+        cursor = conn.cursor(name='term_dictionary')
+        cursor.itersize = FETCH_ROWS
+        try:
+            cursor.execute(query)
+            return cls.from_pairs(cursor)
+        finally:
+            cursor.close()
+            conn.rollback()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, concept_id):
+        """The term of one concept; KeyError if it has none"""
+        term = self.lookup([concept_id])[0]
+        if term is None:
+            raise KeyError(concept_id)
+        return term
+
+    def lookup(self, concept_ids):
+        """The terms of a sequence of ids, as a list; None for an id that
+        has no term, or that is None itself"""
+        if len(self._ids) == 0:
+            return [None] * len(concept_ids)
+        ids = np.array([-1 if concept_id is None else concept_id
+                        for concept_id in concept_ids], dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._ids, ids),
+                               len(self._ids) - 1)
+        found = (self._ids[positions] == ids).tolist()
+        starts = self._offsets[positions].tolist()
+        ends = self._offsets[positions + 1].tolist()
+        blob = self._blob
+        return [blob[start:end] if present else None
+                for start, end, present in zip(starts, ends, found)]
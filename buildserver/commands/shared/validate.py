@@ -0,0 +1,199 @@
+# coding=utf-8
+"""Check the SCTIDs of an RF2 release as it is loaded
+
+An SCTID ends in a Verhoeff check digit, and the two digits before it are
+its partition identifier: 00 / 10 for a concept, 01 / 11 for a description
+and 02 / 12 for a relationship (core / extension). The checks are done a
+column at a time with NumPy, over the blocks that the loader streams to
+COPY, so a file with a bad id fails its COPY and nothing of it is loaded;
+the loader then stops the load (see invalid_ids).
+"""
+import numpy as np
+
+from collections import namedtuple
+
+# The Verhoeff dihedral group multiplication, position permutation and
+# inverse tables
+_D = np.array([
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8],
+    [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2],
+    [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+], dtype=np.int8)
+_P = np.array([
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0],
+    [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5],
+    [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+], dtype=np.int8)
+_INV = [0, 4, 3, 2, 1, 5, 6, 7, 8, 9]
+
+MIN_SCTID_LENGTH = 6
+MAX_SCTID_LENGTH = 18
+
+CONCEPT = (0, 10)
+DESCRIPTION = (1, 11)
+RELATIONSHIP = (2, 12)
+COMPONENT = CONCEPT + DESCRIPTION + RELATIONSHIP
+
+# moduleId, refsetId and referencedComponentId, common to all refsets
+REFSET_COLUMNS = {3: CONCEPT, 4: CONCEPT, 5: COMPONENT}
+_DESCRIPTION = {0: DESCRIPTION, 3: CONCEPT, 4: CONCEPT, 6: CONCEPT,
+                8: CONCEPT}
+_RELATIONSHIP = {0: RELATIONSHIP, 3: CONCEPT, 4: CONCEPT, 5: CONCEPT,
+                 7: CONCEPT, 8: CONCEPT, 9: CONCEPT}
+# RF2 category (the LOADERS keys) -> {column: allowed partition ids}; the
+# other reference sets are checked on REFSET_COLUMNS
+ID_COLUMNS = {
+    'CONCEPTS': {0: CONCEPT, 3: CONCEPT, 4: CONCEPT},
+    'DESCRIPTIONS': _DESCRIPTION,
+    'TEXT_DEFINITIONS': _DESCRIPTION,
+    'RELATIONSHIPS': _RELATIONSHIP,
+    # acceptabilityId, valueId and targetComponentId
+    'LANGUAGE_REFERENCE_SET': {3: CONCEPT, 4: CONCEPT, 5: DESCRIPTION,
+                               6: CONCEPT},
+    'ATTRIBUTE_VALUE_REFERENCE_SET': {3: CONCEPT, 4: CONCEPT, 5: COMPONENT,
+                                      6: CONCEPT},
+    'ASSOCIATION_REFERENCE_SET': {3: CONCEPT, 4: CONCEPT, 5: COMPONENT,
+                                  6: COMPONENT},
+}
+
+Problem = namedtuple('Problem', ['line', 'column', 'value', 'reason'])
+INVALID_IDS = 'invalid SCTIDs'
+
+
+def verhoeff_digit(number):
+    """The Verhoeff check digit for a string of digits, as a string"""
+    check = 0
+    for position, digit in enumerate(reversed(number), 1):
+        check = _D[check][_P[position % 8][int(digit)]]
+    return str(_INV[check])
+
+
+def check_ids(values, partitions):
+    """Check a column of SCTIDs at once
+
+    :param values: the ids, as bytes or str
+    :param partitions: the partition ids that are allowed in the column
+    :return: a boolean array, False where an id is not valid, and the
+        reason for the first invalid id (None if they are all valid)
+    """
+    raw = np.array(values)
+    lengths = np.char.str_len(raw)
+    try:
+        numbers = raw.astype(np.int64)
+    except (ValueError, OverflowError):
+        # Rare; find the ids that are not numbers the slow way
+        digits = np.array([
+            value.isdigit() and len(value) <= MAX_SCTID_LENGTH
+            for value in values])
+        numbers = np.where(digits, raw, b'0' if raw.dtype.kind == 'S'
+                           else '0').astype(np.int64)
+    else:
+        digits = np.ones(len(numbers), dtype=bool)
+
+    # Run the Verhoeff check over the digits from the right; an id is valid
+    # when it ends back on 0. Positions past the first digit are skipped.
+    check = np.zeros(len(numbers), dtype=np.int8)
+    remaining = numbers.copy()
+    length = np.zeros(len(numbers), dtype=np.int64)
+    for position in range(MAX_SCTID_LENGTH + 1):
+        present = (remaining > 0) | (position == 0)
+        step = _D[check, _P[position % 8][remaining % 10]]
+        check = np.where(present, step, check)
+        length += present
+        remaining //= 10
+
+    checks = [
+        (digits, 'not a number'),
+        ((lengths >= MIN_SCTID_LENGTH) & (lengths <= MAX_SCTID_LENGTH) &
+         (lengths == length), 'not an SCTID'),
+        (check == 0, 'bad check digit'),
+        (np.isin(numbers // 10 % 100, partitions), 'wrong partition'),
+    ]
+    valid = np.ones(len(numbers), dtype=bool)
+    reason = None
+    for passed, description in checks:
+        if reason is None and not passed[valid].all():
+            reason = description
+        valid &= passed
+    return valid, reason
+
+
+def check_rows(rows, columns, first_line=2, limit=10):
+    """Check the id columns of a batch of RF2 rows
+
+    :param rows: the rows, split into fields
+    :param columns: {column: allowed partition ids}, from ID_COLUMNS
+    :param first_line: the line number of the first row, for the problems
+    :return: a list of up to `limit` Problems
+    """
+    problems = []
+    if not rows:
+        return problems
+    fields = list(zip(*rows))
+    for column, partitions in sorted(columns.items()):
+        if column >= len(fields):
+            problems.append(
+                Problem(first_line, column, None, 'missing column'))
+            continue
+        valid, reason = check_ids(fields[column], partitions)
+        for index in np.flatnonzero(~valid)[:limit - len(problems)]:
+            _, reason = check_ids(fields[column][index:index + 1],
+                                  partitions)
+            problems.append(Problem(first_line + int(index), column,
+                                    fields[column][index], reason))
+        if len(problems) >= limit:
+            break
+    return problems
+
+
+def check_blocks(blocks, columns, limit=10):
+    """Check the ids in line-aligned blocks of RF2 rows, as they stream by
+
+    :return: the number of rows checked, and up to `limit` Problems
+    """
+    row_count = 0
+    problems = []
+    for block in blocks:
+        rows = [line.split(b'\t') for line in block.splitlines()]
+        problems += check_rows(rows, columns, row_count + 2,
+                               limit - len(problems))
+        row_count += len(rows)
+        if len(problems) >= limit:
+            break
+    return row_count, problems
+
+
+def checked_blocks(blocks, columns, limit=10):
+    """Pass line-aligned blocks of RF2 rows on, checking their ids first
+
+    :param columns: {column: allowed partition ids}, from ID_COLUMNS
+    :raises ValueError: at the first block that has a bad id, with up to
+        `limit` of its Problems
+    """
+    row_count = 0
+    for block in blocks:
+        rows = [line.split(b'\t') for line in block.splitlines()]
+        problems = check_rows(rows, columns, row_count + 2, limit)
+        if problems:
+            raise ValueError('{}: {}'.format(INVALID_IDS, '; '.join(
+                'line {} column {} {!r}: {}'.format(*problem)
+                for problem in problems)))
+        row_count += len(rows)
+        yield block
+
+
+def invalid_ids(error):
+    """Whether a load error, as a string, is from checked_blocks"""
+    return INVALID_IDS in error
@@ -0,0 +1,178 @@
+"""Build the IS-A transitive closure in memory, and check it against SQL"""
+import os
+import time
+import click
+
+from sil_snomed_server.config.config import basedir
+from .shared import closure, connections, metrics, sql_script, subsumption
+
+SQL_SCRIPT = os.path.join(basedir, 'migrations/sql/transitive_closure.sql')
+SQL_COPY = 'single_snapshot_transitive_closure_sql'
+
+
+def build_closure(conn):
+    """Compute the closure and write it, as one transaction
+
+    :return: the number of rows written
+    """
+    cursor = conn.cursor()
+    with metrics.stage('closure/read_edges') as stage:
+        children, parents = closure.read_edges(cursor)
+        stage.rows = len(children)
+    cursor.execute(closure.EFFECTIVE_TIME_QUERY)
+    effective_time = cursor.fetchone()[0]
+    with metrics.stage('closure/compute') as stage:
+        subtypes, supertypes = closure.transitive_closure(children, parents)
+        stage.rows = len(subtypes)
+    with metrics.stage('closure/write') as stage:
+        closure.write_closure(cursor, subtypes, supertypes, effective_time)
+        closure.save_edges(cursor)
+        conn.commit()
+        stage.rows = len(subtypes)
+    click.echo('{:,} IS-A edges, {:,} closure rows as of {}'.format(
+        len(children), len(subtypes), effective_time))
+    return len(subtypes)
+
+
+def update_closure(conn):
+    """Update the closure for the IS-A edges that changed since it was built
+
+    It is built from scratch if there is no closure, or no closure_edges
+    to compare with.
+
+    :return: the concepts whose ancestors changed, or None after a build
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT to_regclass(%s) IS NULL OR to_regclass(%s) IS NULL',
+                   (closure.CLOSURE_TABLE, closure.EDGES_TABLE))
+    if cursor.fetchone()[0]:
+        click.echo('No previous closure to update; building it')
+        build_closure(conn)
+        return None
+    with metrics.stage('closure/read_edges') as stage:
+        old_edges = zip(*(ids.tolist() for ids in closure.read_edges(
+            cursor, closure.PREVIOUS_EDGES_QUERY)))
+        children, parents = closure.read_edges(cursor)
+        new_edges = zip(children.tolist(), parents.tolist())
+        stage.rows = len(children)
+    cursor.execute(closure.EFFECTIVE_TIME_QUERY)
+    effective_time = cursor.fetchone()[0]
+    with metrics.stage('closure/compute') as stage:
+        added, removed, changed = closure.closure_changes(
+            old_edges, new_edges,
+            lambda concepts: closure.read_ancestors(cursor, concepts))
+        stage.rows = len(changed)
+    with metrics.stage('closure/write') as stage:
+        closure.apply_changes(cursor, added, removed, changed, effective_time)
+        conn.commit()
+        stage.rows = len(added) + len(removed)
+    click.echo('{:,} concepts with new ancestors: {:,} closure rows added, '
+               '{:,} removed'.format(len(changed), len(added), len(removed)))
+    return changed
+
+
+@click.group()
+def transitive_closure():
+    """The transitive closure of the IS-A hierarchy"""
+
+
+@transitive_closure.command()
+def build():
+    """(Re)build single_snapshot_transitive_closure from the snapshot"""
+    conn = connections.connect('index')
+    try:
+        build_closure(conn)
+    finally:
+        conn.close()
+
+
+@transitive_closure.command()
+def update():
+    """Update single_snapshot_transitive_closure for the changed IS-A edges
+
+    The concepts whose ancestors changed are listed in changed_components.
+    """
+    conn = connections.connect('index')
+    try:
+        update_closure(conn)
+    finally:
+        conn.close()
+
+
+@transitive_closure.command()
+@click.option('--output', required=True, type=click.Path(dir_okay=False),
+              help='Where to write the index, e.g. in final_build_data')
+def index(output):
+    """Write the compact subsumption index of the closure
+
+    See commands/shared/subsumption_reader.py, which reads it.
+    """
+    conn = connections.connect('index')
+    try:
+        cursor = conn.cursor()
+        with metrics.stage('closure/index') as stage:
+            children, parents = closure.read_edges(cursor)
+            subtypes, supertypes = closure.read_edges(
+                cursor, 'SELECT subtype_id, supertype_id FROM {}'.format(
+                    closure.CLOSURE_TABLE))
+            built = subsumption.build_index(
+                children, parents, subtypes, supertypes)
+            stage.rows = len(subtypes)
+            stage.bytes_out = subsumption.write_index(built, output)
+    finally:
+        conn.close()
+    click.echo('{:,} concepts, {:,} labels for {:,} closure rows: {:,} bytes'
+               .format(len(built.ids), len(built.labels), len(subtypes),
+                       stage.bytes_out))
+
+
+@transitive_closure.command()
+def benchmark():
+    """Build the closure with transitive_closure.sql and in memory
+
+    Both are timed and their rows compared; the in-memory one is kept.
+    """
+    conn = connections.connect('index')
+    cursor = conn.cursor()
+    try:
+        with open(SQL_SCRIPT, 'r') as script:
+            functions = [statement for statement in
+                         sql_script.parse_script(script.read())
+                         if statement.kind == 'function']
+        for statement in functions:
+            cursor.execute(statement.text)
+        start_time = time.time()
+        with metrics.stage('closure_benchmark/sql'):
+            cursor.execute('SELECT generate_single_snapshot_transitive_'
+                           'closure(get_tc_effective_time())')
+        sql_seconds = time.time() - start_time
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(SQL_COPY))
+        cursor.execute('CREATE TABLE {} AS TABLE {}'.format(
+            SQL_COPY, closure.CLOSURE_TABLE))
+        conn.commit()
+
+        start_time = time.time()
+        with metrics.stage('closure_benchmark/memory'):
+            build_closure(conn)
+        memory_seconds = time.time() - start_time
+
+        cursor.execute(
+            'SELECT count(*) FROM ((TABLE {0} EXCEPT ALL TABLE {1}) '
+            'UNION ALL (TABLE {1} EXCEPT ALL TABLE {0})) AS differences'
+            .format(closure.CLOSURE_TABLE, SQL_COPY))
+        differences = cursor.fetchone()[0]
+        cursor.execute('DROP TABLE {}'.format(SQL_COPY))
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo('SQL: {:.1f}s, in memory: {:.1f}s ({:.1f}x)'.format(
+        sql_seconds, memory_seconds,
+        sql_seconds / memory_seconds if memory_seconds else 0))
+    if differences:
+        raise click.ClickException(
+            '{} rows differ between the two closures'.format(differences))
+    click.echo('The two closures have the same rows')
+
+
+if __name__ == '__main__':
+    transitive_closure()
@@ -6,3 +6,4 @@ export SECRET_KEY=de00842abffbee09f09e7b44b53b7d9abe0e28a090933169b69f750f9997a5
 export APP_SETTINGS='sil_snomed_server.config.config.StagingConfig'
 export DATABASE_URL={{database_url}}
 export MIGRATIONS_PATH={{venv_dir}}/lib/python3.6/site-packages/sil_snomed_server/migrations
+export BUILD_METRICS_FILE={{install_dir}}/build_metrics/build_metrics.jsonl
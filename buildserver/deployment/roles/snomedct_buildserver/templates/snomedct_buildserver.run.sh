@@ -9,6 +9,7 @@ fetch_snomed_data(){
     snomed_data fetch && echo "good" ||  snomed_data fetch
 }
 
-python {{venv_dir}}/bin/manage.py db upgrade &&\
+build_metrics reset &&\
+    python {{venv_dir}}/bin/manage.py db upgrade &&\
     fetch_snomed_data &&\
-    load_snomed_data
+    load_snomed_data{% if load_bulk %} --bulk-load{% endif %}{% if load_binary_copy %} --binary-copy{% endif %}
@@ -66,6 +66,7 @@ setup(
         "Flask-SQLAlchemy~=2.3.2",
         "google-api-python-client~=1.7.7",
         "ipython~=7.2.0",
+        "numpy~=1.16.2",
         "oauth2client~=4.1.3",
         "psycopg2-binary~=2.7.6.1",
         "pytest~=4.0.2",
@@ -76,6 +77,13 @@ setup(
     buildserver=snomed_buildserver:instance
     snomed_data=commands.dropbox_content:snomed_data
     load_snomed_data=commands.load_full_release:load_snomed_data
+    build_metrics=commands.build_metrics:build_metrics
+    run_sql_script=commands.run_sql_script:run_sql_script
+    benchmark_snapshot=commands.benchmark_snapshot:benchmark_snapshot
+    benchmark_subsumption=commands.benchmark_subsumption:benchmark_subsumption
+    export_final_views=commands.export_final_views:export_final_views
+    transitive_closure=commands.transitive_closure:transitive_closure
+    concept_lookup=commands.concept_lookup:concept_lookup
     """,
     scripts=["manage.py"],
 )
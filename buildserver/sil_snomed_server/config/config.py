@@ -1,6 +1,21 @@
 import os
+import json
 basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+
+def _session_profiles(defaults):
+    """Merge the BUILD_SESSION_PROFILES JSON from the environment, if any
+
+    It has the same shape as the defaults, e.g. {"load": {"work_mem":
+    "128MB"}}, and overrides them setting by setting.
+    """
+    overrides = json.loads(os.environ.get('BUILD_SESSION_PROFILES', '{}'))
+    return {
+        stage: dict(defaults.get(stage, {}), **overrides.get(stage, {}))
+        for stage in set(defaults) | set(overrides)
+    }
+
+
 class Config(object):
     DEBUG = False
     TESTING = False
@@ -8,7 +23,35 @@ class Config(object):
     SECRET_KEY = os.environ['SECRET_KEY']
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
     MIGRATIONS_PATH = os.environ['MIGRATIONS_PATH']
+    # Session settings of the build connections, per stage; see
+    # commands/shared/connections.py
+    BUILD_SESSION_PROFILES = _session_profiles({
+        'load': {
+            'synchronous_commit': 'off',
+            'work_mem': '64MB',
+        },
+        'snapshot': {
+            'synchronous_commit': 'off',
+            'work_mem': '1GB',
+            'temp_buffers': '256MB',
+            'maintenance_work_mem': '1GB',
+            'max_parallel_workers_per_gather': 4,
+        },
+        'index': {
+            'synchronous_commit': 'off',
+            'maintenance_work_mem': '1GB',
+            'max_parallel_maintenance_workers': 2,
+        },
+        # The views of denormalized_concepts_descriptions_refsets.sql run
+        # side by side, and aggregate the closure into arrays
+        'denormalization': {
+            'synchronous_commit': 'off',
+            'work_mem': '256MB',
+            'maintenance_work_mem': '1GB',
+            'max_parallel_workers_per_gather': 2,
+        },
+    })
 
 class StagingConfig(Config):
     DEVELOPMENT = True
-    DEBUG = True
\ No newline at end of file
+    DEBUG = True
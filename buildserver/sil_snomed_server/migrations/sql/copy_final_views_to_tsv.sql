@@ -1,3 +1,6 @@
+-- Run by export_final_views, which turns each COPY into a COPY ... TO STDOUT
+-- into a file of the same name in its output folder, and runs them side by side
+
 COPY (SELECT
     get_adjacency_list(id, children) AS adjacency_list FROM concept_subsumption)
 TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/transitive_closure_adjacency_list.adjlist.gz' CSV HEADER;
@@ -7,143 +10,6 @@ COPY (
     * FROM language_reference_set_expanded_view)
 TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/language_reference_set_expanded_view.csv.gz' CSV HEADER;
 
--- we copy these reference sets directly to csv files, since they are only used in the termserver, not during the build step
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.attribute_description_id, get_concept_preferred_term(rf.attribute_description_id) AS attribute_description_name,
-    rf.attribute_type_id, get_concept_preferred_term(rf.attribute_type_id) AS attribute_type_name,
-    rf.attribute_order
-  FROM current_reference_set_descriptor_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/reference_set_descriptor_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name
-  FROM current_simple_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/simple_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active, rf.order,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.linked_to_id, get_concept_preferred_term(rf.linked_to_id) AS linked_to_name
-  FROM current_ordered_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/ordered_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.value_id, get_concept_preferred_term(rf.value_id) AS value_name
-  FROM current_attribute_value_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/attribute_value_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.map_target
-  FROM current_simple_map_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/simple_map_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.correlation_id, get_concept_preferred_term(rf.correlation_id) AS correlation_name,
-    rf.map_group, rf.map_priority, rf.map_rule, rf.map_advice, rf.map_target, rf.map_block
-  FROM current_complex_map_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/complex_map_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.correlation_id, get_concept_preferred_term(rf.correlation_id) AS correlation_name,
-    rf.map_category_id, get_concept_preferred_term(rf.map_category_id) AS map_category_name,
-    rf.map_group, rf.map_priority, rf.map_rule, rf.map_advice, rf.map_target
-  FROM current_extended_map_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/extended_map_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.query
-  FROM current_query_specification_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/query_specification_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.annotation
-  FROM current_annotation_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/annotation_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.target_component_id, get_concept_preferred_term(rf.target_component_id) AS target_component_name
-  FROM current_association_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/association_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.source_effective_time, rf.target_effective_time
-  FROM current_module_dependency_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/module_dependency_reference_set_expanded_view.csv.gz' CSV HEADER;
-
-
-COPY (
-  SELECT
-    rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
-    rf.referenced_component_id, get_concept_preferred_term(rf.referenced_component_id) AS referenced_component_name,
-    rf.description_format_id, get_concept_preferred_term(rf.description_format_id) AS description_format_name,
-    rf.description_length
-  FROM current_description_format_reference_set_snapshot rf)
-  TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/description_format_reference_set_expanded_view.csv.gz' CSV HEADER;
-
 COPY (
   SELECT
     concept.id AS component_id,
@@ -222,7 +88,7 @@ COPY (
 FROM current_concept_snapshot concept)
 TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/snomed_denormalized_concept_view_for_current_snapshot.csv.gz' CSV HEADER;
 
-
+-- The relationship view names its concepts with joins, so it is copied as it is
 COPY (
   SELECT id AS component_id,
   effective_time,
@@ -247,9 +113,9 @@ COPY (
   SELECT
   subtype_id,
   supertype_id,
-  effective_time,
+  closure_release.effective_time,
   active
-FROM single_snapshot_transitive_closure)
+FROM single_snapshot_transitive_closure, closure_release)
 TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/snomed_transitive_closure_for_current_snapshot.csv.gz' CSV HEADER;
 
 COPY (
@@ -0,0 +1,130 @@
+-- The normalized export profile of export_final_views: like
+-- copy_final_views_to_tsv.sql, but the concepts that a row refers to are
+-- given by their ids only, and concept_names has the preferred term and
+-- FSN of every concept, once
+
+COPY (SELECT
+    get_adjacency_list(id, children) AS adjacency_list FROM concept_subsumption)
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/transitive_closure_adjacency_list.adjlist.gz' CSV HEADER;
+
+COPY (
+  SELECT
+    concept.id AS concept_id,
+    pt.preferred_term,
+    (fsn.fully_specified_name).term AS fully_specified_name
+  FROM current_concept_snapshot concept
+  LEFT JOIN concept_preferred_terms pt ON pt.concept_id = concept.id
+  LEFT JOIN concept_fully_specified_names fsn ON fsn.concept_id = concept.id)
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/concept_names.csv.gz' CSV HEADER;
+
+COPY (
+  SELECT
+    concept.id AS component_id,
+    concept.effective_time,
+    concept.active,
+    concept.module_id,
+    concept.definition_status_id,
+    CASE WHEN concept.definition_status_id = 900000000000074008 THEN true ELSE false END AS is_primitive,
+    array_to_json(ARRAY(SELECT term FROM denormalized_description_for_current_snapshot WHERE concept_id = concept.id AND type_id=900000000000550004)) AS definition,
+    array_to_json(ARRAY(SELECT json_build_object(
+            'id', des.id,
+            'type_id', des.type_id,
+            'term', des.term,
+            'case_significance_id', des.case_significance_id)
+        FROM denormalized_description_for_current_snapshot des
+        JOIN current_language_reference_set_snapshot ref
+        ON ref.referenced_component_id = des.id
+        AND des.concept_id = concept.id
+        AND des.active = true)) AS descriptions,
+    subsumption.parents,
+    subsumption.children,
+    subsumption.ancestors,
+    subsumption.descendants,
+    array_to_json(ARRAY(
+      SELECT json_build_object(
+        'id', rel.id,
+        'effective_time', rel.effective_time,
+        'active', rel.active,
+        'module_id', rel.module_id,
+        'relationship_group', rel.relationship_group,
+        'source_id', rel.source_id,
+        'destination_id', rel.destination_id,
+        'type_id', rel.type_id,
+        'characteristic_type_id', rel.characteristic_type_id,
+        'modifier_id', rel.modifier_id)
+      FROM current_relationship_snapshot rel
+      WHERE rel.destination_id = concept.id
+      AND rel.active = true)) incoming_relationships,
+    array_to_json(ARRAY(
+      SELECT json_build_object(
+        'id', rel.id,
+        'effective_time', rel.effective_time,
+        'active', rel.active,
+        'module_id', rel.module_id,
+        'relationship_group', rel.relationship_group,
+        'source_id', rel.source_id,
+        'destination_id', rel.destination_id,
+        'type_id', rel.type_id,
+        'characteristic_type_id', rel.characteristic_type_id,
+        'modifier_id', rel.modifier_id)
+      FROM current_relationship_snapshot rel
+      WHERE rel.source_id = concept.id
+      AND rel.active = true)) outgoing_relationships,
+    array_to_json(ARRAY(
+      SELECT (
+        ref.refset_id,
+        ref.refset_type)::denormalized_reference_set_identifier
+      FROM snomed_denormalized_refset_view_for_current_snapshot ref
+      WHERE referenced_component_id = concept.id)) reference_set_memberships
+FROM current_concept_snapshot concept
+JOIN concept_subsumption subsumption ON subsumption.id = concept.id)
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/snomed_normalized_concept_view_for_current_snapshot.csv.gz' CSV HEADER;
+
+COPY (
+  SELECT
+  subtype_id,
+  supertype_id,
+  closure_release.effective_time,
+  active
+FROM single_snapshot_transitive_closure, closure_release)
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/snomed_transitive_closure_for_current_snapshot.csv.gz' CSV HEADER;
+
+COPY (
+  SELECT
+  id AS component_id,
+  module_id,
+  effective_time,
+  language_code,
+  active,
+  type_id,
+  term,
+  case_significance_id,
+  concept_id,
+  reference_set_memberships
+FROM denormalized_description_for_current_snapshot)
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/normalized_description_for_current_snapshot.csv.gz' CSV HEADER;
+
+-- All unique terms in the Descriptions table.
+COPY (
+  SELECT
+    word,
+    nentry
+FROM ts_stat('SELECT to_tsvector(''simple'', term) FROM denormalized_description_for_current_snapshot where active = true'))
+TO PROGRAM 'gzip > /opt/snomedct_buildserver/final_build_data/description_terms.csv.gz' CSV HEADER;
+
+-- outputs a file with a single line that looks like:
+-- snomed-20160131-release-server
+COPY (
+  SELECT
+      concat('snomed-',
+          replace(
+              split_part(
+                  trim(leading 'SNOMED Clinical Terms version:' from term),
+                  '(', 1),
+              ' [R]',
+              '-release-server'))
+  FROM current_description_snapshot
+  WHERE concept_id = 138875005
+  AND term LIKE '%SNOMED Clinical Terms version:%'
+  AND active = true)
+TO '/opt/snomedct_buildserver/final_build_data/current_version_info' CSV HEADER;
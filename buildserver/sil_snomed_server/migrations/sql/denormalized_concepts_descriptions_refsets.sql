@@ -61,43 +61,54 @@ CREATE OR REPLACE FUNCTION get_concept_fully_specified_name(bigint) returns text
 $$ LANGUAGE SQL;
 
 
+-- Each array is aggregated for all concepts at once, and joined to the concepts;
+-- the elements are in id order
 CREATE MATERIALIZED VIEW concept_subsumption AS
 SELECT
     concept.id,
-    ARRAY(SELECT
-        destination_id
-        FROM current_relationship_snapshot
-        WHERE source_id = concept.id
-        AND type_id = 116680003
-        AND active=true) AS parents,
-    ARRAY(SELECT
-        supertype_id
-        FROM single_snapshot_transitive_closure
-        WHERE subtype_id = concept.id) AS ancestors,
-    ARRAY(SELECT source_id
-        FROM current_relationship_snapshot
-        WHERE destination_id = concept.id
-        AND type_id = 116680003
-        AND active=true) AS children,
-    ARRAY(SELECT subtype_id
-        FROM single_snapshot_transitive_closure
-        WHERE supertype_id = concept.id) AS descendants
-FROM current_concept_snapshot concept;
+    COALESCE(parents.ids, '{}') AS parents,
+    COALESCE(ancestors.ids, '{}') AS ancestors,
+    COALESCE(children.ids, '{}') AS children,
+    COALESCE(descendants.ids, '{}') AS descendants
+FROM current_concept_snapshot concept
+LEFT JOIN (
+    SELECT source_id AS id, array_agg(destination_id ORDER BY destination_id) AS ids
+    FROM current_relationship_snapshot
+    WHERE type_id = 116680003 AND active = true
+    GROUP BY source_id) parents ON parents.id = concept.id
+LEFT JOIN (
+    SELECT subtype_id AS id, array_agg(supertype_id ORDER BY supertype_id) AS ids
+    FROM single_snapshot_transitive_closure
+    GROUP BY subtype_id) ancestors ON ancestors.id = concept.id
+LEFT JOIN (
+    SELECT destination_id AS id, array_agg(source_id ORDER BY source_id) AS ids
+    FROM current_relationship_snapshot
+    WHERE type_id = 116680003 AND active = true
+    GROUP BY destination_id) children ON children.id = concept.id
+LEFT JOIN (
+    SELECT supertype_id AS id, array_agg(subtype_id ORDER BY subtype_id) AS ids
+    FROM single_snapshot_transitive_closure
+    GROUP BY supertype_id) descendants ON descendants.id = concept.id;
 
 create index denormalized_full_relationship_id on concept_subsumption (id);
 
 
 -- This index here plays an outsized role in the creation of the language_reference_set_expanded_view
 CREATE INDEX current_description_snapshot_id ON current_description_snapshot(id);
+-- The names are joined in, rather than looked up row by row
 CREATE MATERIALIZED VIEW language_reference_set_expanded_view AS
   SELECT
     rf.id, rf.effective_time, rf.active,
-    rf.module_id, get_concept_preferred_term(rf.module_id) AS module_name,
-    rf.refset_id, get_concept_preferred_term(rf.refset_id) AS refset_name,
+    rf.module_id, module.preferred_term AS module_name,
+    rf.refset_id, refset.preferred_term AS refset_name,
     rf.referenced_component_id,
-    (SELECT term FROM current_description_snapshot WHERE id = rf.referenced_component_id LIMIT 1) AS referenced_component_name,
-    rf.acceptability_id, get_concept_preferred_term(rf.acceptability_id) AS acceptability_name
-  FROM current_language_reference_set_snapshot rf;
+    description.term AS referenced_component_name,
+    rf.acceptability_id, acceptability.preferred_term AS acceptability_name
+  FROM current_language_reference_set_snapshot rf
+  LEFT JOIN concept_preferred_terms module ON module.concept_id = rf.module_id
+  LEFT JOIN concept_preferred_terms refset ON refset.concept_id = rf.refset_id
+  LEFT JOIN current_description_snapshot description ON description.id = rf.referenced_component_id
+  LEFT JOIN concept_preferred_terms acceptability ON acceptability.concept_id = rf.acceptability_id;
 CREATE UNIQUE INDEX language_reference_set_expanded_view_id ON language_reference_set_expanded_view(id);
 CREATE INDEX language_reference_set_expanded_view_referenced_component_id ON language_reference_set_expanded_view(referenced_component_id);
 CREATE INDEX language_reference_set_expanded_view_refset_id ON language_reference_set_expanded_view(refset_id);
@@ -115,73 +126,78 @@ RETURNS expanded_concept AS $$
 $$ LANGUAGE SQL;
 
 
+-- The expanded parents, children, ancestors and descendants of every concept,
+-- aggregated in one pass each. A concept without any has no row, and the
+-- functions below return NULL for it.
+CREATE MATERIALIZED VIEW concept_expanded_parents AS
+SELECT
+  rel.source_id AS concept_id,
+  array_agg((rel.destination_id, pt.preferred_term, (fsn.fully_specified_name).term)::expanded_concept
+            ORDER BY rel.destination_id) AS concepts
+FROM current_relationship_snapshot rel
+LEFT JOIN concept_preferred_terms pt ON pt.concept_id = rel.destination_id
+LEFT JOIN concept_fully_specified_names fsn ON fsn.concept_id = rel.destination_id
+WHERE rel.type_id = 116680003 AND rel.active = true
+GROUP BY rel.source_id;
+
+CREATE UNIQUE INDEX concept_expanded_parents_concept_id ON concept_expanded_parents (concept_id);
+
+CREATE MATERIALIZED VIEW concept_expanded_children AS
+SELECT
+  rel.destination_id AS concept_id,
+  array_agg((rel.source_id, pt.preferred_term, (fsn.fully_specified_name).term)::expanded_concept
+            ORDER BY rel.source_id) AS concepts
+FROM current_relationship_snapshot rel
+LEFT JOIN concept_preferred_terms pt ON pt.concept_id = rel.source_id
+LEFT JOIN concept_fully_specified_names fsn ON fsn.concept_id = rel.source_id
+WHERE rel.type_id = 116680003 AND rel.active = true
+GROUP BY rel.destination_id;
+
+CREATE UNIQUE INDEX concept_expanded_children_concept_id ON concept_expanded_children (concept_id);
+
+CREATE MATERIALIZED VIEW concept_expanded_ancestors AS
+SELECT
+  tc.subtype_id AS concept_id,
+  array_agg((tc.supertype_id, pt.preferred_term, (fsn.fully_specified_name).term)::expanded_concept
+            ORDER BY tc.supertype_id) AS concepts
+FROM single_snapshot_transitive_closure tc
+LEFT JOIN concept_preferred_terms pt ON pt.concept_id = tc.supertype_id
+LEFT JOIN concept_fully_specified_names fsn ON fsn.concept_id = tc.supertype_id
+GROUP BY tc.subtype_id;
+
+CREATE UNIQUE INDEX concept_expanded_ancestors_concept_id ON concept_expanded_ancestors (concept_id);
+
+CREATE MATERIALIZED VIEW concept_expanded_descendants AS
+SELECT
+  tc.supertype_id AS concept_id,
+  array_agg((tc.subtype_id, pt.preferred_term, (fsn.fully_specified_name).term)::expanded_concept
+            ORDER BY tc.subtype_id) AS concepts
+FROM single_snapshot_transitive_closure tc
+LEFT JOIN concept_preferred_terms pt ON pt.concept_id = tc.subtype_id
+LEFT JOIN concept_fully_specified_names fsn ON fsn.concept_id = tc.subtype_id
+GROUP BY tc.supertype_id;
+
+CREATE UNIQUE INDEX concept_expanded_descendants_concept_id ON concept_expanded_descendants (concept_id);
+
 CREATE OR REPLACE FUNCTION extract_expanded_concepts_for_ancestors(concept_id bigint)
 RETURNS expanded_concept[] AS $$
-  DECLARE
-    rel_ancestors bigint[];
-    ancestor bigint;
-    expanded_concepts expanded_concept[];
-  BEGIN
-    rel_ancestors := (SELECT ancestors
-      FROM concept_subsumption
-      WHERE id = concept_id);
-    FOREACH ancestor IN ARRAY rel_ancestors LOOP
-      expanded_concepts := expanded_concepts || expand_concept(ancestor);
-    END LOOP;
-    RETURN expanded_concepts;
-END;
-$$ LANGUAGE plpgsql;
+  SELECT concepts FROM concept_expanded_ancestors WHERE concept_expanded_ancestors.concept_id = $1;
+$$ LANGUAGE SQL STABLE PARALLEL SAFE;
 
 CREATE OR REPLACE FUNCTION extract_expanded_concepts_for_descendants(concept_id bigint)
 RETURNS expanded_concept[] AS $$
-  DECLARE
-    rel_descendants bigint[];
-    descendant bigint;
-    expanded_concepts expanded_concept[];
-  BEGIN
-    rel_descendants := (SELECT descendants
-      FROM concept_subsumption
-      WHERE id = concept_id);
-    FOREACH descendant IN ARRAY rel_descendants LOOP
-      expanded_concepts := expanded_concepts || expand_concept(descendant);
-    END LOOP;
-    RETURN expanded_concepts;
-END;
-$$ LANGUAGE plpgsql;
+  SELECT concepts FROM concept_expanded_descendants WHERE concept_expanded_descendants.concept_id = $1;
+$$ LANGUAGE SQL STABLE PARALLEL SAFE;
 
 CREATE OR REPLACE FUNCTION extract_expanded_concepts_for_children(concept_id bigint)
 RETURNS expanded_concept[] AS $$
-  DECLARE
-    rel_children bigint[];
-    child bigint;
-    expanded_concepts expanded_concept[];
-  BEGIN
-    rel_children := (SELECT children
-      FROM concept_subsumption
-      WHERE id = concept_id);
-    FOREACH child IN ARRAY rel_children LOOP
-      expanded_concepts := expanded_concepts || expand_concept(child);
-    END LOOP;
-    RETURN expanded_concepts;
-END;
-$$ LANGUAGE plpgsql;
+  SELECT concepts FROM concept_expanded_children WHERE concept_expanded_children.concept_id = $1;
+$$ LANGUAGE SQL STABLE PARALLEL SAFE;
 
 CREATE OR REPLACE FUNCTION extract_expanded_concepts_for_parents(concept_id bigint)
 RETURNS expanded_concept[] AS $$
-  DECLARE
-    rel_parents bigint[];
-    parent bigint;
-    expanded_concepts expanded_concept[];
-  BEGIN
-    rel_parents := (SELECT parents
-      FROM concept_subsumption
-      WHERE id = concept_id);
-    FOREACH parent IN ARRAY rel_parents LOOP
-      expanded_concepts := expanded_concepts || expand_concept(parent);
-    END LOOP;
-    RETURN expanded_concepts;
-END;
-$$ LANGUAGE plpgsql;
+  SELECT concepts FROM concept_expanded_parents WHERE concept_expanded_parents.concept_id = $1;
+$$ LANGUAGE SQL STABLE PARALLEL SAFE;
 
 
 CREATE TYPE denormalized_reference_set_identifier AS (
@@ -279,19 +295,25 @@ CREATE MATERIALIZED VIEW snomed_denormalized_relationship_for_current_snapshot A
     relationship.effective_time,
     relationship.active,
     relationship.module_id,
-    get_concept_preferred_term(relationship.module_id) module_name,
+    module.preferred_term module_name,
     relationship.relationship_group,
     relationship.source_id,
-    get_concept_preferred_term(relationship.source_id) source_name,
+    source.preferred_term source_name,
     relationship.destination_id,
-    get_concept_preferred_term(relationship.destination_id) destination_name,
+    destination.preferred_term destination_name,
     relationship.type_id,
-    get_concept_preferred_term(relationship.type_id) type_name,
+    type.preferred_term type_name,
     relationship.characteristic_type_id,
-    get_concept_preferred_term(relationship.characteristic_type_id) characteristic_type_name,
+    characteristic_type.preferred_term characteristic_type_name,
     relationship.modifier_id,
-    get_concept_preferred_term(relationship.modifier_id) modifier_name
-FROM current_relationship_snapshot relationship;
+    modifier.preferred_term modifier_name
+FROM current_relationship_snapshot relationship
+LEFT JOIN concept_preferred_terms module ON module.concept_id = relationship.module_id
+LEFT JOIN concept_preferred_terms source ON source.concept_id = relationship.source_id
+LEFT JOIN concept_preferred_terms destination ON destination.concept_id = relationship.destination_id
+LEFT JOIN concept_preferred_terms type ON type.concept_id = relationship.type_id
+LEFT JOIN concept_preferred_terms characteristic_type ON characteristic_type.concept_id = relationship.characteristic_type_id
+LEFT JOIN concept_preferred_terms modifier ON modifier.concept_id = relationship.modifier_id;
 
 CREATE TYPE denormalized_relationship_type AS (
        id bigint,
@@ -324,16 +346,19 @@ SELECT
     description.effective_time,
     description.active,
     description.module_id,
-    get_concept_preferred_term(description.module_id) module_name,
+    module.preferred_term module_name,
     description.language_code,
     description.type_id,
-    get_concept_preferred_term(description.type_id) type_name,
+    type.preferred_term type_name,
     description.term,
     description.case_significance_id,
-    get_concept_preferred_term(description.case_significance_id) case_significance_name,
+    case_significance.preferred_term case_significance_name,
     description.concept_id,
     array_to_json(ARRAY(SELECT (ref.refset_id, ref.refset_type)::denormalized_reference_set_identifier FROM snomed_denormalized_refset_view_for_current_snapshot ref WHERE referenced_component_id = description.id)) reference_set_memberships
-FROM current_description_snapshot description;
+FROM current_description_snapshot description
+LEFT JOIN concept_preferred_terms module ON module.concept_id = description.module_id
+LEFT JOIN concept_preferred_terms type ON type.concept_id = description.type_id
+LEFT JOIN concept_preferred_terms case_significance ON case_significance.concept_id = description.case_significance_id;
 
 CREATE INDEX denormalized_description_concept_id ON denormalized_description_for_current_snapshot (concept_id);
 CREATE INDEX denormalized_description_id ON denormalized_description_for_current_snapshot (id);
@@ -0,0 +1,69 @@
+import struct
+import uuid
+
+from datetime import date
+
+import pytest
+
+from commands.shared import binary_copy
+
+TYPES = ['bigint', 'integer', 'boolean', 'date', 'uuid', 'text', 'text']
+
+
+def _fields(stream):
+    """The fields of each row of a binary COPY stream, as bytes"""
+    assert stream.startswith(binary_copy.HEADER)
+    assert stream.endswith(binary_copy.TRAILER)
+    data = stream[len(binary_copy.HEADER):-len(binary_copy.TRAILER)]
+    rows = []
+    position = 0
+    while position < len(data):
+        count, = struct.unpack_from('>h', data, position)
+        position += 2
+        row = []
+        for _ in range(count):
+            length, = struct.unpack_from('>i', data, position)
+            position += 4
+            row.append(data[position:position + length])
+            position += length
+        rows.append(row)
+    return rows
+
+
+class TestEncodeRf2:
+    def test_fields(self):
+        member = uuid.UUID('800aa109-431f-4407-a431-6fe65e9db160')
+        block = ('900000000000207008\t-3\t1\t20170131\t{}\tZehn ü\t\r\n'
+                 '138875005\t7\t0\t20000101\t{}\ta\tb\r\n').format(
+                     member, member).encode('utf-8')
+        rows = _fields(b''.join(binary_copy.encode_rf2([block], TYPES)))
+        assert rows[0] == [
+            struct.pack('>q', 900000000000207008), struct.pack('>i', -3),
+            b'\x01',
+            struct.pack('>i', (date(2017, 1, 31) - date(2000, 1, 1)).days),
+            member.bytes, 'Zehn ü'.encode('utf-8'), b'']
+        assert rows[1][2:4] == [b'\x00', struct.pack('>i', 0)]
+        assert rows[1][5:] == [b'a', b'b']
+
+    def test_empty_field_is_not_null(self):
+        stream = b''.join(binary_copy.encode_rf2([b'1\t\n'],
+                                                 ['bigint', 'text']))
+        # An empty value has the length 0; a NULL would have -1
+        assert stream[len(binary_copy.HEADER):-len(binary_copy.TRAILER)] == (
+            struct.pack('>hiqi', 2, 8, 1, 0))
+
+    def test_blocks(self):
+        blocks = [b'1\tx\n', b'', b'2\tyy\n3\tzzz\n']
+        assert _fields(b''.join(binary_copy.encode_rf2(
+            blocks, ['bigint', 'text']))) == [
+            [struct.pack('>q', number), text] for number, text in
+            [(1, b'x'), (2, b'yy'), (3, b'zzz')]]
+
+    def test_field_count(self):
+        with pytest.raises(Exception, match='Expected 2 fields'):
+            list(binary_copy.encode_rf2([b'1\tx\n2\n'], ['bigint', 'text']))
+
+    def test_block_reader(self):
+        reader = binary_copy.BlockReader([b'abc', b'de'])
+        assert [reader.read(2), reader.read(2), reader.read(), reader.read()
+                ] == [b'ab', b'c', b'de', b'']
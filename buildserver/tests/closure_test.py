@@ -0,0 +1,93 @@
+import numpy as np
+
+from commands.shared import closure
+
+
+def _pairs(children, parents):
+    subtypes, supertypes = closure.transitive_closure(
+        np.array(children), np.array(parents))
+    return sorted(zip(subtypes.tolist(), supertypes.tolist()))
+
+
+def _expected(children, parents):
+    """The closure, by repeated joins as in transitive_closure.sql"""
+    edges = set(zip(children, parents))
+    pairs = set(edges)
+    while True:
+        more = {(child, ancestor) for child, parent in edges
+                for middle, ancestor in pairs if middle == parent}
+        if more <= pairs:
+            return sorted(pairs)
+        pairs |= more
+
+
+class TestTransitiveClosure:
+    def test_hierarchy(self):
+        # 138875005 <- 10 <- 20 <- 40, and 10 <- 30 <- 40; 40 <- 50 twice
+        children = [10, 20, 30, 40, 40, 50, 50]
+        parents = [138875005, 10, 10, 20, 30, 40, 40]
+        assert _pairs(children, parents) == _expected(children, parents)
+
+    def test_random_graph(self):
+        generator = np.random.RandomState(1)
+        children = list(range(2, 300))
+        parents = [int(generator.randint(1, child)) for child in children]
+        children += children[50:]
+        parents += [int(generator.randint(1, child))
+                    for child in children[50:298]]
+        assert _pairs(children, parents) == _expected(children, parents)
+
+    def test_cycle(self):
+        children = [1, 2, 3, 4]
+        parents = [2, 3, 1, 3]
+        assert _pairs(children, parents) == _expected(children, parents)
+
+
+def _ancestors(children, parents):
+    ancestors = {}
+    for subtype, supertype in _pairs(children, parents):
+        ancestors.setdefault(subtype, set()).add(supertype)
+    return ancestors
+
+
+def _update(old, new):
+    """The closure of old updated to new, and the concepts that changed"""
+    ancestors = _ancestors(*zip(*old))
+    added, removed, changed = closure.closure_changes(
+        old, new, lambda concepts: {concept: ancestors[concept]
+                                    for concept in concepts
+                                    if concept in ancestors})
+    pairs = set(_pairs(*zip(*old)))
+    assert not added & pairs and removed <= pairs
+    return sorted((pairs - removed) | added), changed
+
+
+class TestClosureChanges:
+    def test_no_changes(self):
+        edges = [(10, 1), (20, 10), (30, 20)]
+        assert closure.closure_changes(edges, edges, None) == (
+            set(), set(), set())
+
+    def test_added_and_removed_edges(self):
+        # 30 moves from under 20 to under 15; 40 is new under 30
+        old = [(10, 1), (15, 1), (20, 10), (30, 20), (35, 30), (25, 15)]
+        new = [(10, 1), (15, 1), (20, 10), (30, 15), (35, 30), (25, 15),
+               (40, 30)]
+        pairs, changed = _update(old, new)
+        assert pairs == _pairs(*zip(*new))
+        assert changed == {30, 35, 40}
+
+    def test_random_changes(self):
+        generator = np.random.RandomState(2)
+        old = [(child, int(generator.randint(1, child)))
+               for child in range(2, 200)]
+        new = [edge for edge in old if generator.rand() > 0.05]
+        new += [(child, int(generator.randint(1, child)))
+                for child in generator.randint(2, 250, 20)]
+        pairs, changed = _update(old, new)
+        assert pairs == _pairs(*zip(*new))
+        old_ancestors = _ancestors(*zip(*old))
+        new_ancestors = _ancestors(*zip(*new))
+        assert changed == {
+            concept for concept in set(old_ancestors) | set(new_ancestors)
+            if old_ancestors.get(concept) != new_ancestors.get(concept)}
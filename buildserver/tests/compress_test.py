@@ -0,0 +1,70 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+
+import pytest
+
+from commands.shared.compress import CODECS, Compression, ParallelBlockWriter
+
+DATA = b''.join(b'%d,Concept %d\n' % (number, number)
+                for number in range(20000))
+OPEN = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open, 'none': open}
+
+
+def _write(path, compression, chunks):
+    with ParallelBlockWriter(path, compression, threads=3,
+                             block_size=10000) as output:
+        for chunk in chunks:
+            output.write(chunk)
+    return output
+
+
+class TestParallelBlockWriter:
+    def test_codecs(self, tmpdir):
+        chunks = [DATA[start:start + 777]
+                  for start in range(0, len(DATA), 777)]
+        for codec in CODECS:
+            path = str(tmpdir.join('out' + CODECS[codec].extension))
+            output = _write(path, Compression(codec, 1), chunks)
+            with OPEN[codec](path, 'rb') as result:
+                assert result.read() == DATA
+            assert output.bytes_in == len(DATA)
+            assert output.bytes_out == os.path.getsize(path)
+            with open(path, 'rb') as result:
+                assert output.sha256 == hashlib.sha256(
+                    result.read()).hexdigest()
+
+    def test_gzip_members(self, tmpdir):
+        path = str(tmpdir.join('out.gz'))
+        _write(path, Compression.parse('gzip'), [DATA])
+        with open(path, 'rb') as result:
+            compressed = result.read()
+        assert compressed.count(b'\x1f\x8b\x08\x00\x00\x00\x00\x00') == 1
+        path = str(tmpdir.join('blocks.gz'))
+        _write(path, Compression.parse('gzip:6'),
+               [DATA[start:start + 5000]
+                for start in range(0, len(DATA), 5000)])
+        with open(path, 'rb') as result:
+            compressed = result.read()
+        assert compressed.count(b'\x1f\x8b\x08\x00\x00\x00\x00\x00') > 1
+        assert gzip.decompress(compressed) == DATA
+
+    def test_empty(self, tmpdir):
+        path = str(tmpdir.join('empty.gz'))
+        _write(path, Compression('gzip', None), [])
+        with gzip.open(path, 'rb') as result:
+            assert result.read() == b''
+
+    def test_error(self, tmpdir):
+        path = str(tmpdir.join('failed.gz'))
+        with pytest.raises(RuntimeError):
+            with ParallelBlockWriter(path) as output:
+                output.write(DATA)
+                raise RuntimeError('the query failed')
+        assert tmpdir.listdir() == []
+
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError):
+            Compression.parse('zip:9')
@@ -0,0 +1,105 @@
+import json
+
+from datetime import date
+
+from commands.shared import export, sql_script, terms
+
+PREFERRED_TERMS = terms.TermDictionary.from_pairs(
+    [(30, 'Thirty'), (10, 'Ten, "10"'), (20, 'Zwanzig ü')])
+
+
+class TestTermDictionary:
+    def test_lookup(self):
+        assert len(PREFERRED_TERMS) == 3
+        assert PREFERRED_TERMS.lookup([20, 10, 15, None, 40, 30]) == [
+            'Zwanzig ü', 'Ten, "10"', None, None, None, 'Thirty']
+        assert PREFERRED_TERMS[30] == 'Thirty'
+
+    def test_empty(self):
+        assert terms.TermDictionary.from_pairs([]).lookup([1, 2]) == [
+            None, None]
+
+
+class TestExport:
+    def test_csv(self):
+        assert export.csv_lines([
+            [1, True, False, None, '', 'plain', 'a,b', 'say "hi"',
+             'two\nlines', date(2017, 1, 31)]]) == (
+            '1,t,f,,"",plain,"a,b","say ""hi""","two\nlines",2017-01-31\n')
+
+    def test_ndjson(self):
+        assert export.ndjson_lines(
+            ['id', 'term', 'date', 'none', 'flag'],
+            [(1, 'say "hi"\nü', date(2017, 1, 31), None, True)]) == (
+            '{"id":1,"term":"say \\"hi\\"\\nü","date":"2017-01-31",'
+            '"none":null,"flag":true}\n')
+
+    def test_named_rows(self):
+        table = export.Export('t', ['id AS component_id', 'module_id',
+                                    'module_name', 'order', 'value_id',
+                                    'value_name'])
+        assert table.names == ['component_id', 'module_id', 'module_name',
+                               'order', 'value_id', 'value_name']
+        assert table.query() == (
+            'SELECT "id" AS "component_id", "module_id", "order", '
+            '"value_id" FROM t')
+        assert export.named_rows(
+            table, [('a', 10, 1, 40), ('b', 30, 2, 20)], PREFERRED_TERMS) == [
+            ('a', 10, 'Ten, "10"', 1, 40, None),
+            ('b', 30, 'Thirty', 2, 20, 'Zwanzig ü')]
+
+    def test_ids_only(self):
+        table = export.Export('t', ['id', 'module_id', 'module_name'])
+        assert table.named
+        assert table.ids_only() == export.Export('t', ['id', 'module_id'])
+        assert not table.ids_only().named
+        normalized = export.NORMALIZED_EXPORTS['simple_reference_set']
+        assert normalized.query() == export.EXPORTS[
+            'simple_reference_set_expanded_view'].query()
+        assert list(export.NORMALIZED_EXPORTS)[-1] == (
+            'snomed_relationship_for_current_snapshot')
+
+    def test_copy_exports(self):
+        copies = export.copy_exports(sql_script.parse_script(
+            "COPY (SELECT 1) TO PROGRAM 'gzip > /opt/out/one.adjlist.gz' "
+            "CSV HEADER;\n"
+            "COPY (\n  SELECT (2)) TO '/opt/out/version_info' CSV HEADER;"))
+        assert list(copies) == ['one', 'version_info']
+        assert copies['one'] == export.CopyExport(
+            'SELECT 1', ' CSV HEADER', 'one.adjlist', True)
+        assert copies['one'].statement == (
+            'COPY (SELECT 1) TO STDOUT CSV HEADER')
+        assert copies['version_info'].statement == (
+            'COPY (\n  SELECT (2)) TO STDOUT CSV HEADER')
+        assert not copies['version_info'].compressed
+
+    def test_shards(self):
+        copy = export.CopyExport('SELECT 1 AS id', ' CSV HEADER',
+                                 'one.csv', True)
+        first = copy.shard('id', None, 10, 0)
+        assert first.file_name == 'one.shard000.csv'
+        assert first.statement == (
+            'COPY (SELECT * FROM (SELECT 1 AS id) AS shard '
+            'WHERE shard.id < 10) TO STDOUT CSV HEADER')
+        assert copy.shard('id', 10, 20, 1).query.endswith(
+            'WHERE shard.id >= 10 AND shard.id < 20')
+        assert copy.shard('id', None, None, 12).query.endswith('WHERE true')
+        documents = first.as_ndjson()
+        assert documents.file_name == 'one.shard000.ndjson'
+        assert documents.statement.startswith(
+            'COPY (SELECT row_to_json(document) FROM (SELECT * FROM')
+        assert copy.tabular and not copy._replace(
+            file_name='one.adjlist').tabular
+
+    def test_manifest(self, tmpdir):
+        shards = [export.Written('one.shard000.csv.gz', 2, 30, 'ab'),
+                  export.Written('one.shard001.csv.gz', 3, 40, 'cd')]
+        file_name = export.write_manifest(
+            str(tmpdir), 'one', 'id', [(None, 10), (10, None)], shards)
+        assert file_name == 'one.manifest.json'
+        assert tmpdir.listdir() == [tmpdir.join(file_name)]
+        manifest = json.loads(tmpdir.join(file_name).read())
+        assert manifest['rows'] == 5
+        assert manifest['shards'][1] == {
+            'file': 'one.shard001.csv.gz', 'first_id': 10, 'end_id': None,
+            'rows': 3, 'bytes': 40, 'sha256': 'cd'}
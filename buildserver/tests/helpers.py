@@ -0,0 +1 @@
+from commands.shared.validate import verhoeff_digit  # noqa
@@ -0,0 +1,45 @@
+import io
+
+from commands.shared import load_plan
+
+ROWS = [b'10\t20170131\t1\r\n', b'20\t20160731\t1\r\n',
+        b'30\t20180131\t0\r\n', b'40\t20170131\t1']
+
+
+class TestLoadPlan:
+    def test_iter_blocks(self):
+        blocks = list(load_plan.iter_blocks(io.BytesIO(b''.join(ROWS)), 5))
+        assert blocks == ROWS
+        blocks = list(load_plan.iter_blocks(io.BytesIO(b''.join(ROWS)), 20))
+        assert blocks == [ROWS[0] + ROWS[1], ROWS[2] + ROWS[3]]
+        assert list(load_plan.iter_blocks(io.BytesIO(b''), 5)) == []
+
+    def test_newer_rows(self):
+        blocks = [ROWS[0] + ROWS[1], ROWS[1], ROWS[2] + ROWS[3]]
+        assert list(load_plan.newer_rows(blocks, b'20170131')) == [ROWS[2]]
+        assert list(load_plan.newer_rows(blocks, b'20160731')) == [
+            ROWS[0], ROWS[2] + ROWS[3]]
+
+    def test_deal_blocks(self):
+        assert list(load_plan.deal_blocks('abcde', 3)) == [
+            (0, 'a'), (1, 'b'), (2, 'c'), (0, 'd'), (1, 'e')]
+        assert list(load_plan.deal_blocks('ab', 1)) == [(0, 'a'), (0, 'b')]
+
+    def test_file_parts(self):
+        assert load_plan.file_parts([], 4, big=False) == (1, [0])
+        assert load_plan.file_parts([], 4, big=True) == (4, [0, 1, 2, 3])
+        assert load_plan.file_parts([], 1, big=True) == (1, [0])
+        # A resumed file keeps its split, even if the budget changed
+        assert load_plan.file_parts([(0, 3), (2, 3)], 8, big=True) == (
+            3, [1])
+        assert load_plan.file_parts([(0, 1)], 4, big=True) == (1, [])
+
+    def test_table_is_loaded(self):
+        on_disk = {('a.txt', 10, 'crc_a'), ('b.txt', 20, 'crc_b')}
+        loaded = [('a.txt', 10, 'crc_a', 5), ('b.txt', 20, 'crc_b', 7)]
+        assert load_plan.table_is_loaded(12, loaded, on_disk)
+        assert load_plan.table_is_loaded(0, [], on_disk)
+        assert not load_plan.table_is_loaded(11, loaded, on_disk)
+        changed = [('a.txt', 10, 'crc_x', 5), ('b.txt', 20, 'crc_b', 7)]
+        assert not load_plan.table_is_loaded(12, changed, on_disk)
+        assert load_plan.table_is_loaded(12, changed, on_disk, delta=True)
@@ -0,0 +1,51 @@
+import pytest
+
+from commands.shared import lookup
+from commands.shared.lookup_reader import Concept, ConceptLookup, Description
+
+FSN = 900000000000003001
+SYNONYM = 900000000000013009
+CONCEPTS = [(30, True, 'Thirty', 'Thirty (number)'),
+            (10, True, 'Zehn ü', None),
+            (20, False, None, None)]
+DESCRIPTIONS = [(103, 30, SYNONYM, 'Thirty'),
+                (101, 10, SYNONYM, 'Zehn ü'),
+                (102, 30, FSN, 'Thirty (number)'),
+                (99, 40, SYNONYM, 'Not a concept')]
+
+
+def _lookup(folder, concepts, descriptions):
+    path = str(folder.join('lookup.bin'))
+    size = lookup.write_lookup(
+        lookup.build_lookup(concepts, descriptions), path)
+    assert folder.join('lookup.bin').size() == size
+    return ConceptLookup(path)
+
+
+class TestConceptLookup:
+    def test_lookup(self, tmpdir):
+        with _lookup(tmpdir, CONCEPTS, DESCRIPTIONS) as concepts:
+            assert len(concepts) == 3
+            assert 20 in concepts and 40 not in concepts
+            assert concepts.preferred_term(10) == 'Zehn ü'
+            assert concepts.fully_specified_name(10) is None
+            assert concepts.concept(30) == Concept(
+                30, True, 'Thirty', 'Thirty (number)', [
+                    Description(102, 30, FSN, 'Thirty (number)'),
+                    Description(103, 30, SYNONYM, 'Thirty')])
+            assert concepts.concept(20) == Concept(20, False, None, None, [])
+            assert concepts.description(101) == Description(
+                101, 10, SYNONYM, 'Zehn ü')
+            for missing in (concepts.description, concepts.preferred_term):
+                with pytest.raises(KeyError):
+                    missing(99)
+
+    def test_empty(self, tmpdir):
+        with _lookup(tmpdir, [], []) as concepts:
+            assert len(concepts) == 0 and 10 not in concepts
+
+    def test_not_a_lookup(self, tmpdir):
+        path = tmpdir.join('lookup.bin')
+        path.write_binary(b'SCTISA01' + b'\0' * 40)
+        with pytest.raises(ValueError):
+            ConceptLookup(str(path))
@@ -0,0 +1,45 @@
+import random
+
+from commands.shared import presnapshot
+
+
+def _row(component_id, effective_time, active):
+    return '{}\t{}\t{}\t900000000000207008\r\n'.format(
+        component_id, effective_time, active).encode('ascii')
+
+
+def _expected(rows, snapshot_date=None):
+    latest = {}
+    for row in rows:
+        component_id, effective_time = presnapshot._key(row)
+        if snapshot_date is not None and effective_time > snapshot_date:
+            continue
+        if effective_time > latest.get(component_id, (b'',))[0]:
+            latest[component_id] = (effective_time, row)
+    return sorted(row for _, row in latest.values())
+
+
+ROWS = [
+    _row(component_id, '20{:02d}0131'.format(year), year % 2)
+    for component_id in range(100000, 100500)
+    for year in random.Random(component_id).sample(range(2, 18), 4)
+]
+random.Random(1).shuffle(ROWS)
+BLOCKS = [b''.join(ROWS[start:start + 100])
+          for start in range(0, len(ROWS), 100)]
+
+
+class TestPresnapshot:
+
+    def test_in_memory(self):
+        assert list(presnapshot.latest_rows(BLOCKS)) == _expected(
+            ROWS)
+
+    def test_merged_runs(self):
+        assert list(presnapshot.latest_rows(
+            BLOCKS, memory_limit=1000)) == _expected(ROWS)
+
+    def test_snapshot_date(self):
+        assert list(presnapshot.latest_rows(
+            BLOCKS, snapshot_date=b'20100131', memory_limit=1000)
+        ) == _expected(ROWS, b'20100131')
@@ -0,0 +1,30 @@
+from datetime import date
+
+import pytest
+
+from commands.shared import snapshot, sql_script
+
+
+class TestSnapshot:
+    def test_script(self):
+        statements = sql_script.parse_script(snapshot.snapshot_script())
+        assert [statement.creates for statement in statements][:16] == list(
+            snapshot.SNAPSHOT_VIEWS)
+        assert len(statements) == 16 + len(snapshot.SNAPSHOT_INDEXES)
+
+    def test_snapshot_date(self):
+        for strategy in snapshot.STRATEGIES:
+            query = snapshot.snapshot_query(
+                'curr_concept_f', strategy, date(2017, 4, 1))
+            assert "effective_time <= DATE '2017-04-01'" in query
+            assert 'DATE' not in snapshot.snapshot_query(
+                'curr_concept_f', strategy)
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            snapshot.snapshot_query('curr_concept_f', 'nested_loop')
+
+    def test_distinct_on_ties(self):
+        query = snapshot.snapshot_query('curr_concept_f', 'distinct_on')
+        assert query.endswith(
+            'ORDER BY c.id, c.effective_time DESC, c.active DESC, c')
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import pytest
+
+from commands.shared import sql_script
+
+DENORMALIZATION_SCRIPT = os.path.join(
+    os.path.dirname(__file__), '..', 'sil_snomed_server', 'migrations', 'sql',
+    'denormalized_concepts_descriptions_refsets.sql')
+
+SCRIPT = """
+-- a comment; not a statement
+CREATE TABLE a (x text DEFAULT 'semi;colon');
+CREATE FUNCTION f() RETURNS bigint AS $body$
+  BEGIN
+    RETURN (SELECT count(*) FROM a); -- ends the body's statement only
+  END;
+$body$ LANGUAGE plpgsql;
+CREATE MATERIALIZED VIEW b AS SELECT f() AS "Count" /* ; */;
+CREATE INDEX b_count ON b ("Count");
+CREATE INDEX b_count_2 ON b ("Count");
+CREATE VIEW c AS SELECT * FROM b;
+CREATE VIEW d AS SELECT 1;
+INSERT INTO a VALUES ('x');
+CREATE VIEW e AS SELECT 1
+"""
+
+
+class TestSqlScript:
+    def test_parse(self):
+        statements = sql_script.parse_script(SCRIPT)
+        assert [statement.creates for statement in statements] == [
+            'a', 'f', 'b', 'b_count', 'b_count_2', 'c', 'd', None, 'e']
+        assert statements[0].text == (
+            "CREATE TABLE a (x text DEFAULT 'semi;colon')")
+        assert statements[1].line == 4
+        assert statements[1].text.endswith('$body$ LANGUAGE plpgsql')
+        assert statements[3].table == 'b'
+
+    def test_plan(self):
+        statements = sql_script.parse_script(SCRIPT)
+        waits = [sorted(statements[index].number for index in waiting)
+                 for waiting in sql_script.plan(statements)]
+        assert waits == [
+            [], [1], [2], [3], [3], [3, 4, 5], [], [1, 2, 3, 4, 5, 6, 7],
+            [8]]
+
+    def test_unterminated(self):
+        with pytest.raises(ValueError, match='line 1'):
+            sql_script.parse_script("SELECT 'x;\nSELECT 1;")
+
+    def test_view_query(self):
+        statements = sql_script.parse_script(SCRIPT)
+        assert sql_script.view_query(statements, 'c') == 'SELECT * FROM b'
+        with pytest.raises(ValueError):
+            sql_script.view_query(statements, 'a')
+
+    def test_denormalization_plan(self):
+        with open(DENORMALIZATION_SCRIPT, 'r') as script:
+            statements = sql_script.parse_script(script.read())
+        waits = sql_script.plan(statements)
+        creators = {statement.creates: index
+                    for index, statement in enumerate(statements)}
+        # The expanded views wait for the term views, not for each other
+        for relation in ('parents', 'children', 'ancestors', 'descendants'):
+            waiting = waits[creators['concept_expanded_' + relation]]
+            assert creators['concept_preferred_terms'] in waiting
+            assert creators['concept_fully_specified_names'] in waiting
+            assert creators['concept_subsumption'] not in waiting
+            assert not waiting & {creators['concept_expanded_' + other]
+                                  for other in ('parents', 'children')}
+
+    def test_qualified_names(self):
+        statements = sql_script.parse_script(
+            'CREATE TABLE public.a (x bigint);\n'
+            'CREATE INDEX a_x ON "public".a (x);\n'
+            'CREATE VIEW public.v AS SELECT a.x FROM public.a;')
+        assert [(statement.creates, statement.table)
+                for statement in statements] == [
+            ('a', None), ('a_x', 'a'), ('v', None)]
+        assert [sorted(waiting) for waiting in sql_script.plan(
+            statements)] == [[], [0], [0, 1]]
+
+    def test_session_statements(self):
+        statements = sql_script.parse_script(
+            'CREATE TABLE a (x bigint);\n'
+            "SET work_mem = '1GB';\n"
+            'CREATE TEMP TABLE t AS SELECT 1;\n'
+            'CREATE TABLE b (x bigint);\n'
+            'CREATE TABLE c (x bigint);')
+        assert [statement.session for statement in statements] == [
+            False, True, True, False, False]
+        assert [sorted(waiting) for waiting in sql_script.plan(
+            statements)] == [[], [0], [1], [2], [2]]
+
+    def test_session_script_runs_on_one_connection(self, monkeypatch):
+        threads = set()
+
+        def run(statement, name, stage, local, opened):
+            threads.add(threading.get_ident())
+            time.sleep(0.01)
+            return []
+        monkeypatch.setattr(sql_script, '_run_statement', run)
+        sql_script.run_statements(sql_script.parse_script(
+            "SET work_mem = '1GB';" + ''.join(
+                'CREATE VIEW v{} AS SELECT 1;'.format(number)
+                for number in range(8))), 'session.sql', workers=4)
+        assert len(threads) == 1
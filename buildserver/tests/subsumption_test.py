@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from commands.shared import closure, subsumption
+from commands.shared.subsumption_reader import SubsumptionIndex
+
+
+def _index(folder, children, parents):
+    children = np.array(children)
+    parents = np.array(parents)
+    subtypes, supertypes = closure.transitive_closure(children, parents)
+    path = str(folder.join('index.bin'))
+    subsumption.write_index(subsumption.build_index(
+        children, parents, subtypes, supertypes), path)
+    return path, set(zip(subtypes.tolist(), supertypes.tolist()))
+
+
+def _check(folder, children, parents):
+    path, pairs = _index(folder, children, parents)
+    concepts = sorted(set(children) | set(parents))
+    with SubsumptionIndex(path) as index:
+        assert len(index) == len(concepts)
+        for concept in concepts:
+            for ancestor in concepts:
+                assert index.is_a(concept, ancestor) == (
+                    (concept, ancestor) in pairs)
+
+
+class TestSubsumptionIndex:
+    def test_hierarchy(self, tmpdir):
+        # 40 has two parents, 20 and 30; 50 is below both 40 and 15
+        _check(tmpdir, [10, 15, 20, 30, 40, 40, 50, 50],
+               [1, 1, 10, 10, 20, 30, 40, 15])
+
+    def test_random_graph(self, tmpdir):
+        generator = np.random.RandomState(3)
+        children = list(range(2, 200))
+        parents = [int(generator.randint(1, child)) for child in children]
+        children += children[20:]
+        parents += [int(generator.randint(1, child))
+                    for child in children[20:198]]
+        _check(tmpdir, children, parents)
+
+    def test_unknown_concept(self, tmpdir):
+        path, _ = _index(tmpdir, [10], [1])
+        with SubsumptionIndex(path) as index:
+            assert 10 in index and 5 not in index
+            with pytest.raises(KeyError):
+                index.is_a(10, 5)
+
+    def test_cycle(self):
+        children = np.array([1, 2])
+        parents = np.array([2, 1])
+        subtypes, supertypes = closure.transitive_closure(children, parents)
+        with pytest.raises(ValueError):
+            subsumption.build_index(children, parents, subtypes, supertypes)
@@ -0,0 +1,46 @@
+import pytest
+
+from commands.shared import validate
+
+
+class TestCheckIds:
+    def test_valid_ids(self):
+        valid, reason = validate.check_ids(
+            [b'138875005', b'900000000000207008', b'404684003'],
+            validate.CONCEPT)
+        assert valid.all()
+        assert reason is None
+
+    def test_invalid_ids(self):
+        for value, reason in [
+                (b'138875006', 'bad check digit'),
+                (b'1388750x5', 'not a number'),
+                (b'0138875005', 'not an SCTID'),
+                (b'1234', 'not an SCTID')]:
+            assert validate.check_ids([value], validate.CONCEPT) == (
+                [False], reason)
+
+    def test_partition(self):
+        relationship = '10000' + '02'
+        relationship += validate.verhoeff_digit(relationship)
+        assert validate.check_ids([relationship], validate.RELATIONSHIP)[0]
+        assert validate.check_ids([relationship], validate.CONCEPT) == (
+            [False], 'wrong partition')
+
+    def test_check_blocks(self):
+        block = b'138875005\t1\r\n138875006\t1\r\n'
+        assert validate.check_blocks([block], {0: validate.CONCEPT}) == (
+            2, [validate.Problem(3, 0, b'138875006', 'bad check digit')])
+
+    def test_checked_blocks(self):
+        good = b'138875005\t1\r\n'
+        blocks = validate.checked_blocks([good, good], {0: validate.CONCEPT})
+        assert list(blocks) == [good, good]
+        blocks = validate.checked_blocks(
+            [good, b'138875006\t1\r\n', good], {0: validate.CONCEPT})
+        assert next(blocks) == good
+        with pytest.raises(ValueError) as error:
+            next(blocks)
+        assert "line 3 column 0 b'138875006'" in str(error.value)
+        assert validate.invalid_ids(str(error.value))
+        assert not validate.invalid_ids('Unable to read the file')
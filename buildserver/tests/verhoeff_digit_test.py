@@ -2,7 +2,7 @@ import pytest
 
 from . import helpers
 
-class VerhoeffTest:
+class TestVerhoeff:
     def test_verhoeff_check_digit(self):
         assert helpers.verhoeff_digit('123456654321') == '9'
         assert helpers.verhoeff_digit('1') == '5'